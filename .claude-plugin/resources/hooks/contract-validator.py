@@ -17,23 +17,85 @@ contract-validator.py - 全局契约校验 Hook 脚本
 使用说明:
 此脚本由 cc-wf-factory 生成，放置在用户工作流的 .claude/hooks/ 目录。
 需要配合 .claude/contracts/ 目录中的契约文件使用。
+
+编译校验器:
+    python3 contract-validator.py --compile [CONTRACT ...]
+把契约 Schema 编译为纯 Python 校验模块（.claude/contracts/.compiled/），
+校验时优先使用，Schema 修改后未重新编译则回退到 jsonschema（见 wf_schema_compiler.py）。
+
+Pydantic 契约:
+    pydantic_model: validators/task_model.py:TaskContract   # 相对契约目录的文件
+    pydantic_model: task_models:TaskContract                # 模块名（契约目录、validators/ 加入 sys.path）
+模型在进程内只导入一次，用缓存的 TypeAdapter 校验（pydantic 在用到时才导入）。
+
+校验结果缓存:
+同一输出常被重复校验（阻止后未修改、节点契约与工作流契约覆盖同一输出），
+结果按（数据哈希, 契约内容哈希, VALIDATOR_VERSION）缓存在 .context/cache/validations.json，
+命中时跳过全部校验层。校验脚本依赖外部数据时在契约中设置 `cache: false`。
+
+超时预算:
+Hook 超过配置的 timeout 会被直接终止，结果不确定。--hook-timeout（默认 30 秒，
+即生成的 Hook 配置中的 timeout，与其保持一致）减去余量作为本次事件的预算，契约加载、输出提取、
+各校验层依次计时，校验脚本的超时取剩余预算。预算用尽时按契约的 on_timeout 处理:
+    schema-only（默认）: Schema 照常校验，跳过 Pydantic 模型和校验脚本，通过时附带提示
+    allow: 跳过所有未执行的校验层，放行并附带提示
+    block: 阻止，提示校验未能在时限内完成
+
+重试上限:
+SubagentStop / Stop 校验未通过时阻止结束，Agent 修正后重试。阻止次数按（会话, 节点, agent）
+累计在 .context/contract-retries.json，每次阻止的提示附带此前各次的错误；超过
+--max-retries（契约中 max_retries 优先，默认 3）后不再阻止，放行并记为 exhausted，
+wf-state.py 在节点完成（或工作流结束）时将其标记为失败。
+
+输出骨架注入（--inject-skeleton）:
+PreToolUse (Task) 时按 subagent_type 读取 .claude/agents/{node}.md 的 output_contract，
+把契约 Schema 生成的输出骨架和关键约束追加到 Task prompt（updatedInput），
+子 Agent 开始工作前就知道输出结构，减少 SubagentStop 校验失败后的整轮重试（见 wf_skeleton.py）。
+修改 prompt 必须同时给出权限决定：--inject-skeleton（即 ask）由用户确认修改后的调用；
+--inject-skeleton allow 自动批准，会绕过 Task 的 ask / deny 权限规则，只在明确选择时使用。
 """
 
+import os
+import sys
+
+# 快速路径：不在工作流运行中的事件在导入其他模块前直接返回
+_STDIN_RAW = None
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from wf_active import read_stdin_or_exit
+    _STDIN_RAW = read_stdin_or_exit(cli_flags=("--compile",))
+
 import argparse
+import hashlib
+import importlib
+import importlib.util
 import json
-import os
+import re
 import subprocess
-import sys
+import time
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Any, NoReturn, Optional
 
+_IMPORTS_STARTED = time.perf_counter()
+
 # 确保可以从任意工作目录导入同目录下的模块
 sys.path.insert(0, str(Path(__file__).parent))
 from wf_output_extractor import extract_from_transcript
-
-
-# 日志配置
+from wf_metrics import get_metrics
+from wf_payload import load_payload
+from wf_profile import get_profiler
+from wf_record import record_event
+import wf_columnar
+from wf_schema_compiler import COMPILED_DIR, SchemaCompileError, compile_schema, error_details, load_compiled
+from wf_skeleton import build_skeleton, load_cached_skeleton, render_skeleton, store_skeleton
+from wf_store import ContractRetries, ValidationCache, canonical_hash
+from wf_trace import record_span
+from wf_validation_args import DEFAULT_MAX_RETRIES, SKELETON_PERMISSIONS, ValidationDeadline, add_validation_arguments
+
+
+# 日志配置（相对于项目目录；SDK 进程内运行时工作目录不一定是项目目录）
 LOG_FILE = Path(".context/contract-validator.log")
 
 
@@ -47,7 +109,8 @@ def log(level: str, message: str, **kwargs) -> None:
         **kwargs: 额外的结构化数据
     """
     try:
-        LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+        log_file = Path(os.environ.get("CLAUDE_PROJECT_DIR") or ".") / LOG_FILE
+        log_file.parent.mkdir(parents=True, exist_ok=True)
 
         timestamp = datetime.now().isoformat(timespec="milliseconds")
 
@@ -59,7 +122,7 @@ def log(level: str, message: str, **kwargs) -> None:
         if kwargs:
             entry["data"] = kwargs
 
-        with LOG_FILE.open("a", encoding="utf-8") as f:
+        with log_file.open("a", encoding="utf-8") as f:
             f.write(json.dumps(entry, ensure_ascii=False) + "\n")
     except Exception:
         pass
@@ -70,52 +133,290 @@ try:
 except ImportError:
     yaml = None
 
-try:
-    import jsonschema
-    from jsonschema import ValidationError, validate
-except ImportError:
-    jsonschema = None
-    validate = None
-    ValidationError = None
+_IMPORTS_DONE = time.perf_counter()
+
+_jsonschema: Any = None
+
+
+def get_jsonschema() -> Any:
+    """
+    按需导入 jsonschema（未安装时返回 False）
+
+    导入需要 30~45ms，而有编译校验器、按列校验的契约用不到它，只在回退到解释执行时才导入
+    """
+    global _jsonschema
+    if _jsonschema is None:
+        try:
+            import jsonschema
+            _jsonschema = jsonschema
+        except ImportError:
+            _jsonschema = False
+    return _jsonschema
+
+# 校验语义变化时递增，已缓存的校验结果随之失效
+VALIDATOR_VERSION = 1
+
+# 超时预算（Hook timeout 默认值与余量见 wf_validation_args）
+VALIDATOR_SCRIPT_TIMEOUT = 30.0  # 校验脚本的超时上限（秒）
+ON_TIMEOUT_POLICIES = ("schema-only", "allow", "block")
+
+# pydantic 模型缓存（进程级：wf-hook / wf_sdk_hooks / wf-batch 长驻进程中的多个 ContractValidator 共用）
+_PYDANTIC_ADAPTERS: dict[tuple[str, str], tuple[int, Any]] = {}  # {(模块, 类名): (mtime_ns, TypeAdapter)}
+
+
+def load_pydantic_adapter(contracts_dir: Path, model_ref: str) -> Any:
+    """
+    加载契约 pydantic_model 指向的模型并构建 TypeAdapter（按模块文件修改时间缓存）
+
+    Args:
+        model_ref: module:Class。module 以 .py 结尾或含路径分隔符时按相对契约目录的
+            文件加载，否则按模块名导入
+
+    Raises:
+        ValueError / ImportError / AttributeError: 格式错误或模型无法加载
+    """
+    from pydantic import TypeAdapter
+
+    module_ref, sep, class_name = model_ref.rpartition(":")
+    if not sep or not module_ref or not class_name:
+        raise ValueError(f"pydantic_model 格式应为 module:Class，实际为 {model_ref!r}")
+
+    if module_ref.endswith(".py") or "/" in module_ref:
+        module_file = (contracts_dir / module_ref).resolve()
+        key = (str(module_file), class_name)
+        mtime_ns = module_file.stat().st_mtime_ns
+        cached = _PYDANTIC_ADAPTERS.get(key)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        module_name = "wf_contract_model_" + re.sub(r"\W", "_", module_file.stem)
+        spec = importlib.util.spec_from_file_location(module_name, module_file)
+        if spec is None or spec.loader is None:
+            raise ImportError(f"无法加载模块文件: {module_file}")
+        module = importlib.util.module_from_spec(spec)
+        # 注册到 sys.modules，pydantic 解析前向引用时按 __module__ 查找
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    else:
+        key = (module_ref, class_name)
+        cached = _PYDANTIC_ADAPTERS.get(key)
+        if cached:
+            return cached[1]
+        for path in (contracts_dir, contracts_dir / "validators"):
+            if str(path) not in sys.path:
+                sys.path.append(str(path))
+        mtime_ns = 0
+        module = importlib.import_module(module_ref)
+
+    adapter = TypeAdapter(getattr(module, class_name))
+    _PYDANTIC_ADAPTERS[key] = (mtime_ns, adapter)
+    return adapter
 
 
 class ContractValidator:
     """契约校验器"""
 
-    def __init__(self, contracts_dir: Path):
+    def __init__(self, contracts_dir: Path, result_cache: bool = True):
+        """
+        Args:
+            result_cache: 启用校验结果缓存（项目 .context/cache/validations.json）
+        """
         self.contracts_dir = contracts_dir
+        self._contracts: dict[Path, tuple[int, Any]] = {}  # {契约文件: (mtime_ns, 契约)}
+        self._compiled: dict[str, tuple[Any, Any]] = {}  # {契约名: (Schema, 编译模块或 None)}
+        self._columnar: dict[int, tuple[Any, Any]] = {}  # {id(Schema): (Schema, (同构数组, 剩余 Schema) 或 None)}
+        self._file_digests: dict[Path, tuple[tuple[int, int], str]] = {}  # {文件: ((mtime_ns, size), sha256)}
+        self._node_contracts: dict[Path, tuple[int, Optional[str]]] = {}  # {agent 文件: (mtime_ns, 输出契约名)}
+        self._skeletons: dict[str, tuple[Any, str]] = {}  # {契约名: (Schema, 注入文本)}
+        self.result_cache = (
+            ValidationCache(contracts_dir.parent.parent / ".context" / "cache") if result_cache else None
+        )
+        self.retries = ContractRetries(contracts_dir.parent.parent / ".context")
 
     def load_contract(self, contract_name: str) -> Optional[dict]:
-        """加载契约文件"""
-        yaml_file = self.contracts_dir / f"{contract_name}.yaml"
-        if yaml_file.exists():
-            content = yaml_file.read_text(encoding="utf-8")
-            if yaml:
-                return yaml.safe_load(content)
+        """加载契约文件（同一实例内按修改时间缓存，长驻进程中契约更新后自动重新加载）"""
+        with get_profiler().phase("load_contract"):
+            for suffix in (".yaml", ".json"):
+                contract_file = self.contracts_dir / f"{contract_name}{suffix}"
+                try:
+                    mtime_ns = contract_file.stat().st_mtime_ns
+                except OSError:
+                    continue
+
+                cached = self._contracts.get(contract_file)
+                if cached and cached[0] == mtime_ns:
+                    return cached[1]
+
+                content = contract_file.read_text(encoding="utf-8")
+                if suffix == ".json":
+                    contract = json.loads(content)
+                elif yaml:
+                    contract = yaml.safe_load(content)
+                else:
+                    return None
+                self._contracts[contract_file] = (mtime_ns, contract)
+                return contract
+
             return None
 
-        json_file = self.contracts_dir / f"{contract_name}.json"
-        if json_file.exists():
-            content = json_file.read_text(encoding="utf-8")
-            return json.loads(content)
+    def find_node_contract(self, node_name: str) -> Optional[str]:
+        """节点的输出契约（.claude/agents/{node}.md frontmatter 中的 output_contract）"""
+        agent_file = self.contracts_dir.parent / "agents" / f"{node_name}.md"
+        try:
+            mtime_ns = agent_file.stat().st_mtime_ns
+        except OSError:
+            return None
+        cached = self._node_contracts.get(agent_file)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+
+        contract_name = None
+        content = agent_file.read_text(encoding="utf-8")
+        if content.startswith("---"):
+            frontmatter = content[3:].partition("\n---")[0]
+            match = re.search(r"^output_contract:\s*[\"']?([\w.-]+)", frontmatter, re.MULTILINE)
+            if match:
+                contract_name = match.group(1)
+        self._node_contracts[agent_file] = (mtime_ns, contract_name)
+        return contract_name
+
+    def skeleton_text(self, contract_name: str, schema: Any) -> str:
+        """契约的输出骨架注入文本（进程内缓存，并按 Schema 哈希缓存在 .context/cache/skeletons/）"""
+        cached = self._skeletons.get(contract_name)
+        if cached and cached[0] == schema:
+            return cached[1]
+
+        cache_dir = self.contracts_dir.parent.parent / ".context" / "cache" / "skeletons"
+        with get_profiler().phase("skeleton"):
+            skeleton = load_cached_skeleton(cache_dir, schema)
+            if skeleton is None:
+                skeleton = build_skeleton(schema)
+                try:
+                    store_skeleton(cache_dir, schema, skeleton)
+                except OSError as e:
+                    log("WARN", "骨架缓存写入失败", contract=contract_name, error=str(e))
+        text = render_skeleton(contract_name, skeleton)
+        self._skeletons[contract_name] = (schema, text)
+        return text
+
+    def _file_digest(self, relative_path: str) -> str:
+        """契约目录下文件的内容哈希（按修改时间和大小缓存）"""
+        file_path = self.contracts_dir / relative_path
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return "-"
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_digests.get(file_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256(file_path.read_bytes()).hexdigest()
+        self._file_digests[file_path] = (signature, digest)
+        return digest
+
+    def contract_digest(self, contract: dict) -> str:
+        """契约内容哈希（包含校验脚本和 pydantic 模型文件，修改后缓存的校验结果自动失效）"""
+        parts = [canonical_hash(contract)]
+        if contract.get("validator_script"):
+            parts.append(self._file_digest(contract["validator_script"]))
+        model_ref = contract.get("pydantic_model")
+        if isinstance(model_ref, str):
+            module_ref = model_ref.rpartition(":")[0]
+            if module_ref.endswith(".py") or "/" in module_ref:
+                parts.append(self._file_digest(module_ref))
+        return ":".join(parts)
+
+    def load_compiled(self, contract_name: str, schema: Any) -> Optional[Any]:
+        """
+        加载契约的编译校验器（按契约名缓存，Schema 对象随契约文件更新时重新检查）
 
-        return None
+        Returns:
+            编译模块；不存在、与当前 Schema 不一致或加载失败时返回 None
+        """
+        cached = self._compiled.get(contract_name)
+        if cached and cached[0] is schema:
+            return cached[1]
+
+        module = None
+        compiled_file = self.contracts_dir / COMPILED_DIR / f"{contract_name}.py"
+        if compiled_file.exists():
+            try:
+                with get_profiler().phase("load_compiled"):
+                    module = load_compiled(compiled_file, schema)
+                if module is None:
+                    log("WARN", "编译校验器与契约 Schema 不一致，使用 jsonschema 校验"
+                        "（请重新执行 --compile）", contract=contract_name)
+            except Exception as e:
+                log("WARN", "编译校验器加载失败，使用 jsonschema 校验",
+                    contract=contract_name, error=str(e))
+        self._compiled[contract_name] = (schema, module)
+        return module
+
+    def columnar_plan(self, schema: Any) -> Optional[tuple[list, dict]]:
+        """Schema 中标记了 x-columnar 的数组及剩余 Schema（按 Schema 对象缓存，无标记时为 None）"""
+        cached = self._columnar.get(id(schema))
+        if cached and cached[0] is schema:
+            return cached[1]
+        targets = wf_columnar.find_targets(schema)
+        plan = (targets, wf_columnar.residual_schema(schema, targets)) if targets else None
+        self._columnar[id(schema)] = (schema, plan)
+        return plan
+
+    def validate_columnar(
+        self, data: Any, plan: tuple[list, dict]
+    ) -> tuple[bool, list[dict]]:
+        """同构数组按列校验，数组之外的部分用剩余 Schema 校验（见 wf_columnar.py）"""
+        targets, residual = plan
+        errors: list[dict] = []
+        started_ts = time.time()
+        with get_profiler().phase("validate_columnar"):
+            for target in targets:
+                array = wf_columnar.lookup(data, target.path)
+                if isinstance(array, list):
+                    errors.extend(wf_columnar.validate_array(target, array))
+        record_span(
+            "validate_columnar", "validation", started_ts, time.time(),
+            script="contract-validator", arrays=len(targets), errors=len(errors),
+        )
+        _, residual_errors = self.validate_schema(data, residual)
+        errors = residual_errors + errors
+        return not errors, errors
 
-    def validate_schema(self, data: Any, schema: dict) -> tuple[bool, list[dict]]:
+    def validate_schema(
+        self, data: Any, schema: dict, contract_name: Optional[str] = None
+    ) -> tuple[bool, list[dict]]:
         """
-        JSON Schema 结构校验
+        JSON Schema 结构校验（契约有编译校验器时直接调用，否则由 jsonschema 解释执行；
+        标记为 x-columnar 的同构数组按列校验）
 
         Returns:
             (is_valid, errors)
         """
-        if jsonschema is None or validate is None or ValidationError is None:
+        plan = self.columnar_plan(schema)
+        if plan is not None:
+            return self.validate_columnar(data, plan)
+
+        compiled = self.load_compiled(contract_name, schema) if contract_name else None
+        if compiled is not None:
+            started_ts = time.time()
+            with get_profiler().phase("validate_compiled"):
+                errors = error_details(compiled.collect_errors(data))
+            record_span(
+                "validate_schema", "validation", started_ts, time.time(),
+                script="contract-validator", errors=len(errors), compiled=True,
+            )
+            return not errors, errors
+
+        jsonschema = get_jsonschema()
+        if not jsonschema:
             return True, []
 
         errors: list[dict] = []
+        started_ts = time.time()
         try:
-            validate(instance=data, schema=schema)
+            with get_profiler().phase("validate_schema"):
+                jsonschema.validate(instance=data, schema=schema)
             return True, []
-        except ValidationError as e:
+        except jsonschema.ValidationError as e:
             schema_dict = e.schema if isinstance(e.schema, dict) else {}
             error_detail = {
                 "field": ".".join(str(p) for p in e.absolute_path) or "(root)",
@@ -139,9 +440,64 @@ class ContractValidator:
                 errors.append(sub_detail)
 
             return False, errors
+        finally:
+            record_span(
+                "validate_schema", "validation", started_ts, time.time(),
+                script="contract-validator", errors=len(errors),
+            )
+
+    def validate_pydantic(self, data: Any, model_ref: str) -> tuple[bool, list[dict]]:
+        """
+        Pydantic 模型校验（契约 pydantic_model 字段）
+
+        错误映射为与 Schema 校验相同的格式：field 为 loc 路径，expected 为 pydantic 错误类型
+        （如 missing、string_type），actual 为输入值类型，message 为 pydantic 错误消息
+
+        Returns:
+            (is_valid, errors)
+        """
+        try:
+            import pydantic
+        except ImportError:
+            log("WARN", "未安装 pydantic，跳过 pydantic_model 校验", model=model_ref)
+            return True, []
+
+        errors: list[dict] = []
+        started_ts = time.time()
+        try:
+            try:
+                with get_profiler().phase("load_pydantic"):
+                    adapter = load_pydantic_adapter(self.contracts_dir, model_ref)
+            except Exception as e:
+                errors = [{"message": f"pydantic 模型加载失败 ({model_ref}): {e}", "transient": True}]
+                return False, errors
+
+            try:
+                with get_profiler().phase("validate_pydantic"):
+                    adapter.validate_python(data)
+                return True, []
+            except pydantic.ValidationError as e:
+                errors = [
+                    {
+                        "field": ".".join(str(p) for p in error["loc"]) or "(root)",
+                        "expected": error["type"],
+                        "actual": str(type(error.get("input")).__name__),
+                        "message": error["msg"],
+                    }
+                    for error in e.errors(include_url=False)
+                ]
+                return False, errors
+            except Exception as e:
+                errors = [{"message": f"pydantic 校验异常 ({model_ref}): {e}", "transient": True}]
+                return False, errors
+        finally:
+            record_span(
+                "validate_pydantic", "validation", started_ts, time.time(),
+                script="contract-validator", model=model_ref, errors=len(errors),
+            )
 
     def run_validator_script(
-        self, script_path: str, data: Any
+        self, script_path: str, data: Any, timeout: float = VALIDATOR_SCRIPT_TIMEOUT
     ) -> tuple[bool, list[dict]]:
         """
         执行自定义校验脚本
@@ -149,31 +505,48 @@ class ContractValidator:
         脚本接收 JSON 数据作为 stdin，输出 JSON 结果到 stdout:
         - 通过: {"valid": true}
         - 失败: {"valid": false, "errors": [...]}
+
+        脚本自身执行失败（退出码非 0、超时、异常）的错误带 transient 标记，不写入结果缓存
+
+        Args:
+            timeout: 超时秒数（由调用方按剩余预算给出）
         """
         full_path = self.contracts_dir / script_path
         if not full_path.exists():
             return True, []
 
+        started = time.perf_counter()
+        started_ts = time.time()
         try:
-            result = subprocess.run(
-                ["python", str(full_path)],
-                input=json.dumps(data),
-                capture_output=True,
-                text=True,
-                timeout=30,
-            )
+            with get_profiler().phase("validator_script"):
+                result = subprocess.run(
+                    ["python", str(full_path)],
+                    input=json.dumps(data),
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                )
 
             if result.returncode != 0:
-                return False, [{"message": f"校验脚本执行失败: {result.stderr}"}]
+                return False, [{"message": f"校验脚本执行失败: {result.stderr}", "transient": True}]
 
             output = json.loads(result.stdout)
             if output.get("valid", True):
                 return True, []
             return False, output.get("errors", [{"message": "自定义校验失败"}])
         except subprocess.TimeoutExpired:
-            return False, [{"message": "校验脚本执行超时"}]
+            return False, [{"message": "校验脚本执行超时", "transient": True}]
         except Exception as e:
-            return False, [{"message": f"校验脚本执行异常: {str(e)}"}]
+            return False, [{"message": f"校验脚本执行异常: {str(e)}", "transient": True}]
+        finally:
+            elapsed = time.perf_counter() - started
+            get_metrics().observe(
+                "wf_validator_script_duration_seconds", elapsed, {"script": script_path}
+            )
+            record_span(
+                f"validator_script:{script_path}", "validation", started_ts, started_ts + elapsed,
+                script="contract-validator",
+            )
 
 
 def find_contracts_dir() -> Path:
@@ -192,6 +565,14 @@ def find_contracts_dir() -> Path:
     return Path(project_dir or cwd) / ".claude" / "contracts"
 
 
+def record_validation(event: str, contract_name: str, result: str) -> None:
+    """记录契约校验结果指标（passed / failed / error / exhausted）"""
+    get_metrics().inc(
+        "wf_contract_validations_total",
+        {"event": event, "contract": contract_name or "-", "result": result},
+    )
+
+
 def generate_suggestion(errors: list[dict]) -> str:
     """生成修复建议"""
     if not errors:
@@ -230,29 +611,264 @@ def format_error_message(
     )
 
 
-def block_with_exit(message: str) -> NoReturn:
+def get_deadline(shared: Optional[dict]) -> ValidationDeadline:
+    """取出本次事件的超时预算（dispatch_event 写入 shared；直接调用处理函数时不限时）"""
+    deadline = (shared or {}).get("deadline")
+    return deadline if deadline is not None else ValidationDeadline(float("inf"))
+
+
+@dataclass
+class HookOutcome:
+    """Hook 处理结果（由 emit_outcome 统一输出，wf-hook.py 可与状态更新结果合并）"""
+    action: str  # continue / block_exit / block_json
+    message: str = ""
+    hook_output: Optional[dict] = None  # continue 时附带的 hookSpecificOutput
+
+
+def block_with_exit(message: str) -> HookOutcome:
     """使用 exit(2) 阻止执行 (UserPromptSubmit/PreToolUse)"""
-    print(message, file=sys.stderr)
-    sys.exit(2)
+    return HookOutcome("block_exit", message)
 
 
-def block_with_json(reason: str) -> NoReturn:
+def block_with_json(reason: str) -> HookOutcome:
     """使用 JSON 阻止结束 (SubagentStop/Stop)"""
-    result = {"decision": "block", "reason": reason}
-    print(json.dumps(result))
-    sys.exit(0)
+    return HookOutcome("block_json", reason)
 
 
-def allow_continue(message: str = "") -> NoReturn:
+def allow_continue(message: str = "", hook_output: Optional[dict] = None) -> HookOutcome:
     """允许继续执行"""
-    if message:
-        result = {"continue": True, "systemMessage": message}
-    else:
-        result = {"continue": True}
+    return HookOutcome("continue", message, hook_output)
+
+
+def emit_outcome(outcome: HookOutcome) -> NoReturn:
+    """按 Hook 协议输出结果并退出"""
+    if outcome.action == "block_exit":
+        print(outcome.message, file=sys.stderr)
+        sys.exit(2)
+    if outcome.action == "block_json":
+        print(json.dumps({"decision": "block", "reason": outcome.message}))
+        sys.exit(0)
+    result: dict[str, Any] = {"continue": True}
+    if outcome.message:
+        result["systemMessage"] = outcome.message
+    if outcome.hook_output:
+        result["hookSpecificOutput"] = outcome.hook_output
     print(json.dumps(result))
     sys.exit(0)
 
 
+def get_max_retries(contract: dict, args: argparse.Namespace) -> int:
+    """重试上限（契约 max_retries 优先，其次 --max-retries）"""
+    value = contract.get("max_retries", getattr(args, "max_retries", DEFAULT_MAX_RETRIES))
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_RETRIES
+
+
+def format_retry_feedback(message: str, errors: list[dict], entry: dict, max_retries: int) -> str:
+    """
+    在阻止提示中附加重试进度
+
+    第二次起列出本次全部错误和此前各次的错误，最后一次机会时明确告知再失败的后果
+    """
+    attempts = entry["attempts"]
+    lines = [message, f"重试: {attempts}/{max_retries}"]
+    if attempts > 1:
+        if len(errors) > 3:
+            lines.append("本次全部错误:")
+            lines.extend(
+                f"- {error.get('field', '(root)')}: {error.get('message', '')[:200]}" for error in errors
+            )
+        lines.append("此前各次未通过的错误:")
+        for item in entry.get("errors", [])[:-1]:
+            summary = "; ".join(error.get("message", "")[:100] for error in item["errors"])
+            lines.append(f"- 第 {item['attempt']} 次: {summary}")
+        lines.append("请对照契约一次修正全部错误，不要只修复第一条。")
+    if attempts == max_retries:
+        lines.append("这是最后一次重试机会，再次未通过时将被标记为失败。")
+    return "\n".join(lines)
+
+
+def block_within_retry_budget(
+    validator: "ContractValidator",
+    input_data: dict,
+    event: str,
+    node: str,
+    contract_name: str,
+    max_retries: int,
+    errors: list[dict],
+    message: str,
+) -> HookOutcome:
+    """
+    SubagentStop / Stop 校验未通过：在重试上限内阻止结束，超过上限后放行并记为 exhausted
+
+    计数读写失败时照常阻止（不影响校验结论）
+    """
+    agent = input_data.get("agent_id") or input_data.get("agent_transcript_path")
+    try:
+        entry = validator.retries.record_failure(
+            input_data.get("session_id"), node, agent, contract_name, errors, max_retries,
+        )
+    except Exception as e:
+        log("WARN", "重试计数不可用", node=node, contract=contract_name, error=str(e))
+        return block_with_json(message)
+
+    if entry["status"] != "exhausted":
+        return block_with_json(format_retry_feedback(message, errors, entry, max_retries))
+
+    log("ERROR", f"{event} 重试次数耗尽，节点标记为失败",
+        node=node, contract=contract_name, attempts=entry["attempts"], max_retries=max_retries)
+    record_validation(event, contract_name, "exhausted")
+    get_metrics().inc("wf_contract_retries_exhausted_total", {"event": event, "contract": contract_name or "-"})
+    target = "工作流输出" if node == ContractRetries.WORKFLOW else f"节点 '{node}' 输出"
+    return allow_continue(
+        f"contract-validator: {target}已重试 {max_retries} 次仍未通过契约 '{contract_name}'，"
+        f"不再阻止，标记为失败"
+    )
+
+
+def clear_retries(validator: "ContractValidator", input_data: dict, node: str) -> None:
+    """校验通过后清除重试计数"""
+    agent = input_data.get("agent_id") or input_data.get("agent_transcript_path")
+    try:
+        validator.retries.clear(input_data.get("session_id"), node, agent)
+    except Exception as e:
+        log("WARN", "重试计数不可用", node=node, error=str(e))
+
+
+def validate_contract_data(
+    validator: ContractValidator,
+    contract: dict,
+    data: Any,
+    contract_name: Optional[str] = None,
+    deadline: Optional[ValidationDeadline] = None,
+) -> list[dict]:
+    """
+    按契约校验数据（命中校验结果缓存时直接返回缓存的结论）
+
+    缓存读写失败不影响校验；含 transient 错误（校验脚本执行失败等）和因超时
+    未完成的结果不缓存
+    """
+    cache_key = None
+    if validator.result_cache is not None and contract.get("cache", True):
+        try:
+            with get_profiler().phase("result_cache"):
+                cache_key = hashlib.sha256(
+                    f"{VALIDATOR_VERSION}:{validator.contract_digest(contract)}:{canonical_hash(data)}"
+                    .encode("utf-8")
+                ).hexdigest()
+                cached = validator.result_cache.lookup(cache_key)
+            hit = cached is not None
+            log("DEBUG", "校验结果缓存命中" if hit else "校验结果缓存未命中",
+                contract=contract_name, key=cache_key[:12])
+            get_metrics().inc(
+                "wf_validation_cache_total",
+                {"contract": contract_name or "-", "result": "hit" if hit else "miss"},
+            )
+            if hit:
+                return cached
+        except Exception as e:
+            log("WARN", "校验结果缓存不可用", contract=contract_name, error=str(e))
+            cache_key = None
+
+    all_errors = run_contract_layers(validator, contract, data, contract_name, deadline)
+
+    if deadline is not None and deadline.skipped:
+        outcome = "blocked" if all_errors else "allowed"
+        log("WARN", "契约校验超出 Hook 超时预算",
+            contract=contract_name, policy=deadline.policy, skipped=deadline.skipped,
+            outcome=outcome, budget=round(deadline.budget, 3), phases=deadline.phases)
+        get_metrics().inc(
+            "wf_validation_deadline_total",
+            {"contract": contract_name or "-", "policy": deadline.policy or "-", "outcome": outcome},
+        )
+        return all_errors
+
+    if cache_key and not any(error.get("transient") for error in all_errors):
+        try:
+            validator.result_cache.store(cache_key, contract_name or "-", all_errors)
+        except Exception as e:
+            log("WARN", "校验结果缓存写入失败", contract=contract_name, error=str(e))
+    return all_errors
+
+
+def get_timeout_policy(contract: dict, contract_name: Optional[str] = None) -> str:
+    """契约的 on_timeout 策略（未设置或无效时为 schema-only）"""
+    policy = contract.get("on_timeout", "schema-only")
+    if policy not in ON_TIMEOUT_POLICIES:
+        log("WARN", "无效的 on_timeout，按 schema-only 处理", contract=contract_name, on_timeout=policy)
+        return "schema-only"
+    return policy
+
+
+def run_contract_layers(
+    validator: ContractValidator,
+    contract: dict,
+    data: Any,
+    contract_name: Optional[str] = None,
+    deadline: Optional[ValidationDeadline] = None,
+) -> list[dict]:
+    """
+    按契约校验数据：先 Schema，通过后依次执行 Pydantic 模型和自定义校验脚本
+
+    预算用尽后不再启动新的校验层（schema-only 策略下 Schema 仍然校验）；
+    校验脚本的超时取剩余预算，因此超时的脚本同样视为未完成。
+    block 策略下存在未完成的校验层时返回一条 transient 错误
+    """
+    if deadline is None:
+        deadline = ValidationDeadline(float("inf"))
+    policy = get_timeout_policy(contract, contract_name)
+
+    layers = [
+        ("schema", contract.get("schema"),
+         lambda schema: validator.validate_schema(data, schema, contract_name)),
+        ("pydantic_model", contract.get("pydantic_model"),
+         lambda model_ref: validator.validate_pydantic(data, model_ref)),
+        ("validator_script", contract.get("validator_script"),
+         lambda script: validator.run_validator_script(
+             script, data, min(VALIDATOR_SCRIPT_TIMEOUT, max(deadline.remaining(), 0.0)))),
+    ]
+
+    all_errors: list[dict] = []
+    for layer, spec, run_layer in layers:
+        if not spec or all_errors:
+            continue
+        if deadline.expired() and not (layer == "schema" and policy == "schema-only"):
+            deadline.skipped.append(layer)
+            continue
+
+        is_valid, errors = run_layer(spec)
+        deadline.mark(layer)
+        if not is_valid and deadline.expired() and all(error.get("transient") for error in errors):
+            # 预算内未能完成（校验脚本被超时终止等），按未执行处理
+            deadline.skipped.append(layer)
+            continue
+        if not is_valid:
+            all_errors.extend(errors)
+
+    if deadline.skipped:
+        deadline.policy = policy
+        if policy == "block" and not all_errors:
+            all_errors.append({
+                "message": (
+                    f"契约校验未能在 Hook 超时预算（{deadline.hook_timeout:g} 秒）内完成，"
+                    f"未完成: {', '.join(deadline.skipped)}"
+                ),
+                "transient": True,
+            })
+    return all_errors
+
+
+def extract_output(transcript_path: str, shared: Optional[dict] = None):
+    """从 transcript 提取输出（同一进程内按路径复用提取结果）"""
+    cache = shared.setdefault("extractions", {}) if shared is not None else {}
+    if transcript_path not in cache:
+        with get_profiler().phase("extract"):
+            cache[transcript_path] = extract_from_transcript(transcript_path)
+    return cache[transcript_path]
+
+
 def check_workflow_match(prompt: str, workflow_name: str) -> bool:
     """
     检查 prompt 是否匹配工作流命令
@@ -275,11 +891,14 @@ def handle_user_prompt_submit(
     input_data: dict,
     validator: ContractValidator,
     args: argparse.Namespace,
-) -> None:
+    shared: Optional[dict] = None,
+) -> HookOutcome:
     """
     处理 UserPromptSubmit 事件
 
-    从 .context/params.json 读取工作流参数并校验输入契约
+    校验工作流参数是否符合输入契约。参数优先取自同一进程中 wf-state
+    刚解析出的结果（shared["params"]，wf-hook.py 合并运行时），
+    否则从 .context/params.json 读取。
     """
     workflow_name = args.workflow or ""
     contract_name = args.contract or ""
@@ -290,70 +909,68 @@ def handle_user_prompt_submit(
         # 不匹配则跳过
         log("DEBUG", "UserPromptSubmit: prompt 不匹配工作流",
             workflow=workflow_name, prompt=prompt[:50])
-        allow_continue()
+        return allow_continue()
 
     # 如果没有指定契约，跳过校验
     if not contract_name:
         log("DEBUG", "UserPromptSubmit: 未指定输入契约，跳过校验")
-        allow_continue()
+        return allow_continue()
 
     # 加载契约
+    deadline = get_deadline(shared)
     contract = validator.load_contract(contract_name)
+    deadline.mark("load_contract")
     if not contract:
         # 契约不存在，报错
-        block_with_exit(f"contract-validator: 未找到输入契约 '{contract_name}'")
-
-    # 从 .context/params.json 读取参数
-    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "")
-    params_path = Path(project_dir or ".") / ".context" / "params.json"
-
-    if not params_path.exists():
-        # 参数文件不存在，可能是 wf-state.py 尚未写入
-        # 这不应该发生，因为 wf-state.py 应该先执行
-        block_with_exit(
-            f"contract-validator: 参数文件不存在 ({params_path})。"
-            "请确保 wf-state.py 在 contract-validator.py 之前执行。"
-        )
+        return block_with_exit(f"contract-validator: 未找到输入契约 '{contract_name}'")
+
+    params_data = (shared or {}).get("params")
+    if params_data is None:
+        # 从 .context/params.json 读取参数
+        project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "")
+        params_path = Path(project_dir or ".") / ".context" / "params.json"
+
+        if not params_path.exists():
+            # 参数文件不存在，可能是 wf-state.py 尚未写入
+            # 这不应该发生，因为 wf-state.py 应该先执行
+            return block_with_exit(
+                f"contract-validator: 参数文件不存在 ({params_path})。"
+                "请确保 wf-state.py 在 contract-validator.py 之前执行，或改用 wf-hook.py。"
+            )
 
-    try:
-        params_data = json.loads(params_path.read_text(encoding="utf-8"))
-    except Exception as e:
-        block_with_exit(f"contract-validator: 无法读取参数文件: {e}")
+        try:
+            with get_profiler().phase("read_params"):
+                params_data = json.loads(params_path.read_text(encoding="utf-8"))
+        except Exception as e:
+            return block_with_exit(f"contract-validator: 无法读取参数文件: {e}")
 
     # 执行校验
-    all_errors: list[dict] = []
-
-    # Schema 校验
-    schema = contract.get("schema")
-    if schema:
-        is_valid, errors = validator.validate_schema(params_data, schema)
-        if not is_valid:
-            all_errors.extend(errors)
-
-    # 自定义校验脚本
-    validator_script = contract.get("validator_script")
-    if validator_script and not all_errors:
-        is_valid, errors = validator.run_validator_script(validator_script, params_data)
-        if not is_valid:
-            all_errors.extend(errors)
+    all_errors = validate_contract_data(validator, contract, params_data, contract_name, deadline)
 
     if all_errors:
         log("ERROR", "UserPromptSubmit 校验失败",
             workflow=workflow_name, contract=contract_name, errors=all_errors)
+        record_validation("UserPromptSubmit", contract_name, "failed")
         error_msg = format_error_message(
             workflow_name or "workflow", contract_name, all_errors, "输入"
         )
-        block_with_exit(error_msg)
+        return block_with_exit(error_msg)
     else:
         log("INFO", "UserPromptSubmit 校验通过",
             workflow=workflow_name, contract=contract_name)
-        allow_continue(f"contract-validator: 工作流输入校验通过")
+        record_validation("UserPromptSubmit", contract_name, "passed")
+        return allow_continue(f"contract-validator: 工作流输入校验通过{deadline.note()}")
+
+
+# 注入文本的开头，Task prompt 中已包含时不重复注入
+SKELETON_MARKER = "[contract-validator] 输出契约"
 
 
 def handle_pre_tool_use(
-    input_data: dict,  # noqa: ARG001  # 保留用于将来扩展
-    validator: ContractValidator,  # noqa: ARG001  # 保留用于将来扩展
-) -> None:
+    input_data: dict,
+    validator: ContractValidator,
+    args: argparse.Namespace,
+) -> HookOutcome:
     """
     处理 PreToolUse 事件
 
@@ -361,56 +978,96 @@ def handle_pre_tool_use(
     - 节点输入 = 前序节点输出（已通过 SubagentStop 校验）
     - 节点输入校验是冗余的
     详见需求文档 3.1 校验设计理念
+
+    指定 --inject-skeleton 时，把节点输出契约的骨架追加到 Task prompt。
+    PreToolUse 的 additionalContext 只进入编排会话，子 Agent 看不到，因此通过 updatedInput 修改 prompt；
+    updatedInput 须与 permissionDecision 一起返回，默认 ask（用户确认），allow 须明确指定
     """
     log("DEBUG", "PreToolUse 事件，跳过校验（边界校验策略）")
-    allow_continue()
+    tool_input = input_data.get("tool_input") or {}
+    if not args.inject_skeleton or input_data.get("tool_name") != "Task":
+        return allow_continue()
+
+    node_name = tool_input.get("subagent_type") or ""
+    prompt = tool_input.get("prompt")
+    if not node_name or not isinstance(prompt, str) or SKELETON_MARKER in prompt:
+        return allow_continue()
+
+    contract_name = validator.find_node_contract(node_name)
+    contract = validator.load_contract(contract_name) if contract_name else None
+    schema = (contract or {}).get("schema")
+    if not isinstance(schema, dict):
+        return allow_continue()
+
+    text = validator.skeleton_text(contract_name, schema)
+    # updatedInput 必须与权限决定一起返回：allow 会自动批准本次调用，只在明确选择时使用
+    permission = args.inject_skeleton if args.inject_skeleton in SKELETON_PERMISSIONS else "ask"
+    log("DEBUG", "注入输出契约骨架", node=node_name, contract=contract_name, chars=len(text),
+        permission=permission)
+    get_metrics().inc("wf_skeleton_injections_total", {"node": node_name, "contract": contract_name})
+    reason = f"contract-validator: 已附加输出契约 {contract_name} 的骨架"
+    if permission == "allow":
+        reason += "（--inject-skeleton allow：自动批准）"
+    return allow_continue(hook_output={
+        "hookEventName": "PreToolUse",
+        "permissionDecision": permission,
+        "permissionDecisionReason": reason,
+        "updatedInput": {**tool_input, "prompt": f"{prompt}\n\n{text}"},
+    })
 
 
 def handle_subagent_stop(
-    input_data: dict, validator: ContractValidator, args: argparse.Namespace
-) -> None:
-    """处理 SubagentStop 事件"""
+    input_data: dict,
+    validator: ContractValidator,
+    args: argparse.Namespace,
+    shared: Optional[dict] = None,
+) -> HookOutcome:
+    """
+    处理 SubagentStop 事件
+
+    未通过时阻止结束（含无法提取输出的情况），超过重试上限后放行并记为失败
+    """
     contract_name: str = args.contract or ""
     node_name: str = args.node or input_data.get("agent_id", "unknown") or "unknown"
+    # 重试计数按节点类型归并（wf-state 以 subagent_type 记录节点）
+    retry_node: str = args.node or input_data.get("agent_type") or node_name
 
     if not contract_name:
-        allow_continue("contract-validator: 未指定契约名称，跳过校验")
+        return allow_continue("contract-validator: 未指定契约名称，跳过校验")
 
+    deadline = get_deadline(shared)
     contract = validator.load_contract(contract_name)
+    deadline.mark("load_contract")
     if not contract:
-        allow_continue(f"contract-validator: 未找到契约 '{contract_name}'")
+        return allow_continue(f"contract-validator: 未找到契约 '{contract_name}'")
+    max_retries = get_max_retries(contract, args)
+
+    def block(errors: list[dict], message: str) -> HookOutcome:
+        return block_within_retry_budget(
+            validator, input_data, "SubagentStop", retry_node, contract_name, max_retries, errors, message,
+        )
 
     # 从 agent_transcript_path 提取节点输出（使用共享模块）
     transcript_path: str = input_data.get("agent_transcript_path") or ""
     if not transcript_path:
-        block_with_json(f"contract-validator: 未找到节点 '{node_name}' 的 transcript")
+        message = f"contract-validator: 未找到节点 '{node_name}' 的 transcript"
+        return block([{"message": message}], message)
 
-    extraction_result = extract_from_transcript(transcript_path)
+    extraction_result = extract_output(transcript_path, shared)
+    deadline.mark("extract")
     if not extraction_result.success:
-        block_with_json(f"contract-validator: 无法读取节点 '{node_name}' 的输出: {extraction_result.error}")
+        record_validation("SubagentStop", contract_name, "error")
+        message = f"contract-validator: 无法读取节点 '{node_name}' 的输出: {extraction_result.error}"
+        return block([{"message": message}], message)
 
     data = extraction_result.json_data
     if data is None:
-        block_with_json(
-            f"contract-validator: 节点 '{node_name}' 输出中未找到符合契约的 JSON 数据"
-        )
+        record_validation("SubagentStop", contract_name, "error")
+        message = f"contract-validator: 节点 '{node_name}' 输出中未找到符合契约的 JSON 数据"
+        return block([{"message": message}], message)
 
     # 执行校验
-    all_errors: list[dict] = []
-
-    # 1. Schema 校验
-    schema = contract.get("schema")
-    if schema:
-        is_valid, errors = validator.validate_schema(data, schema)
-        if not is_valid:
-            all_errors.extend(errors)
-
-    # 2. 自定义校验脚本
-    validator_script = contract.get("validator_script")
-    if validator_script and not all_errors:
-        is_valid, errors = validator.run_validator_script(validator_script, data)
-        if not is_valid:
-            all_errors.extend(errors)
+    all_errors = validate_contract_data(validator, contract, data, contract_name, deadline)
 
     if all_errors:
         log(
@@ -420,22 +1077,27 @@ def handle_subagent_stop(
             contract=contract_name,
             errors=all_errors,
         )
+        record_validation("SubagentStop", contract_name, "failed")
         error_msg = format_error_message(node_name, contract_name, all_errors, "输出")
-        block_with_json(error_msg)
+        return block(all_errors, error_msg)
     else:
         log("INFO", "SubagentStop 校验通过", node=node_name, contract=contract_name)
-        allow_continue(f"contract-validator: 节点 '{node_name}' 输出校验通过")
+        record_validation("SubagentStop", contract_name, "passed")
+        clear_retries(validator, input_data, retry_node)
+        return allow_continue(f"contract-validator: 节点 '{node_name}' 输出校验通过{deadline.note()}")
 
 
 def handle_stop(
     input_data: dict,
     validator: ContractValidator,
     args: argparse.Namespace,
-) -> None:
+    shared: Optional[dict] = None,
+) -> HookOutcome:
     """
     处理 Stop 事件（工作流输出校验）
 
-    从 transcript_path 提取最后一条 assistant 消息并校验输出契约
+    从 transcript_path 提取最后一条 assistant 消息并校验输出契约；
+    未通过时阻止结束，超过重试上限后放行，由 wf-state 将工作流记为失败
     """
     workflow_name = args.workflow or ""
     contract_name = args.contract or ""
@@ -443,97 +1105,222 @@ def handle_stop(
     # 如果没有指定契约，跳过校验
     if not contract_name:
         log("DEBUG", "Stop: 未指定输出契约，跳过校验")
-        allow_continue()
+        return allow_continue()
 
     # 加载契约
+    deadline = get_deadline(shared)
     contract = validator.load_contract(contract_name)
+    deadline.mark("load_contract")
     if not contract:
-        allow_continue(f"contract-validator: 未找到输出契约 '{contract_name}'")
+        return allow_continue(f"contract-validator: 未找到输出契约 '{contract_name}'")
+    max_retries = get_max_retries(contract, args)
+
+    def block(errors: list[dict], message: str) -> HookOutcome:
+        return block_within_retry_budget(
+            validator, input_data, "Stop", ContractRetries.WORKFLOW, contract_name, max_retries, errors, message,
+        )
 
     # 从 transcript_path 提取工作流输出（使用共享模块）
     transcript_path = input_data.get("transcript_path", "")
     if not transcript_path:
-        block_with_json(f"contract-validator: 工作流 '{workflow_name}' 的 transcript 路径缺失")
+        message = f"contract-validator: 工作流 '{workflow_name}' 的 transcript 路径缺失"
+        return block([{"message": message}], message)
 
-    extraction_result = extract_from_transcript(transcript_path)
+    extraction_result = extract_output(transcript_path, shared)
+    deadline.mark("extract")
     if not extraction_result.success:
-        block_with_json(f"contract-validator: 无法读取工作流 '{workflow_name}' 的输出: {extraction_result.error}")
+        record_validation("Stop", contract_name, "error")
+        message = f"contract-validator: 无法读取工作流 '{workflow_name}' 的输出: {extraction_result.error}"
+        return block([{"message": message}], message)
 
     data = extraction_result.json_data
     if data is None:
-        block_with_json(
-            f"contract-validator: 工作流 '{workflow_name}' 输出中未找到符合契约的 JSON 数据"
-        )
+        record_validation("Stop", contract_name, "error")
+        message = f"contract-validator: 工作流 '{workflow_name}' 输出中未找到符合契约的 JSON 数据"
+        return block([{"message": message}], message)
 
     # 执行校验
-    all_errors: list[dict] = []
-
-    # Schema 校验
-    schema = contract.get("schema")
-    if schema:
-        is_valid, errors = validator.validate_schema(data, schema)
-        if not is_valid:
-            all_errors.extend(errors)
-
-    # 自定义校验脚本
-    validator_script = contract.get("validator_script")
-    if validator_script and not all_errors:
-        is_valid, errors = validator.run_validator_script(validator_script, data)
-        if not is_valid:
-            all_errors.extend(errors)
+    all_errors = validate_contract_data(validator, contract, data, contract_name, deadline)
 
     if all_errors:
         log("ERROR", "Stop 校验失败",
             workflow=workflow_name, contract=contract_name, errors=all_errors)
+        record_validation("Stop", contract_name, "failed")
         error_msg = format_error_message(
             workflow_name or "workflow", contract_name, all_errors, "输出"
         )
-        block_with_json(error_msg)
+        return block(all_errors, error_msg)
     else:
         log("INFO", "Stop 校验通过",
             workflow=workflow_name, contract=contract_name)
-        allow_continue(f"contract-validator: 工作流输出校验通过")
+        record_validation("Stop", contract_name, "passed")
+        clear_retries(validator, input_data, ContractRetries.WORKFLOW)
+        return allow_continue(f"contract-validator: 工作流输出校验通过{deadline.note()}")
+
+
+def dispatch_event(
+    input_data: dict,
+    validator: ContractValidator,
+    args: argparse.Namespace,
+    shared: Optional[dict] = None,
+) -> HookOutcome:
+    """
+    根据事件类型分发处理
+
+    Args:
+        shared: 同一进程内共享的数据（wf-hook.py 传入 params、提取结果缓存、超时预算；
+                未传入超时预算时按 --hook-timeout 从现在开始计时）
+    """
+    if shared is None:
+        shared = {}
+    if shared.get("deadline") is None:
+        shared["deadline"] = ValidationDeadline(args.hook_timeout)
+    hook_event = input_data.get("hook_event_name", "")
+    if hook_event == "UserPromptSubmit":
+        return handle_user_prompt_submit(input_data, validator, args, shared)
+    if hook_event == "PreToolUse":
+        return handle_pre_tool_use(input_data, validator, args)
+    if hook_event == "SubagentStop":
+        return handle_subagent_stop(input_data, validator, args, shared)
+    if hook_event == "Stop":
+        return handle_stop(input_data, validator, args, shared)
+    log("WARN", "未知的 Hook 事件", hook_event=hook_event)
+    return allow_continue()
+
+
+def compile_contracts(validator: ContractValidator, names: list[str]) -> int:
+    """
+    编译契约 Schema 到 .compiled/ 目录
+
+    Args:
+        names: 契约名称列表，为空时编译目录下全部契约
+
+    Returns:
+        退出码（指定的契约不存在或编译失败时为 1）
+    """
+    if not names:
+        names = sorted({
+            f.stem for f in validator.contracts_dir.glob("*")
+            if f.suffix in (".yaml", ".json") and f.is_file()
+        })
+    compiled_dir = validator.contracts_dir / COMPILED_DIR
+    exit_code = 0
+
+    for name in names:
+        compiled_file = compiled_dir / f"{name}.py"
+        try:
+            contract = validator.load_contract(name)
+        except Exception as e:
+            print(f"✗ {name}: 契约无法解析 ({e})")
+            exit_code = 1
+            continue
+        if not contract:
+            print(f"✗ {name}: 未找到契约")
+            exit_code = 1
+            continue
+        schema = contract.get("schema")
+        if not schema:
+            print(f"- {name}: 无 schema，跳过")
+            continue
+
+        jsonschema = get_jsonschema()
+        if jsonschema:
+            try:
+                jsonschema.validators.validator_for(schema).check_schema(schema)
+            except jsonschema.SchemaError as e:
+                print(f"✗ {name}: Schema 无效 ({e.message})")
+                exit_code = 1
+                continue
+
+        try:
+            source = compile_schema(schema, name)
+        except SchemaCompileError as e:
+            # 旧的编译结果已与 Schema 不一致，删除后该契约走 jsonschema
+            compiled_file.unlink(missing_ok=True)
+            print(f"- {name}: 未编译，校验时使用 jsonschema ({e})")
+            continue
+
+        compiled_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = compiled_file.with_suffix(".py.tmp")
+        tmp_file.write_text(source, encoding="utf-8")
+        tmp_file.replace(compiled_file)
+        print(f"✓ {name} -> {compiled_file}")
+
+    return exit_code
 
 
 def parse_args() -> argparse.Namespace:
     """解析命令行参数"""
     parser = argparse.ArgumentParser(description="契约校验脚本")
     parser.add_argument("--workflow", type=str, help="工作流名称（用于命令匹配）")
-    parser.add_argument("--contract", type=str, help="契约名称")
-    parser.add_argument("--node", type=str, help="节点名称")
+    add_validation_arguments(parser)
+    parser.add_argument(
+        "--compile",
+        nargs="*",
+        metavar="CONTRACT",
+        help="把契约 Schema 编译为校验模块（.claude/contracts/.compiled/），不指定时编译全部契约",
+    )
+    parser.add_argument("--metrics-file", type=str, help="Prometheus 指标文件路径（.prom）")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="记录各阶段耗时到 .context/profile.jsonl（等同 WF_PROFILE=1）",
+    )
     return parser.parse_args()
 
 
 def main():
     """主函数"""
     args = parse_args()
+    if args.compile is not None:
+        sys.exit(compile_contracts(ContractValidator(find_contracts_dir(), result_cache=False), args.compile))
+
+    profiler = get_profiler("contract-validator", args.profile)
+    profiler.add_phase("imports", _IMPORTS_DONE - _IMPORTS_STARTED)
+    metrics = get_metrics(args.metrics_file)
+    hook_started = time.perf_counter()
+    hook_started_ts = time.time()
 
-    # 读取 stdin 输入
+    # 读取 stdin 输入（快速路径返回的字节或流，大字段落盘）
     try:
-        input_data = json.load(sys.stdin)
+        with profiler.phase("stdin"):
+            input_data = load_payload(_STDIN_RAW)
     except json.JSONDecodeError as e:
+        profiler.finish("invalid_input")
         log("ERROR", "无法解析输入", error=str(e))
-        allow_continue(f"contract-validator: 无法解析输入 ({e})")
+        emit_outcome(allow_continue(f"contract-validator: 无法解析输入 ({e})"))
 
     hook_event = input_data.get("hook_event_name", "")
+    record_event(Path(__file__).name, sys.argv[1:], input_data)
     log("DEBUG", "收到 Hook 事件", hook_event=hook_event, args=vars(args))
 
     # 初始化校验器
     contracts_dir = find_contracts_dir()
-    validator = ContractValidator(contracts_dir)
+    validator = ContractValidator(contracts_dir, result_cache=not args.no_validation_cache)
 
-    # 根据事件类型分发处理
-    if hook_event == "UserPromptSubmit":
-        handle_user_prompt_submit(input_data, validator, args)
-    elif hook_event == "PreToolUse":
-        handle_pre_tool_use(input_data, validator)
-    elif hook_event == "SubagentStop":
-        handle_subagent_stop(input_data, validator, args)
-    elif hook_event == "Stop":
-        handle_stop(input_data, validator, args)
-    else:
-        log("WARN", "未知的 Hook 事件", hook_event=hook_event)
-        allow_continue()
+    try:
+        # 根据事件类型分发处理
+        with profiler.phase(f"handle:{hook_event or 'unknown'}"):
+            outcome = dispatch_event(
+                input_data, validator, args,
+                {"deadline": ValidationDeadline(args.hook_timeout, started=hook_started)},
+            )
+    finally:
+        # 在输出结果前统一记录耗时并写入指标
+        hook_duration = time.perf_counter() - hook_started
+        metrics.observe(
+            "wf_hook_duration_seconds",
+            hook_duration,
+            {"script": "contract-validator", "event": hook_event or "unknown"},
+        )
+        metrics.flush()
+        record_span(
+            hook_event or "unknown", "hook", hook_started_ts, hook_started_ts + hook_duration,
+            script="contract-validator", contract=args.contract, node=args.node,
+        )
+        profiler.finish(hook_event)
+
+    emit_outcome(outcome)
 
 
 if __name__ == "__main__":
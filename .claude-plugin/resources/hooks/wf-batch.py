@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+wf-batch.py - 工作流批量运行器
+
+基于 Python Agent SDK，对一份输入清单无人值守地批量执行同一个生成的工作流：
+- asyncio 并发运行 N 个会话（--concurrency）
+- 状态治理与契约校验通过 wf_sdk_hooks 在进程内处理（命令行 Hook 自动跳过）
+- 每个输入使用独立的项目目录，`.context` 互不干扰
+- 结束后输出汇总报告：吞吐量、失败列表、各节点耗时分布
+
+用法:
+  python wf-batch.py --workflow code-review --manifest inputs.jsonl --concurrency 4 \\
+      --input-contract review-input --output-contract review-report \\
+      --node-contract analyzer=analysis-result
+
+  # 离线验证：脚本化的假客户端按脚本触发 Hook 事件，不调用模型
+  python wf-batch.py --workflow code-review --manifest inputs.jsonl --fake-client fake.json
+
+清单格式（JSONL，每行一个输入）:
+  {"id": "repo-1", "args": "src/ --format json"}
+  "src/ --format json"                # 纯字符串时以行号作为 id
+
+假客户端脚本格式:
+  {
+    "nodes": [
+      {"name": "analyzer", "delay_s": 0.05,
+       "output": "分析完成\\n```json\\n{\\"input\\": \\"{id}\\"}\\n```",
+       "fail_inputs": ["repo-3"]}
+    ],
+    "final": "```json\\n{\\"report\\": \\"{id}\\"}\\n```"
+  }
+  output / final 中的 {id}、{args} 替换为当前输入。
+
+  examples/ 下有可直接运行的假客户端脚本、清单和最小项目:
+  cd examples && python ../wf-batch.py --workflow code-review --manifest manifest.jsonl \\
+      --fake-client fake-client.json --project-dir project --runs-dir "$(mktemp -d)" \\
+      --input-contract review-input --output-contract review-report \\
+      --node-contract analyzer=analysis-result
+
+运行目录:
+  <runs-dir>/
+  ├── <id>/                  # 每个输入一个隔离的项目目录
+  │   ├── .claude -> <project>/.claude
+  │   └── .context/          # 该运行的状态、节点输出、事件流
+  └── report.json            # 汇总报告
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+HOOKS_DIR = Path(__file__).parent
+
+# 确保可以从任意工作目录导入同目录下的模块
+sys.path.insert(0, str(HOOKS_DIR))
+from wf_sdk_hooks import HOOKS_IN_PROCESS_ENV, FakeSDKDriver, WorkflowHooks, wf_hook
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """线性插值百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def load_manifest(path: Path) -> list[dict]:
+    """读取输入清单，返回 [{id, args}]"""
+    items = []
+    seen = set()
+    for line_no, line in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        if isinstance(entry, str):
+            entry = {"args": entry}
+        run_id = re.sub(r"[^\w.-]+", "_", str(entry.get("id") or line_no))
+        if run_id in seen:
+            run_id = f"{run_id}-{line_no}"
+        seen.add(run_id)
+        items.append({"id": run_id, "args": str(entry.get("args", ""))})
+    return items
+
+
+def prepare_run_dir(runs_dir: Path, project_dir: Path, run_id: str) -> Path:
+    """创建运行目录，共享项目的 .claude（命令、节点、契约）"""
+    run_dir = runs_dir / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    claude_dir = run_dir / ".claude"
+    if not claude_dir.exists():
+        try:
+            claude_dir.symlink_to(project_dir / ".claude", target_is_directory=True)
+        except OSError:
+            shutil.copytree(project_dir / ".claude", claude_dir)
+    return run_dir
+
+
+def _assistant_line(text: str) -> str:
+    """构造 transcript 中的一条助手消息"""
+    return json.dumps({
+        "type": "assistant",
+        "message": {"role": "assistant", "content": [{"type": "text", "text": text}]},
+    }, ensure_ascii=False) + "\n"
+
+
+def _blocked(outputs: list[dict]) -> Optional[str]:
+    """回调结果中的阻止原因（未阻止时返回 None）"""
+    for output in outputs:
+        if output.get("decision") == "block":
+            return output.get("reason") or "blocked"
+        hook_output = output.get("hookSpecificOutput") or {}
+        if hook_output.get("permissionDecision") == "deny":
+            return hook_output.get("permissionDecisionReason") or "denied"
+    return None
+
+
+class SDKClient:
+    """通过 Python Agent SDK 运行工作流"""
+
+    def __init__(self, permission_mode: Optional[str] = None, max_turns: Optional[int] = None):
+        self.permission_mode = permission_mode
+        self.max_turns = max_turns
+
+    async def run(self, prompt: str, run_dir: Path, hooks: WorkflowHooks, item: dict) -> dict:  # noqa: ARG002
+        from claude_agent_sdk import ClaudeAgentOptions, query
+
+        options = ClaudeAgentOptions(
+            cwd=str(run_dir),
+            hooks=hooks.matchers(),
+            setting_sources=["project"],
+            env=dict(HOOKS_IN_PROCESS_ENV),
+            permission_mode=self.permission_mode,
+            max_turns=self.max_turns,
+        )
+        outcome = {"is_error": True, "error": "未收到结果消息"}
+        async for message in query(prompt=prompt, options=options):
+            if type(message).__name__ == "ResultMessage":
+                outcome = {
+                    "is_error": bool(getattr(message, "is_error", False)),
+                    "error": getattr(message, "result", None) if getattr(message, "is_error", False) else None,
+                    "cost_usd": getattr(message, "total_cost_usd", None),
+                    "num_turns": getattr(message, "num_turns", None),
+                }
+        return outcome
+
+
+class FakeClient:
+    """脚本化的假客户端：按脚本依次触发 Hook 事件，用于离线验证批量运行"""
+
+    def __init__(self, script: dict):
+        self.script = script
+
+    @staticmethod
+    def _render(template: str, item: dict) -> str:
+        return template.replace("{id}", item["id"]).replace("{args}", item["args"])
+
+    async def run(self, prompt: str, run_dir: Path, hooks: WorkflowHooks, item: dict) -> dict:
+        driver = FakeSDKDriver(hooks.matchers())
+        transcript_path = run_dir / "transcript.jsonl"
+        transcript_path.write_text("", encoding="utf-8")
+        base = {"session_id": f"fake-{item['id']}", "transcript_path": str(transcript_path), "cwd": str(run_dir)}
+
+        reason = _blocked(await driver.dispatch({**base, "hook_event_name": "UserPromptSubmit", "prompt": prompt}))
+        if reason:
+            return {"is_error": True, "error": reason}
+
+        for index, node in enumerate(self.script.get("nodes", [])):
+            name = node["name"]
+            tool_use_id = f"toolu_fake_{item['id']}_{index}"
+            tool_input = {"subagent_type": name, "prompt": f"{name}: {item['args']}"}
+            task = {**base, "tool_name": "Task", "tool_input": tool_input, "tool_use_id": tool_use_id}
+
+            if _blocked(await driver.dispatch({**task, "hook_event_name": "PreToolUse"})):
+                continue  # 恢复模式跳过或缓存命中
+            await asyncio.sleep(float(node.get("delay_s", 0)))
+
+            if item["id"] in node.get("fail_inputs", []):
+                tool_response: Any = {"status": "failed", "message": f"{name} 脚本化失败"}
+            else:
+                tool_response = self._render(node.get("output", "执行完成"), item)
+                agent_transcript = run_dir / f"agent-{index}.jsonl"
+                agent_transcript.write_text(_assistant_line(tool_response), encoding="utf-8")
+                await driver.dispatch({
+                    **base, "hook_event_name": "SubagentStop",
+                    "agent_type": name, "agent_transcript_path": str(agent_transcript),
+                })
+            await driver.dispatch({**task, "hook_event_name": "PostToolUse", "tool_response": tool_response})
+
+        with open(transcript_path, "a", encoding="utf-8") as f:
+            f.write(_assistant_line(self._render(self.script.get("final", "工作流完成"), item)))
+        reason = _blocked(await driver.dispatch({**base, "hook_event_name": "Stop"}))
+        if reason:
+            return {"is_error": True, "error": reason}
+        return {"is_error": False, "error": None}
+
+
+def read_run_state(run_dir: Path) -> dict:
+    """读取运行目录中的最终状态"""
+    state_file = run_dir / ".context" / "state.md"
+    if not state_file.exists():
+        return {}
+    return wf_hook.wf_state.WorkflowState(state_file).state
+
+
+async def run_one(
+    semaphore: asyncio.Semaphore,
+    client: Any,
+    item: dict,
+    args: argparse.Namespace,
+    runs_dir: Path,
+    project_dir: Path,
+) -> dict:
+    """在独立目录中运行一个输入，返回运行记录"""
+    async with semaphore:
+        run_dir = prepare_run_dir(runs_dir, project_dir, item["id"])
+        hooks = WorkflowHooks(
+            workflow=args.workflow,
+            input_contract=args.input_contract,
+            output_contract=args.output_contract,
+            node_contracts=dict(entry.split("=", 1) for entry in args.node_contract),
+            state_argv=args.state_arg,
+            project_dir=str(run_dir),
+        )
+        prompt = f"/{args.workflow} {item['args']}".strip()
+        started = time.perf_counter()
+        try:
+            outcome = await client.run(prompt, run_dir, hooks, item)
+        except Exception as e:
+            outcome = {"is_error": True, "error": f"{type(e).__name__}: {e}"}
+        duration = time.perf_counter() - started
+
+    state = read_run_state(run_dir)
+    nodes = {
+        name: {"status": node.get("status"), "duration_s": node.get("duration_s")}
+        for name, node in (state.get("nodes") or {}).items()
+    }
+    failed_nodes = [name for name, node in nodes.items() if node["status"] == "failed"]
+    error = outcome.get("error")
+    if not error and state.get("status") != "completed":
+        error = f"工作流状态为 {state.get('status') or '未初始化'}"
+        if failed_nodes:
+            error += f"（失败节点: {', '.join(failed_nodes)}）"
+    status = "failed" if outcome.get("is_error") or error else "succeeded"
+
+    record = {
+        "id": item["id"],
+        "status": status,
+        "duration_s": round(duration, 3),
+        "workflow_status": state.get("status"),
+        "nodes": nodes,
+        "error": error,
+    }
+    for key in ("cost_usd", "num_turns"):
+        if outcome.get(key) is not None:
+            record[key] = outcome[key]
+    print(f"[{status}] {item['id']} {duration:.1f}s" + (f" - {error}" if error else ""), file=sys.stderr)
+    return record
+
+
+def build_report(records: list[dict], wall_s: float, args: argparse.Namespace) -> dict:
+    """汇总吞吐量、失败与节点耗时分布"""
+    node_durations: dict[str, list[float]] = {}
+    node_failures: dict[str, int] = {}
+    for record in records:
+        for name, node in record["nodes"].items():
+            if node.get("duration_s") is not None:
+                node_durations.setdefault(name, []).append(node["duration_s"])
+            if node.get("status") == "failed":
+                node_failures[name] = node_failures.get(name, 0) + 1
+
+    succeeded = sum(1 for r in records if r["status"] == "succeeded")
+    run_durations = [r["duration_s"] for r in records]
+    return {
+        "workflow": args.workflow,
+        "client": "fake" if args.fake_client else "sdk",
+        "concurrency": args.concurrency,
+        "total": len(records),
+        "succeeded": succeeded,
+        "failed": len(records) - succeeded,
+        "wall_s": round(wall_s, 3),
+        "throughput_per_min": round(len(records) / wall_s * 60, 2) if wall_s > 0 else None,
+        "run_duration_s": {
+            "p50": round(percentile(run_durations, 50), 3),
+            "p95": round(percentile(run_durations, 95), 3),
+        },
+        "nodes": {
+            name: {
+                "count": len(durations),
+                "failed": node_failures.get(name, 0),
+                "mean_s": round(sum(durations) / len(durations), 3),
+                "p50_s": round(percentile(durations, 50), 3),
+                "p95_s": round(percentile(durations, 95), 3),
+            }
+            for name, durations in sorted(node_durations.items())
+        },
+        "failures": [{"id": r["id"], "error": r["error"]} for r in records if r["status"] == "failed"],
+        "runs": records,
+    }
+
+
+def print_report(report: dict) -> None:
+    """打印汇总报告"""
+    print(f"工作流: {report['workflow']}（{report['client']}，并发 {report['concurrency']}）")
+    print(f"运行: {report['total']}  成功: {report['succeeded']}  失败: {report['failed']}")
+    print(f"总耗时: {report['wall_s']:.1f}s  吞吐量: {report['throughput_per_min']} 次/分钟")
+    print(f"单次运行: p50 {report['run_duration_s']['p50']:.2f}s  p95 {report['run_duration_s']['p95']:.2f}s")
+    if report["nodes"]:
+        print(f"\n{'节点':<24} {'次数':>6} {'失败':>6} {'平均(s)':>10} {'p50(s)':>10} {'p95(s)':>10}")
+        for name, node in report["nodes"].items():
+            print(f"{name:<24} {node['count']:>6} {node['failed']:>6} "
+                  f"{node['mean_s']:>10.3f} {node['p50_s']:>10.3f} {node['p95_s']:>10.3f}")
+    if report["failures"]:
+        print("\n失败:")
+        for failure in report["failures"]:
+            print(f"- {failure['id']}: {failure['error']}")
+
+
+async def run_batch(args: argparse.Namespace) -> dict:
+    """并发运行清单中的全部输入"""
+    project_dir = Path(args.project_dir or os.environ.get("CLAUDE_PROJECT_DIR", "") or Path.cwd()).resolve()
+    runs_dir = Path(args.runs_dir) if args.runs_dir else (
+        project_dir / ".batch" / datetime.now().strftime("%Y%m%d-%H%M%S")
+    )
+    runs_dir = runs_dir.resolve()
+    items = load_manifest(Path(args.manifest))
+
+    if args.fake_client:
+        client: Any = FakeClient(json.loads(Path(args.fake_client).read_text(encoding="utf-8")))
+    else:
+        client = SDKClient(permission_mode=args.permission_mode, max_turns=args.max_turns)
+
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    started = time.perf_counter()
+    records = await asyncio.gather(*(
+        run_one(semaphore, client, item, args, runs_dir, project_dir) for item in items
+    ))
+    report = build_report(list(records), time.perf_counter() - started, args)
+    report["runs_dir"] = str(runs_dir)
+
+    runs_dir.mkdir(parents=True, exist_ok=True)
+    (runs_dir / "report.json").write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="工作流批量运行器（Python Agent SDK）")
+    parser.add_argument("--workflow", required=True, help="工作流命令名称（不含 /）")
+    parser.add_argument("--manifest", required=True, help="输入清单（JSONL）")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发会话数（默认 4）")
+    parser.add_argument("--project-dir", help="工作流项目目录（含 .claude/，默认 CLAUDE_PROJECT_DIR 或当前目录）")
+    parser.add_argument("--runs-dir", help="运行目录（默认 <project>/.batch/<时间戳>）")
+    parser.add_argument("--input-contract", help="工作流输入契约")
+    parser.add_argument("--output-contract", help="工作流输出契约")
+    parser.add_argument(
+        "--node-contract",
+        action="append",
+        default=[],
+        metavar="NODE=CONTRACT",
+        help="节点输出契约（可重复指定）",
+    )
+    parser.add_argument(
+        "--state-arg",
+        action="append",
+        default=[],
+        metavar="ARG",
+        help="传给 wf-state 的参数（可重复指定，如 --state-arg=--cache）",
+    )
+    parser.add_argument("--fake-client", metavar="SCRIPT", help="使用脚本化的假客户端（离线验证）")
+    parser.add_argument("--permission-mode", help="SDK 权限模式（如 acceptEdits、bypassPermissions）")
+    parser.add_argument("--max-turns", type=int, help="每个会话的最大轮数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    return parser.parse_args()
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    report = asyncio.run(run_batch(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        print(f"\n报告: {report['runs_dir']}/report.json")
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,983 @@
+#!/usr/bin/env python3
+"""
+wf-bench.py - 工作流 Hook 性能基准工具
+
+子命令:
+  replay <bundle>   按原顺序回放 WF_RECORD_DIR 录制的 Hook 事件流，
+                    统计每类事件（脚本:事件）的 p50/p95/p99 延迟，
+                    并可与保存的基线对比以发现性能回退
+  output            生成指定大小的合成节点输出，用 tracemalloc 测量
+                    wf-state 写入节点输出的峰值内存和耗时
+  noop              测量没有工作流运行时 Hook 的启动开销（.context/active 快速路径），
+                    并与工作流运行中的完整路径、空解释器对比
+  payload           以子进程运行 wf-state.py 处理大 tool_response 的 PostToolUse，
+                    对比大字段落盘（--spill-kb）与整体解析时进程的峰值 RSS
+  classify          在大输出上对比节点成功判断的旧实现（全文转小写查找关键词）与
+                    wf_classify 分类（JSON 字段 + 末尾规则），统计耗时、内存和判断是否正确
+  contracts         对比契约 Schema 的 jsonschema 解释执行与 --compile 编译校验器的
+                    单次校验耗时，并检查两者错误详情是否一致
+  columnar          对比大型同构数组的 jsonschema 逐元素校验与 x-columnar 按列 / 抽样校验
+  blocks <bundle>.. 统计录制包中 SubagentStop 契约校验的阻止率，对比未注入 / 注入输出骨架
+                    （--inject-skeleton）的录制，并估计阻止中骨架已说明的约束占比
+
+用法:
+  # 1. 录制：在真实工作流运行时设置录制目录
+  WF_RECORD_DIR=/tmp/wf-bundle claude ...
+
+  # 2. 回放并保存基线
+  python wf-bench.py replay /tmp/wf-bundle --runs 10 --save-baseline bench-baseline.json
+
+  # 3. 修改 Hook 后回放并与基线对比（回退时退出码为 1）
+  python wf-bench.py replay /tmp/wf-bundle --runs 10 --baseline bench-baseline.json
+
+  # 大输出写入的内存基准（50MB）
+  python wf-bench.py output --size-mb 50
+
+  # 非工作流事件的快速路径基准
+  python wf-bench.py noop --runs 30
+
+  # 大 tool_response 的 Hook 进程峰值 RSS（落盘 vs 整体解析）
+  python wf-bench.py payload --size-mb 50
+
+  # 大输出的节点成功判断（旧关键词扫描 vs 分类）
+  python wf-bench.py classify --size-mb 20
+
+  # 编译校验器基准（默认使用插件自带的示例契约）
+  python wf-bench.py contracts --number 2000
+
+  # 同构数组按列校验基准（10 万条记录）
+  python wf-bench.py columnar --records 100000
+
+  # 输出骨架效果：分别录制未注入和注入骨架的运行，对比 SubagentStop 阻止率
+  python wf-bench.py blocks /tmp/wf-bundle-plain /tmp/wf-bundle-skeleton
+
+回放在临时项目目录中进行（复制录制时的契约目录），每轮使用全新的 .context，
+transcript 按录制时的快照逐步还原，增量统计等行为与真实运行一致。
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+HOOKS_DIR = Path(__file__).parent
+
+# 确保可以从任意工作目录导入同目录下的模块
+sys.path.insert(0, str(HOOKS_DIR))
+from wf_record import load_events
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """线性插值百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _is_blocked(returncode: int, stdout: str) -> bool:
+    """Hook 是否阻止了执行（exit 2 或 decision=block）"""
+    if returncode == 2:
+        return True
+    try:
+        output = json.loads(stdout.strip().splitlines()[-1]) if stdout.strip() else {}
+    except (json.JSONDecodeError, IndexError):
+        return False
+    if not isinstance(output, dict):
+        return False
+    hook_output = output.get("hookSpecificOutput") or {}
+    return output.get("decision") == "block" or hook_output.get("permissionDecision") == "deny"
+
+
+def replay_once(bundle: Path, events: list[dict], python: str) -> list[dict]:
+    """
+    在全新的临时项目中回放一次事件流
+
+    Returns:
+        每个事件的结果 [{key, latency_ms, blocked, returncode}]
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        project_dir = Path(tmp) / "project"
+        bundle_project = bundle / "project"
+        if bundle_project.is_dir():
+            shutil.copytree(bundle_project, project_dir)
+        else:
+            project_dir.mkdir(parents=True)
+        live_dir = Path(tmp) / "transcripts"
+        live_dir.mkdir()
+
+        env = dict(os.environ)
+        env.pop("WF_RECORD_DIR", None)
+        env["CLAUDE_PROJECT_DIR"] = str(project_dir)
+
+        for event in events:
+            payload = dict(event["payload"])
+            if "cwd" in payload:
+                payload["cwd"] = str(project_dir)
+
+            # 同一原始路径始终映射到同一个回放文件，快照按时间顺序覆盖
+            for field in ("transcript_path", "agent_transcript_path"):
+                original = payload.get(field)
+                if not original:
+                    continue
+                live_path = live_dir / (hashlib.sha1(original.encode("utf-8")).hexdigest() + ".jsonl")
+                snapshot = (event.get("transcripts") or {}).get(field)
+                if snapshot:
+                    shutil.copyfile(bundle / snapshot, live_path)
+                payload[field] = str(live_path)
+
+            command = [python, str(HOOKS_DIR / event["script"]), *event.get("argv", [])]
+            started = time.perf_counter()
+            completed = subprocess.run(
+                command,
+                input=json.dumps(payload, ensure_ascii=False),
+                capture_output=True,
+                text=True,
+                cwd=project_dir,
+                env=env,
+            )
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            results.append({
+                "key": f"{Path(event['script']).stem}:{event.get('event') or 'unknown'}",
+                "latency_ms": latency_ms,
+                "blocked": _is_blocked(completed.returncode, completed.stdout),
+                "returncode": completed.returncode,
+            })
+    return results
+
+
+def summarize(samples: list[dict]) -> dict:
+    """按事件类型汇总延迟分位数和阻止次数"""
+    grouped: dict[str, list[dict]] = {}
+    for sample in samples:
+        grouped.setdefault(sample["key"], []).append(sample)
+
+    summary = {}
+    for key in sorted(grouped):
+        latencies = [s["latency_ms"] for s in grouped[key]]
+        summary[key] = {
+            "count": len(latencies),
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(sum(latencies) / len(latencies), 3),
+            "blocked": sum(1 for s in grouped[key] if s["blocked"]),
+            "errors": sum(1 for s in grouped[key] if s["returncode"] not in (0, 2)),
+        }
+    return summary
+
+
+def compare_baseline(
+    summary: dict, baseline: dict, tolerance: float, min_delta_ms: float, metric: str = "p95"
+) -> list[str]:
+    """
+    与基线对比，返回回退描述列表
+
+    同时超过相对阈值（tolerance）和绝对阈值（min_delta_ms）才算回退，避免微小抖动误报。
+    """
+    regressions = []
+    for key, current in summary.items():
+        base = (baseline.get("events") or baseline).get(key)
+        if not base or metric not in base:
+            continue
+        limit = base[metric] * (1 + tolerance)
+        if current[metric] > limit and current[metric] - base[metric] > min_delta_ms:
+            regressions.append(
+                f"{key}: {metric} {current[metric]:.1f}ms > 基线 {base[metric]:.1f}ms (+{tolerance:.0%})"
+            )
+    return regressions
+
+
+def print_report(summary: dict, baseline: Optional[dict] = None) -> None:
+    """输出延迟报告表格"""
+    base_events = (baseline or {}).get("events") or {}
+    print(f"{'事件':<36} {'次数':>6} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10} {'阻止':>6} {'基线p95':>10}")
+    for key, item in summary.items():
+        base_p95 = base_events.get(key, {}).get("p95")
+        base_text = f"{base_p95:.1f}" if base_p95 is not None else "-"
+        print(
+            f"{key:<36} {item['count']:>6} {item['p50']:>10.1f} {item['p95']:>10.1f} "
+            f"{item['p99']:>10.1f} {item['blocked']:>6} {base_text:>10}"
+        )
+
+
+def cmd_replay(args: argparse.Namespace) -> int:
+    """replay 子命令"""
+    bundle = Path(args.bundle)
+    events = load_events(bundle)
+    if not events:
+        print(f"录制包中没有事件: {bundle}", file=sys.stderr)
+        return 1
+
+    for _ in range(args.warmup):
+        replay_once(bundle, events, args.python)
+
+    samples: list[dict] = []
+    for _ in range(args.runs):
+        samples.extend(replay_once(bundle, events, args.python))
+    summary = summarize(samples)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+
+    if args.json:
+        print(json.dumps({"events": summary}, ensure_ascii=False, indent=2))
+    else:
+        print(f"回放 {len(events)} 个事件 × {args.runs} 轮\n")
+        print_report(summary, baseline)
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({"events": summary, "runs": args.runs}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+
+    if baseline:
+        regressions = compare_baseline(summary, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\n性能回退:", file=sys.stderr)
+            for line in regressions:
+                print(f"  - {line}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def load_hook_module(filename: str):
+    """按文件名导入同目录下的 Hook 脚本（文件名含连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(filename.replace("-", "_")[:-3], HOOKS_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_synthetic_output(size_mb: float) -> str:
+    """生成约 size_mb 大小、末尾带 ```json 代码块的节点输出"""
+    record = {
+        "id": 0,
+        "path": "src/components/example/module_name.py",
+        "severity": "warning",
+        "message": "检测到可以优化的调用链路，建议合并重复的文件读取操作",
+        "tags": ["performance", "io", "refactor"],
+        "score": 0.875,
+    }
+    count = max(int(size_mb * 1024 * 1024 / len(json.dumps(record, ensure_ascii=False).encode("utf-8"))), 1)
+    data = {"summary": f"共 {count} 条结果", "items": [dict(record, id=i) for i in range(count)]}
+    return "分析完成，结果如下：\n\n```json\n" + json.dumps(data, ensure_ascii=False) + "\n```\n"
+
+
+def measure(func) -> tuple[float, float]:
+    """
+    执行函数两次，返回 (峰值新增内存 MB, 耗时秒)
+
+    tracemalloc 会显著拖慢大量小对象分配，因此耗时取未跟踪的一次。
+    """
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (peak - baseline) / 1024 / 1024, elapsed
+
+
+def cmd_output(args: argparse.Namespace) -> int:
+    """output 子命令"""
+    wf_state = load_hook_module("wf-state.py")
+    text = build_synthetic_output(args.size_mb)
+    input_mb = len(text.encode("utf-8")) / 1024 / 1024
+    data = wf_state.extract_from_tool_response(text).json_data
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        os.environ["CLAUDE_PROJECT_DIR"] = tmp
+        out_dir = Path(tmp) / "bench"
+
+        # 端到端：blob 存储 + 提取 + 写 .json/.md + 历史记录
+        # （每次使用新的节点名，避免命中「输出未变化」的快速路径）
+        node_names = iter(["bench-1", "bench-2"])
+        results["write_node_output"] = measure(lambda: wf_state.write_node_output(next(node_names), text, "t1"))
+
+        # 只比较写出阶段：流式编码 vs 整串拼接（旧实现的写法，作为参考）
+        def streaming():
+            wf_state._atomic_write_chunks(out_dir / "stream.json", wf_state._iter_json(data))
+            wf_state._atomic_write_chunks(out_dir / "stream.md", wf_state._iter_output_markdown(
+                "bench", data, "-", raw_text=text,
+            ))
+
+        def whole_string():
+            json_content = json.dumps(data, ensure_ascii=False, indent=2)
+            wf_state._atomic_write(out_dir / "whole.json", json_content)
+            md_content = "\n".join([
+                "# 节点输出: bench", "", "## 结构化数据", "", "```json",
+                json.dumps(data, ensure_ascii=False, indent=2), "```", "", "## 原始输出", "", text, "",
+            ])
+            wf_state._atomic_write(out_dir / "whole.md", md_content)
+
+        results["写出（流式）"] = measure(streaming)
+        results["写出（整串拼接，参考）"] = measure(whole_string)
+
+    if args.json:
+        print(json.dumps({
+            "input_mb": round(input_mb, 2),
+            "results": {k: {"peak_mb": round(v[0], 2), "seconds": round(v[1], 3)} for k, v in results.items()},
+        }, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"合成输出 {input_mb:.1f}MB\n")
+    print(f"{'场景':<28} {'峰值新增内存(MB)':>18} {'相对输入':>10} {'耗时(s)':>10}")
+    for name, (peak_mb, seconds) in results.items():
+        print(f"{name:<28} {peak_mb:>18.1f} {peak_mb / input_mb:>9.2f}x {seconds:>10.2f}")
+    return 0
+
+
+NOOP_PAYLOADS = {
+    "PreToolUse": {
+        "hook_event_name": "PreToolUse",
+        "tool_name": "Task",
+        "tool_input": {"subagent_type": "bench-node", "prompt": "noop"},
+        "tool_use_id": "toolu_bench",
+    },
+    "Stop": {"hook_event_name": "Stop", "transcript_path": "/nonexistent/transcript.jsonl"},
+}
+
+
+def cmd_noop(args: argparse.Namespace) -> int:
+    """noop 子命令"""
+    # (场景名, 脚本, 参数)：wf-hook 分别测只更新状态（Task 的 Hook）和带契约校验两种注册方式
+    scripts = [
+        ("wf-state", "wf-state.py", []),
+        ("contract-validator", "contract-validator.py", ["--contract", "bench-output"]),
+        ("wf-hook", "wf-hook.py", []),
+        ("wf-hook --contract", "wf-hook.py", ["--contract", "bench-output"]),
+    ]
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        env = dict(os.environ)
+        env.pop("WF_RECORD_DIR", None)
+        env["CLAUDE_PROJECT_DIR"] = tmp
+        active_file = Path(tmp) / ".context" / "active"
+
+        def run(command: list[str], payload: dict, active: bool = False) -> float:
+            if active:
+                # Stop 会删除运行标记，每次运行前重新写入
+                active_file.parent.mkdir(parents=True, exist_ok=True)
+                active_file.write_text('{"workflow": "bench"}', encoding="utf-8")
+            started = time.perf_counter()
+            subprocess.run(
+                command, input=json.dumps(payload), capture_output=True, text=True, cwd=tmp, env=env,
+            )
+            return (time.perf_counter() - started) * 1000
+
+        def sample(label: str, command: list[str], payload: dict, active: bool = False) -> None:
+            run(command, payload, active)  # 预热
+            latencies = [run(command, payload, active) for _ in range(args.runs)]
+            rows.append({
+                "key": label,
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+            })
+
+        sample("python（空解释器，参考）", [args.python, "-c", "pass"], {})
+        for active in (False, True):
+            mode = "运行中" if active else "无工作流"
+            for name, script, argv in scripts:
+                for event, payload in NOOP_PAYLOADS.items():
+                    sample(f"{name}:{event}（{mode}）",
+                           [args.python, str(HOOKS_DIR / script), *argv], payload, active)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{'场景':<40} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for row in rows:
+        print(f"{row['key']:<40} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+    return 0
+
+
+def build_text_output(size_mb: float) -> str:
+    """生成约 size_mb 大小的日志型节点输出（大段文本，末尾一个小 ```json 代码块）"""
+    line = "[step] 已检查 src/components/example/module_name.py：调用链路正常，无需修改\n"
+    count = max(int(size_mb * 1024 * 1024 / len(line.encode("utf-8"))), 1)
+    summary = json.dumps({"summary": f"共检查 {count} 个文件", "issues": []}, ensure_ascii=False)
+    return line * count + "\n```json\n" + summary + "\n```\n"
+
+
+# 在独立的小进程中启动被测命令并报告其峰值 RSS：Linux 的 ru_maxrss 在 exec 后保留，
+# 直接从持有大输出的基准进程 fork 会把父进程的内存计入子进程
+_RUSAGE_WRAPPER = """
+import resource, subprocess, sys, time
+started = time.perf_counter()
+subprocess.run(sys.argv[1:], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, time.perf_counter() - started)
+"""
+
+
+def run_with_rusage(command: list[str], stdin_path: Path, cwd: str, env: dict) -> tuple[float, float]:
+    """运行子进程，返回 (峰值 RSS MB, 耗时秒)"""
+    with open(stdin_path, "rb") as stdin:
+        result = subprocess.run(
+            [sys.executable, "-c", _RUSAGE_WRAPPER, *command],
+            stdin=stdin, capture_output=True, text=True, cwd=cwd, env=env,
+        )
+    maxrss, elapsed = result.stdout.split()
+    # ru_maxrss: Linux 为 KB，macOS 为字节
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return int(maxrss) / divisor, float(elapsed)
+
+
+def cmd_payload(args: argparse.Namespace) -> int:
+    """payload 子命令"""
+    outputs = {
+        "文本": build_text_output(args.size_mb),
+        "JSON": build_synthetic_output(args.size_mb),
+    }
+    modes = {"落盘": [], "整体解析": ["--spill-kb", "0"]}
+    script = str(HOOKS_DIR / "wf-state.py")
+    rows = []
+    for shape, text in outputs.items():
+        size_mb = len(text.encode("utf-8")) / 1024 / 1024
+        for mode, extra in modes.items():
+            with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+                env = dict(os.environ)
+                env.pop("WF_RECORD_DIR", None)
+                env["CLAUDE_PROJECT_DIR"] = tmp
+                tool_input = {"subagent_type": "bench-node", "prompt": "noop"}
+                setup = [
+                    {"hook_event_name": "UserPromptSubmit", "session_id": "bench", "prompt": "/bench"},
+                    {"hook_event_name": "PreToolUse", "session_id": "bench", "tool_name": "Task",
+                     "tool_use_id": "toolu_bench", "tool_input": tool_input},
+                ]
+                for payload in setup:
+                    subprocess.run(
+                        [args.python, script, "--workflow", "bench"], input=json.dumps(payload),
+                        capture_output=True, text=True, cwd=tmp, env=env,
+                    )
+                payload_path = Path(tmp) / "post-tool-use.json"
+                payload_path.write_text(json.dumps({
+                    "hook_event_name": "PostToolUse", "session_id": "bench", "tool_name": "Task",
+                    "tool_use_id": "toolu_bench", "tool_input": tool_input, "tool_response": text,
+                }, ensure_ascii=False), encoding="utf-8")
+                peak_mb, seconds = run_with_rusage([args.python, script, *extra], payload_path, tmp, env)
+                written = (Path(tmp) / ".context" / "outputs" / "bench-node.md").exists()
+            rows.append({
+                "key": f"{shape}:{mode}",
+                "input_mb": round(size_mb, 2),
+                "peak_rss_mb": round(peak_mb, 1),
+                "seconds": round(seconds, 3),
+                "written": written,
+            })
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{'场景':<16} {'输入(MB)':>10} {'峰值RSS(MB)':>12} {'耗时(s)':>10}  输出已写入")
+    for row in rows:
+        print(f"{row['key']:<16} {row['input_mb']:>10.1f} {row['peak_rss_mb']:>12.1f} "
+              f"{row['seconds']:>10.2f}  {'是' if row['written'] else '否'}")
+    return 0
+
+
+def legacy_check_success(text: str) -> bool:
+    """旧实现的成功判断：全文转小写后查找关键词（作为参考）"""
+    lower_output = text.lower()
+    return not ("error" in lower_output or "failed" in lower_output or "exception" in lower_output)
+
+
+def build_classify_outputs(size_mb: float) -> dict:
+    """生成成功判断基准的合成输出：{场景: (文本, 期望结果)}"""
+    def repeat(line: str) -> str:
+        return line * max(int(size_mb * 1024 * 1024 / len(line.encode("utf-8"))), 1)
+
+    record = {"file": "src/handlers/upload.py", "severity": "error", "message": "未处理的 exception 分支"}
+    count = max(int(size_mb * 1024 * 1024 / len(json.dumps(record, ensure_ascii=False).encode("utf-8"))), 1)
+    report = {"status": "ok", "summary": f"发现 {count} 个问题", "issues": [record] * count}
+    return {
+        "日志（提到 error，成功）": (
+            repeat("[step] 已处理 src/parser.py：补充 error handling 分支，覆盖 failed 重试路径\n")
+            + "全部完成，共修改 12 个文件。\n",
+            True,
+        ),
+        "日志（末尾异常，失败）": (
+            repeat("[step] 已处理 src/parser.py：格式化并更新导入顺序\n")
+            + "Traceback (most recent call last):\n  File \"run.py\", line 3, in <module>\n"
+            + "RuntimeError: disk full\n",
+            False,
+        ),
+        "审查报告（JSON status: ok）": (
+            "审查完成\n\n```json\n" + json.dumps(report, ensure_ascii=False) + "\n```\n",
+            True,
+        ),
+    }
+
+
+def cmd_classify(args: argparse.Namespace) -> int:
+    """classify 子命令"""
+    from wf_classify import classify_output
+    from wf_output_extractor import extract_from_tool_response
+    from wf_payload import load_payload
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        for scenario, (text, expected) in build_classify_outputs(args.size_mb).items():
+            # JSON 提取与写入节点输出共用，不计入分类耗时
+            json_data = extract_from_tool_response(text).json_data
+            spilled = load_payload(
+                json.dumps({"tool_response": text}, ensure_ascii=False).encode("utf-8"), spill_dir=tmp,
+            )["tool_response"]
+            candidates = {
+                "旧实现（全文关键词）": lambda: legacy_check_success(text),
+                "分类": lambda: classify_output(text, json_data)["verdict"] == "success",
+                "分类（落盘输出）": lambda: classify_output(spilled, json_data)["verdict"] == "success",
+            }
+            for name, func in candidates.items():
+                verdict = func()
+                peak_mb, seconds = measure(func)
+                rows.append({
+                    "key": f"{scenario}:{name}",
+                    "input_mb": round(len(text.encode("utf-8")) / 1024 / 1024, 2),
+                    "verdict": "success" if verdict else "failed",
+                    "correct": verdict == expected,
+                    "peak_mb": round(peak_mb, 2),
+                    "ms": round(seconds * 1000, 3),
+                })
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{'场景':<46} {'输入(MB)':>9} {'结果':>8} {'正确':>5} {'峰值新增内存(MB)':>18} {'耗时(ms)':>10}")
+    for row in rows:
+        print(f"{row['key']:<46} {row['input_mb']:>9.1f} {row['verdict']:>8} {'是' if row['correct'] else '否':>5} "
+              f"{row['peak_mb']:>18.2f} {row['ms']:>10.2f}")
+    return 0 if all(row["correct"] for row in rows if not row["key"].endswith("旧实现（全文关键词）")) else 1
+
+
+EXAMPLE_CONTRACTS_DIR = HOOKS_DIR.parent.parent / "skills" / "contract-development" / "examples"
+
+
+def synthesize_instance(schema) -> object:
+    """按 Schema 合成一个实例（尽量满足约束，pattern 等无法合成的约束不保证满足）"""
+    if not isinstance(schema, dict):
+        return None
+    if "const" in schema:
+        return schema["const"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if schema.get(key):
+            return synthesize_instance(schema[key][0])
+    types = schema.get("type", "object" if "properties" in schema else "string")
+    kind = types[0] if isinstance(types, list) else types
+    if kind == "object":
+        return {k: synthesize_instance(v) for k, v in schema.get("properties", {}).items()}
+    if kind == "array":
+        items = schema.get("items")
+        count = max(schema.get("minItems", 1), 1)
+        return [synthesize_instance(items) for _ in range(count)] if isinstance(items, dict) else []
+    if kind in ("integer", "number"):
+        return schema.get("minimum", 0)
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return "x" * max(schema.get("minLength", 1), 1)
+
+
+def mutate_instances(schema, instance) -> list:
+    """生成校验失败的变体：删除必需字段、替换字段类型、增加未声明字段"""
+    variants = [instance]
+    if isinstance(instance, dict) and isinstance(schema, dict):
+        for key in schema.get("required", []):
+            variants.append({k: v for k, v in instance.items() if k != key})
+        for key, value in instance.items():
+            variants.append({**instance, key: 12345 if isinstance(value, str) else "wrong-type"})
+        variants.append({**instance, "unexpected_field": True})
+    return variants
+
+
+def cmd_contracts(args: argparse.Namespace) -> int:
+    """contracts 子命令"""
+    import timeit
+
+    contract_validator = load_hook_module("contract-validator.py")
+    if not contract_validator.get_jsonschema():
+        print("未安装 jsonschema，无法对比解释执行路径", file=sys.stderr)
+        return 1
+    # span 写入对两条路径相同，不计入校验耗时
+    contract_validator.record_span = lambda *a, **k: None
+
+    sources = [Path(p) for p in args.contracts] or [EXAMPLE_CONTRACTS_DIR]
+    files = sorted(
+        f for source in sources
+        for f in (source.glob("*") if source.is_dir() else [source])
+        if f.suffix in (".yaml", ".json")
+    )
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="wf-bench-") as tmp:
+        os.environ["CLAUDE_PROJECT_DIR"] = tmp
+        contracts_dir = Path(tmp) / ".claude" / "contracts"
+        contracts_dir.mkdir(parents=True)
+        for contract_file in files:
+            shutil.copy(contract_file, contracts_dir / contract_file.name)
+
+        validator = contract_validator.ContractValidator(contracts_dir, result_cache=False)
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                contract_validator.compile_contracts(validator, [])
+            finally:
+                sys.stdout = stdout
+
+        for contract_file in files:
+            name = contract_file.stem
+            contract = validator.load_contract(name)
+            schema = (contract or {}).get("schema")
+            if not schema:
+                continue
+            if validator.load_compiled(name, schema) is None:
+                rows.append({"contract": name, "compiled": False})
+                continue
+
+            # 样本：契约示例（正例/反例）+ 合成实例及其失败变体
+            examples = contract.get("examples") or {}
+            base = examples.get("valid", synthesize_instance(schema))
+            samples = [*mutate_instances(schema, base), *args.sample]
+            if "invalid" in examples:
+                samples.append(examples["invalid"])
+
+            matched = sum(
+                validator.validate_schema(sample, schema) == validator.validate_schema(sample, schema, name)
+                for sample in samples
+            )
+            invalid = sum(not validator.validate_schema(sample, schema)[0] for sample in samples)
+
+            def run(contract_name):
+                for sample in samples:
+                    validator.validate_schema(sample, schema, contract_name)
+
+            calls = args.number * len(samples)
+            interpreted = min(timeit.repeat(lambda: run(None), number=args.number, repeat=3)) / calls
+            compiled = min(timeit.repeat(lambda: run(name), number=args.number, repeat=3)) / calls
+            rows.append({
+                "contract": name,
+                "compiled": True,
+                "samples": len(samples),
+                "invalid_samples": invalid,
+                "parity": f"{matched}/{len(samples)}",
+                "interpreted_us": round(interpreted * 1e6, 2),
+                "compiled_us": round(compiled * 1e6, 2),
+                "speedup": round(interpreted / compiled, 1) if compiled else None,
+            })
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'契约':<28} {'样本(失败)':>10} {'一致':>8} {'jsonschema(µs)':>15} {'编译(µs)':>10} {'加速':>7}")
+        for row in rows:
+            if not row["compiled"]:
+                print(f"{row['contract']:<28} 未编译（含不支持的关键字），校验时使用 jsonschema")
+                continue
+            print(f"{row['contract']:<28} {row['samples']:>5}({row['invalid_samples']:>2}) "
+                  f"{row['parity']:>10} {row['interpreted_us']:>15.2f} {row['compiled_us']:>10.2f} "
+                  f"{row['speedup']:>6.1f}x")
+    return 0 if all(
+        not row["compiled"] or row["parity"].split("/")[0] == row["parity"].split("/")[1] for row in rows
+    ) else 1
+
+
+COLUMNAR_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["id", "score", "status"],
+    "additionalProperties": False,
+    "properties": {
+        "id": {"type": "string", "pattern": "^R-[0-9]+$"},
+        "score": {"type": "number", "minimum": 0, "maximum": 100},
+        "status": {"enum": ["ok", "warn", "fail"]},
+        "count": {"type": "integer", "minimum": 0},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+    },
+}
+
+
+def build_columnar_records(count: int, error_every: int) -> tuple[list[dict], dict[str, list[int]]]:
+    """合成同构记录，每隔 error_every 条注入一个错误（轮流落在不同字段）"""
+    records = [
+        {"id": f"R-{i}", "score": (i * 7) % 100, "status": ("ok", "warn", "fail")[i % 3],
+         "count": i, "tags": ["a", "b"]}
+        for i in range(count)
+    ]
+    injected: dict[str, list[int]] = {}
+    mutations = [
+        ("score", lambda r: r.update(score=-1)),
+        ("id", lambda r: r.update(id="bad")),
+        ("status", lambda r: r.update(status="unknown")),
+        ("required", lambda r: r.pop("count") and r.pop("status")),
+        ("tags", lambda r: r.update(tags=["a", "b", "c", "d"])),
+    ]
+    if error_every > 0:
+        for n, index in enumerate(range(error_every - 1, count, error_every)):
+            name, mutate = mutations[n % len(mutations)]
+            mutate(records[index])
+            injected.setdefault(name, []).append(index)
+    return records, injected
+
+
+def cmd_columnar(args: argparse.Namespace) -> int:
+    """columnar 子命令"""
+    import wf_columnar
+
+    contract_validator = load_hook_module("contract-validator.py")
+    if not contract_validator.get_jsonschema():
+        print("未安装 jsonschema，无法对比", file=sys.stderr)
+        return 1
+    contract_validator.record_span = lambda *a, **k: None
+
+    records, injected = build_columnar_records(args.records, args.error_every)
+    data = {"summary": "bench", "records": records}
+
+    def schema_for(policy) -> dict:
+        array = {"type": "array", "minItems": 1, "items": COLUMNAR_ITEM_SCHEMA}
+        if policy is not None:
+            array["x-columnar"] = policy
+        return {"type": "object", "required": ["summary", "records"],
+                "properties": {"summary": {"type": "string"}, "records": array}}
+
+    validator = contract_validator.ContractValidator(Path(tempfile.gettempdir()), result_cache=False)
+    plain = schema_for(None)
+    scenarios = {
+        "jsonschema validate（契约校验现有路径）": lambda: validator.validate_schema(data, plain)[1],
+        "jsonschema iter_errors（找出全部错误）": lambda: list(
+            contract_validator.get_jsonschema().validators.validator_for(plain)(plain).iter_errors(data)
+        ),
+        "x-columnar 全量": lambda: validator.validate_schema(data, schema_for(True))[1],
+        f"x-columnar 抽样 {args.sample}": lambda: validator.validate_schema(data, schema_for({"sample": args.sample}))[1],
+    }
+
+    rows = []
+    for name, func in scenarios.items():
+        started = time.perf_counter()
+        errors = func()
+        elapsed = time.perf_counter() - started
+        rows.append({
+            "scenario": name,
+            "seconds": round(elapsed, 3),
+            "errors": len(errors),
+            "fields": sorted({e["field"] for e in errors if isinstance(e, dict)}),
+        })
+
+    result = {
+        "records": args.records,
+        "injected": {k: len(v) for k, v in injected.items()},
+        "numpy": bool(wf_columnar.get_numpy()),
+        "results": rows,
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{args.records} 条记录，注入错误 {result['injected']}，NumPy: {'是' if result['numpy'] else '否'}\n")
+    print(f"{'场景':<36} {'耗时(s)':>10} {'错误条数':>8}")
+    for row in rows:
+        print(f"{row['scenario']:<36} {row['seconds']:>10.3f} {row['errors']:>8}")
+    return 0
+
+
+def analyze_blocks(bundle: Path, contract_validator, wf_skeleton) -> dict:
+    """
+    按录制时的契约重新校验录制包中每次 SubagentStop 的节点输出
+
+    Returns:
+        {bundle, injected, checks, blocked, covered, nodes: {node: {checks, blocked}}}
+        covered 为错误字段出现在骨架中（或输出缺少 JSON）的阻止次数
+    """
+    from wf_output_extractor import extract_from_transcript
+
+    hook_parser = argparse.ArgumentParser(add_help=False)
+    hook_parser.add_argument("--contract")
+    hook_parser.add_argument("--node")
+    hook_parser.add_argument("--inject-skeleton", nargs="?", const="ask")
+
+    validator = contract_validator.ContractValidator(
+        bundle / "project" / ".claude" / "contracts", result_cache=False,
+    )
+    report = {"bundle": str(bundle), "injected": False, "checks": 0, "blocked": 0, "covered": 0, "nodes": {}}
+    skeleton_fields: dict[str, set] = {}
+
+    for event in load_events(bundle):
+        options, _ = hook_parser.parse_known_args(event.get("argv", []))
+        payload = event.get("payload") or {}
+        if event.get("event") == "PreToolUse" and options.inject_skeleton:
+            report["injected"] = True
+        snapshot = (event.get("transcripts") or {}).get("agent_transcript_path")
+        if event.get("event") != "SubagentStop" or not options.contract or not snapshot:
+            continue
+        contract = validator.load_contract(options.contract)
+        if not contract:
+            continue
+
+        node = options.node or payload.get("agent_type") or "unknown"
+        data = extract_from_transcript(str(bundle / snapshot)).json_data
+        if data is None:
+            errors = [{"field": "(root)", "message": "输出中未找到 JSON"}]
+            covered = True
+        else:
+            errors = contract_validator.run_contract_layers(validator, contract, data, options.contract)
+            if options.contract not in skeleton_fields:
+                schema = contract.get("schema")
+                fields = wf_skeleton.build_skeleton(schema)["fields"] if isinstance(schema, dict) else []
+                skeleton_fields[options.contract] = set(fields)
+            covered = any(
+                wf_skeleton.normalize_field(error.get("field", "")) in skeleton_fields[options.contract]
+                for error in errors
+            )
+
+        node_stats = report["nodes"].setdefault(node, {"checks": 0, "blocked": 0})
+        report["checks"] += 1
+        node_stats["checks"] += 1
+        if errors:
+            report["blocked"] += 1
+            node_stats["blocked"] += 1
+            report["covered"] += int(covered)
+
+    report["block_rate"] = round(report["blocked"] / report["checks"], 4) if report["checks"] else 0.0
+    return report
+
+
+def cmd_blocks(args: argparse.Namespace) -> int:
+    """blocks 子命令"""
+    import wf_skeleton
+
+    contract_validator = load_hook_module("contract-validator.py")
+    contract_validator.record_span = lambda *a, **k: None
+
+    reports = []
+    for bundle in args.bundles:
+        bundle = Path(bundle)
+        if not (bundle / "events").is_dir():
+            print(f"不是录制包: {bundle}", file=sys.stderr)
+            return 1
+        reports.append(analyze_blocks(bundle, contract_validator, wf_skeleton))
+
+    if args.json:
+        print(json.dumps({"bundles": reports}, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{'录制包':<40} {'骨架':>4} {'校验':>6} {'阻止':>6} {'阻止率':>8} {'骨架已说明':>10}")
+    for report in reports:
+        print(
+            f"{Path(report['bundle']).name:<40} {'是' if report['injected'] else '否':>4} "
+            f"{report['checks']:>6} {report['blocked']:>6} {report['block_rate']:>8.1%} {report['covered']:>10}"
+        )
+        for node, stats in sorted(report["nodes"].items()):
+            rate = stats["blocked"] / stats["checks"] if stats["checks"] else 0.0
+            print(f"  {node:<38} {'':>4} {stats['checks']:>6} {stats['blocked']:>6} {rate:>8.1%}")
+
+    baseline = next((r for r in reports if not r["injected"]), None)
+    for report in reports:
+        if report is baseline or not report["injected"] or baseline is None:
+            continue
+        print(
+            f"\n阻止率 {baseline['block_rate']:.1%} -> {report['block_rate']:.1%}"
+            f"（{Path(baseline['bundle']).name} -> {Path(report['bundle']).name}）"
+        )
+    if baseline is not None and baseline["blocked"]:
+        print(
+            f"未注入骨架时 {baseline['blocked']} 次阻止中，{baseline['covered']} 次的错误字段已在骨架中说明"
+            f"（注入后可避免的上限）"
+        )
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="工作流 Hook 性能基准工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    replay = subparsers.add_parser("replay", help="回放录制的 Hook 事件流并统计延迟")
+    replay.add_argument("bundle", help="录制包目录（WF_RECORD_DIR）")
+    replay.add_argument("--runs", type=int, default=5, help="回放轮数（默认 5）")
+    replay.add_argument("--warmup", type=int, default=1, help="预热轮数，不计入统计（默认 1）")
+    replay.add_argument("--python", default=sys.executable, help="运行 Hook 的 Python 解释器")
+    replay.add_argument("--baseline", help="对比的基线文件")
+    replay.add_argument("--save-baseline", help="将本次结果保存为基线")
+    replay.add_argument("--tolerance", type=float, default=0.2, help="允许的 p95 相对增幅（默认 0.2）")
+    replay.add_argument("--min-delta-ms", type=float, default=2.0, help="判定回退的最小绝对增幅（默认 2ms）")
+    replay.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    replay.set_defaults(func=cmd_replay)
+
+    output = subparsers.add_parser("output", help="测量大节点输出写入的峰值内存")
+    output.add_argument("--size-mb", type=float, default=50, help="合成输出大小（MB，默认 50）")
+    output.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    output.set_defaults(func=cmd_output)
+
+    noop = subparsers.add_parser("noop", help="测量非工作流事件的 Hook 开销（快速路径）")
+    noop.add_argument("--runs", type=int, default=20, help="每个场景的运行次数（默认 20）")
+    noop.add_argument("--python", default=sys.executable, help="运行 Hook 的 Python 解释器")
+    noop.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    noop.set_defaults(func=cmd_noop)
+
+    payload = subparsers.add_parser("payload", help="测量大 tool_response 时 Hook 进程的峰值 RSS")
+    payload.add_argument("--size-mb", type=float, default=50, help="合成输出大小（MB，默认 50）")
+    payload.add_argument("--python", default=sys.executable, help="运行 Hook 的 Python 解释器")
+    payload.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    payload.set_defaults(func=cmd_payload)
+
+    classify = subparsers.add_parser("classify", help="对比大输出上节点成功判断的旧实现与分类")
+    classify.add_argument("--size-mb", type=float, default=20, help="合成输出大小（MB，默认 20）")
+    classify.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    classify.set_defaults(func=cmd_classify)
+
+    contracts = subparsers.add_parser("contracts", help="对比 jsonschema 与编译校验器的校验耗时")
+    contracts.add_argument("contracts", nargs="*", help="契约文件或目录（默认插件示例契约）")
+    contracts.add_argument("--number", type=int, default=1000, help="每轮重复校验全部样本的次数（默认 1000）")
+    contracts.add_argument("--sample", type=json.loads, action="append", default=[],
+                           help="额外的校验样本（JSON，可重复）")
+    contracts.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    contracts.set_defaults(func=cmd_contracts)
+
+    columnar = subparsers.add_parser("columnar", help="对比大型同构数组的逐元素校验与按列校验")
+    columnar.add_argument("--records", type=int, default=100000, help="记录条数（默认 100000）")
+    columnar.add_argument("--error-every", type=int, default=20000, help="每隔多少条注入一个错误（默认 20000，0 为不注入）")
+    columnar.add_argument("--sample", type=int, default=1000, help="抽样策略的样本数（默认 1000）")
+    columnar.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    columnar.set_defaults(func=cmd_columnar)
+
+    blocks = subparsers.add_parser("blocks", help="统计录制包中 SubagentStop 契约校验的阻止率")
+    blocks.add_argument("bundles", nargs="+", help="WF_RECORD_DIR 录制包（可多个，对比未注入与注入骨架的运行）")
+    blocks.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    blocks.set_defaults(func=cmd_blocks)
+
+    return parser.parse_args()
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+wf-hook.py - 工作流 Hook 统一入口
+
+在同一进程中依次执行状态治理（wf-state.py）和契约校验（contract-validator.py），
+替代为同一事件分别注册两个命令的配置：
+- 只启动一次解释器、只解析一次 stdin
+- UserPromptSubmit 时校验直接使用 wf-state 刚解析出的参数，
+  不再依赖另一个进程先写好 .context/params.json（并行执行的 Hook 存在竞态）
+- 两者的结果合并为一个 Hook 响应
+
+执行顺序:
+- Stop: 先校验工作流输出，校验未通过时阻止结束，不标记工作流完成
+- 其他事件: 先更新状态，再校验（未指定 --contract 时只更新状态）
+
+响应合并:
+- 校验阻止时以校验结果为准（UserPromptSubmit/PreToolUse: exit(2) + stderr，
+  SubagentStop/Stop: {"decision": "block"}）
+- 否则保留 wf-state 的输出（包括 hookSpecificOutput），systemMessage 合并；
+  wf-state 未给出 hookSpecificOutput 时采用校验的（--inject-skeleton 修改 Task prompt）
+
+使用说明:
+此脚本由 cc-wf-factory 生成，与 wf-state.py、contract-validator.py 一起放置在
+用户工作流的 .claude/hooks/ 目录。参数为两个脚本参数的并集。
+contract-validator.py 按需加载：只更新状态的事件不加载校验模块（见 get_contract_validator）。
+"""
+
+import os
+import sys
+
+# 快速路径：不在工作流运行中的事件在导入其他模块、加载 wf-state / contract-validator 前直接返回
+_STDIN_RAW = None
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from wf_active import read_stdin_or_exit
+    _STDIN_RAW = read_stdin_or_exit()
+
+import argparse
+import importlib.util
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+_IMPORTS_STARTED = time.perf_counter()
+
+HOOKS_DIR = Path(__file__).parent
+
+# 确保可以从任意工作目录导入同目录下的模块
+sys.path.insert(0, str(HOOKS_DIR))
+from wf_metrics import get_metrics
+from wf_payload import load_payload
+from wf_profile import get_profiler
+from wf_record import record_event
+from wf_trace import record_span
+from wf_validation_args import ValidationDeadline, add_validation_arguments
+
+
+def load_hook_module(filename: str):
+    """按文件名导入同目录下的 Hook 脚本（文件名含连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location(filename.replace("-", "_")[:-3], HOOKS_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+wf_state = load_hook_module("wf-state.py")
+
+_IMPORTS_DONE = time.perf_counter()
+
+_contract_validator = None
+
+
+def get_contract_validator():
+    """
+    按需加载 contract-validator.py（进程内只加载一次）
+
+    只更新状态的事件（未指定 --contract / --inject-skeleton，如 Task 的 PreToolUse / PostToolUse）
+    不加载校验模块及其依赖的 jsonschema、wf_columnar、wf_schema_compiler、wf_skeleton
+    """
+    global _contract_validator
+    if _contract_validator is None:
+        with get_profiler().phase("imports:contract-validator"):
+            _contract_validator = load_hook_module("contract-validator.py")
+    return _contract_validator
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """构建命令行参数解析器（wf_sdk_hooks.py 复用）"""
+    parser = argparse.ArgumentParser(description="工作流 Hook 统一入口（状态治理 + 契约校验）")
+    parser.add_argument("--workflow", type=str, help="工作流名称（用于命令匹配）")
+    parser.add_argument("--metrics-file", type=str, help="Prometheus 指标文件路径（.prom）")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="记录各阶段耗时到 .context/profile.jsonl（等同 WF_PROFILE=1）",
+    )
+    parser.add_argument(
+        "--no-state",
+        action="store_true",
+        help="只做契约校验，不更新状态（用于 agent frontmatter 中的 SubagentStop，"
+             "状态已由 settings.json 中的 wf-hook.py 更新）",
+    )
+    wf_state.add_state_arguments(parser)
+    add_validation_arguments(parser)
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    return build_parser().parse_args()
+
+
+def run_state(input_data: dict, args: argparse.Namespace, shared: dict, state_manager=None) -> dict:
+    """更新工作流状态（失败不应阻塞工作流）"""
+    if state_manager is None:
+        state_manager = wf_state.WorkflowState(wf_state.find_state_file())
+    try:
+        with get_profiler().phase("state"):
+            return wf_state.handle_event(input_data, state_manager, args, shared)
+    except Exception as e:
+        return {
+            "continue": True,
+            "systemMessage": f"wf-state: 状态更新失败 ({e})",
+        }
+
+
+def run_validation(input_data: dict, args: argparse.Namespace, shared: dict, validator=None):
+    """执行契约校验，返回 HookOutcome"""
+    contract_validator = get_contract_validator()
+    if validator is None:
+        validator = contract_validator.ContractValidator(
+            contract_validator.find_contracts_dir(), result_cache=not args.no_validation_cache,
+        )
+    try:
+        with get_profiler().phase("validate"):
+            return contract_validator.dispatch_event(input_data, validator, args, shared)
+    except Exception as e:
+        # 校验脚本自身出错时不阻塞工作流
+        contract_validator.log("ERROR", "契约校验异常",
+                               hook_event=input_data.get("hook_event_name"), error=str(e))
+        return contract_validator.allow_continue(f"contract-validator: 校验异常 ({e})")
+
+
+def merge_responses(state_result: Optional[dict], outcome: Any) -> tuple[Optional[dict], Any]:
+    """
+    合并状态更新与校验结果
+
+    Returns:
+        (合并后的 JSON 输出, 阻止执行的 HookOutcome)，二者只有一个非空
+    """
+    if outcome is not None and outcome.action != "continue":
+        return None, outcome
+
+    result = dict(state_result or {"continue": True})
+    messages = [
+        message
+        for message in (result.get("systemMessage"), outcome.message if outcome else "")
+        if message
+    ]
+    if messages:
+        result["systemMessage"] = "\n".join(messages)
+    if outcome is not None and outcome.hook_output and "hookSpecificOutput" not in result:
+        result["hookSpecificOutput"] = outcome.hook_output
+    return result, None
+
+
+def process_event(
+    input_data: dict,
+    args: argparse.Namespace,
+    state_manager=None,
+    validator=None,
+) -> tuple[Optional[dict], Any]:
+    """
+    按既定顺序执行状态更新与契约校验并合并结果
+
+    Args:
+        state_manager: 复用的 WorkflowState（默认每次从状态文件加载）
+        validator: 复用的 ContractValidator（默认每次新建）
+
+    Returns:
+        同 merge_responses
+    """
+    hook_event = input_data.get("hook_event_name", "")
+
+    # 同一进程内共享的数据：wf-state 解析的参数、transcript 提取结果、校验超时预算（含状态更新耗时）
+    shared: dict = {"deadline": ValidationDeadline(args.hook_timeout)}
+    state_result = None
+    outcome = None
+    run_state_update = not args.no_state
+
+    if hook_event == "Stop" and args.contract:
+        # 先校验工作流输出，未通过时工作流继续运行，不标记完成
+        outcome = run_validation(input_data, args, shared, validator)
+        if outcome.action != "continue":
+            run_state_update = False
+
+    if run_state_update:
+        state_result = run_state(input_data, args, shared, state_manager)
+        shared["deadline"].mark("state")
+
+    # 注入输出骨架：wf-state 已拒绝本次 Task 调用（命中缓存、恢复时跳过）时不再需要
+    inject_skeleton = (
+        hook_event == "PreToolUse"
+        and args.inject_skeleton
+        and "hookSpecificOutput" not in (state_result or {})
+    )
+    if outcome is None and (args.contract or inject_skeleton):
+        outcome = run_validation(input_data, args, shared, validator)
+
+    return merge_responses(state_result, outcome)
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    profiler = get_profiler("wf-hook", args.profile)
+    profiler.add_phase("imports", _IMPORTS_DONE - _IMPORTS_STARTED)
+    metrics = get_metrics(args.metrics_file)
+    hook_started = time.perf_counter()
+    hook_started_ts = time.time()
+
+    # 读取 stdin 输入（只解析一次，大字段落盘）
+    try:
+        with profiler.phase("stdin"):
+            input_data = load_payload(_STDIN_RAW, spill_bytes=args.spill_kb * 1024)
+    except json.JSONDecodeError as e:
+        print(json.dumps({"continue": True, "systemMessage": f"wf-hook: 无法解析输入 ({e})"}))
+        profiler.finish("invalid_input")
+        return
+
+    hook_event = input_data.get("hook_event_name", "")
+    record_event(Path(__file__).name, sys.argv[1:], input_data)
+
+    with profiler.phase(f"handle:{hook_event or 'unknown'}"):
+        result, blocking = process_event(input_data, args)
+
+    hook_duration = time.perf_counter() - hook_started
+    with profiler.phase("metrics"):
+        metrics.observe(
+            "wf_hook_duration_seconds",
+            hook_duration,
+            {"script": "wf-hook", "event": hook_event or "unknown"},
+        )
+        metrics.flush()
+        record_span(
+            hook_event or "unknown", "hook", hook_started_ts, hook_started_ts + hook_duration,
+            script="wf-hook", tool=input_data.get("tool_name") or None,
+            tool_use_id=input_data.get("tool_use_id"), contract=args.contract, node=args.node,
+        )
+    profiler.finish(hook_event)
+
+    if blocking is not None:
+        get_contract_validator().emit_outcome(blocking)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,37 +5,94 @@ wf-state.py - 工作流状态治理 Hook 脚本
 自动维护工作流执行状态文件，支持进度追踪和断点续传。
 
 触发时机:
-- UserPromptSubmit: 检测工作流启动
+- UserPromptSubmit: 检测工作流启动（--resume 时恢复未完成的运行）
 - PreToolUse (Task): 记录节点开始
 - PostToolUse (Task): 记录节点完成/失败，提取输出写入文件
-- Stop: 记录工作流完成
+- SubagentStop: 增量汇总节点 transcript 的 token 用量
+- Stop: 汇总编排会话 token 用量，记录工作流完成（删除运行标记）。
+  需要校验工作流输出时通过 wf-hook.py 注册（先校验，通过后才调用本脚本），
+  不要与 contract-validator.py 分开注册：校验阻止后运行标记已被删除，重试的 Stop 不再校验
 
 输出:
 - .context/state.md: 状态文件（Markdown + YAML frontmatter）
-- .context/outputs/{node-name}.json: 节点原始输出
-- .context/outputs/{node-name}.md: 节点可读输出
+- .context/outputs/{node-name}.json: 节点输出中提取的 JSON 数据
+- .context/outputs/{node-name}.md: 节点可读输出（原始文本，JSON 以链接引用）
+- .context/outputs/{node-name}.history.json: 每次调用的输出记录（原文存于 .context/blobs/）
+- .context/outputs/{node-name}/index.json: 大输出的分片索引（可选，--chunk-size-kb）
+- .context/events.jsonl: 状态变化事件流（--watch 增量查看，可选 socket/FIFO 订阅）
+- .context/active: 工作流运行标记（不存在时非工作流事件走快速路径直接返回）
+- .context/spans.jsonl: Hook 处理耗时记录（--export-trace 导出时间线）
+- Prometheus 指标文件（可选，--metrics-file 或 WF_METRICS_FILE）
+- .context/profile.jsonl: 各阶段耗时剖析（可选，--profile 或 WF_PROFILE=1）
+- Hook 事件录制包（可选，WF_RECORD_DIR，供 wf-bench.py replay 回放）
+- .context/cache/: 节点结果缓存（可选，--cache，输入未变化的节点直接复用上次输出）
+
+契约重试耗尽:
+contract-validator.py 在 SubagentStop / Stop 校验连续未通过、超过重试上限后放行并在
+.context/contract-retries.json 中记为 exhausted；节点完成（PostToolUse）时据此把节点
+标记为失败并告知编排会话，工作流结束（Stop）时把工作流标记为失败。
+
+成功判断:
+先看节点输出契约声明的成功字段，再看提取出的 JSON（error / success / status），最后用
+预编译规则集（--success-rules 可追加）只匹配输出末尾；分类依据记录在节点的 outcome 中（wf_classify）。
+
+大输出:
+tool_response 中超过 --spill-kb 的字符串在读取负载时落盘为临时文件（wf_payload），
+成功判断、blob 存储、JSON 代码块提取、Markdown 写入都分块读取该文件，不在内存中复制原文。
 
 使用说明:
 此脚本由 cc-wf-factory 生成，放置在用户工作流的 .claude/hooks/ 目录。
 状态文件采用 Markdown 格式，人类可直接查看。
 """
 
-import json
 import os
 import sys
+
+# 快速路径：不在工作流运行中的事件在导入其他模块前直接返回
+_STDIN_RAW = None
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from wf_active import read_stdin_or_exit
+    _STDIN_RAW = read_stdin_or_exit(cli_flags=("--export-trace", "--watch", "--render-output"))
+
+import json
+import shutil
 import tempfile
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
+
+_IMPORTS_STARTED = time.perf_counter()
+
+# 确保可以从任意工作目录导入同目录下的模块
+sys.path.insert(0, str(Path(__file__).parent))
 
 try:
     import yaml
 except ImportError:
     yaml = None
 
-# 确保可以从任意工作目录导入同目录下的模块
-sys.path.insert(0, str(Path(__file__).parent))
-from wf_output_extractor import extract_from_tool_response
+from wf_active import clear_active, mark_active, touch_active
+from wf_classify import RuleSet, RuleSetError, classify_output, load_rule_set, load_success_spec
+from wf_output_extractor import (
+    add_usage,
+    aggregate_transcript_usage,
+    cache_hit_rate,
+    diff_usage,
+    empty_usage,
+    extract_from_tool_response,
+    ExtractionResult,
+)
+from wf_metrics import get_metrics
+from wf_payload import SPILL_BYTES, SpilledText, iter_text, load_payload
+from wf_profile import get_profiler
+from wf_events import follow_events, get_events_file, publish_events, rotate_events
+from wf_record import record_event
+from wf_store import BlobStore, ContractRetries, NodeCache, OutputHistory, compute_input_hash
+from wf_trace import build_chrome_trace, load_spans, record_span, rotate_spans
+
+_IMPORTS_DONE = time.perf_counter()
 
 
 def get_project_dir() -> Path:
@@ -53,13 +110,31 @@ def ensure_outputs_dir() -> Path:
     return outputs_dir
 
 
-def write_node_output(node_name: str, tool_response: str) -> Optional[str]:
+def get_output_history() -> OutputHistory:
+    """获取节点输出历史（原文存于 .context/blobs/）"""
+    context_dir = get_project_dir() / ".context"
+    return OutputHistory(context_dir / "outputs", BlobStore(context_dir / "blobs"))
+
+
+def write_node_output(
+    node_name: str,
+    tool_response: Any,
+    tool_use_id: Optional[str] = None,
+    chunk_bytes: int = 0,
+    extraction_result: Optional[ExtractionResult] = None,
+) -> Optional[str]:
     """
     将节点输出写入文件（使用共享模块提取）
 
+    原文以内容寻址方式存入 blob 并追加到节点输出历史；与上次输出相同时
+    只追加历史记录，不重写 .json/.md。
+
     Args:
         node_name: 节点名称
-        tool_response: Task 工具返回的原始响应
+        tool_response: Task 工具返回的原始响应（落盘的大输出为 SpilledText，直接读取临时文件）
+        tool_use_id: Task 调用 ID（记录到输出历史）
+        chunk_bytes: 分片大小上限（字节）；JSON 超过该大小时额外写入分片和索引，0 表示不分片
+        extraction_result: 已提取的结果（调用方判断成功时已提取过，不再重复提取）
 
     Returns:
         输出文件的相对路径（.json），若写入失败则返回 None
@@ -70,100 +145,273 @@ def write_node_output(node_name: str, tool_response: str) -> Optional[str]:
 
     timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
+    profiler = get_profiler()
+
+    # 原文存入 blob（相同内容只存一份）
+    history = get_output_history()
+    with profiler.phase("store_blob"):
+        digest, size = history.blobs.put_stream(lambda: _iter_output_bytes(tool_response))
+    previous = history.load(node_name)
+    entry = {"attempt": tool_use_id, "ts": timestamp, "blob": digest, "size": size}
+
+    if previous and previous[-1].get("blob") == digest and md_path.exists():
+        # 输出未变化，视图文件无需重写
+        entry["json"] = previous[-1].get("json", False)
+        if not entry["json"] or json_path.exists():
+            history.append(node_name, entry)
+            if entry["json"]:
+                return f".context/outputs/{node_name}.json"
+            return f".context/outputs/{node_name}.md"
+
     # 使用共享模块提取输出
-    extraction_result = extract_from_tool_response(tool_response)
+    if extraction_result is None:
+        with profiler.phase("extract"):
+            extraction_result = extract_from_tool_response(tool_response)
 
-    # 写入 JSON 文件（仅当有 JSON 数据时）
+    # 写入 JSON 文件（仅当有 JSON 数据时，流式编码直接写入临时文件）
     json_written = False
     if extraction_result.json_data is not None:
         try:
-            json_content = json.dumps(extraction_result.json_data, ensure_ascii=False, indent=2)
-            _atomic_write(json_path, json_content)
+            with profiler.phase("write_json"):
+                _atomic_write_chunks(json_path, _iter_json(extraction_result.json_data))
             json_written = True
         except Exception:
             pass
 
-    # 写入 Markdown 文件（始终写入 raw_text）
+    # 大输出分片（失败不影响主流程）
+    chunk_index = None
+    if json_written and chunk_bytes > 0:
+        try:
+            with profiler.phase("write_chunks"):
+                chunk_index = write_output_chunks(node_name, extraction_result.json_data, chunk_bytes)
+        except Exception:
+            pass
+
+    # 写入 Markdown 文件（始终写入 raw_text，JSON 已落地时只引用 .json 文件）
     try:
-        md_content = _generate_output_markdown(
-            node_name,
-            extraction_result.json_data if extraction_result.json_data else extraction_result.raw_text,
-            timestamp,
-            raw_text=extraction_result.raw_text
-        )
-        _atomic_write(md_path, md_content)
+        with profiler.phase("write_markdown"):
+            _atomic_write_chunks(md_path, _iter_output_markdown(
+                node_name,
+                extraction_result.json_data if extraction_result.json_data else extraction_result.raw_text,
+                timestamp,
+                raw_text=extraction_result.raw_text,
+                json_file=json_path.name if json_written else None,
+                chunk_index=f"{node_name}/index.json" if chunk_index else None,
+            ))
     except Exception:
         pass  # Markdown 写入失败不影响主流程
 
+    entry["json"] = json_written
+    try:
+        history.append(node_name, entry)
+    except Exception:
+        pass  # 历史记录写入失败不影响主流程
+
     # 返回相对路径（优先返回 JSON 路径）
     if json_written:
         return f".context/outputs/{node_name}.json"
     return f".context/outputs/{node_name}.md"
 
 
-def _generate_output_markdown(
+def _iter_output_bytes(tool_output: Any) -> Iterator[bytes]:
+    """节点输出原文按 UTF-8 分块（与 str 原文或 json.dumps(ensure_ascii=False) 的编码一致）"""
+    for chunk in iter_text(tool_output):
+        yield chunk.encode("utf-8")
+
+
+def _iter_json(data: Any) -> Iterator[str]:
+    """流式编码 JSON（与 json.dumps(indent=2) 输出一致）"""
+    return json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(data)
+
+
+def _iter_output_markdown(
     node_name: str,
     output_data: Any,
     timestamp: str,
-    raw_text: Optional[str] = None
-) -> str:
+    raw_text: Any = None,
+    json_file: Optional[str] = None,
+    chunk_index: Optional[str] = None,
+) -> Iterator[str]:
     """
-    生成节点输出的 Markdown 格式
+    逐段生成节点输出的 Markdown 格式（内嵌 JSON 与原始文本不拼接成整串）
 
     Args:
         node_name: 节点名称
         output_data: 结构化输出数据（JSON）
         timestamp: 时间戳
-        raw_text: 原始文本内容（用于展示完整上下文）
+        raw_text: 原始文本内容（用于展示完整上下文，SpilledText 时分块读取）
+        json_file: 已写入的 JSON 文件名；提供时只引用该文件，不再内嵌 JSON
+        chunk_index: 分片索引相对于输出目录的路径（输出已分片时）
     """
-    lines = [
+    yield "\n".join([
         f"# 节点输出: {node_name}",
         "",
         "## 元信息",
         f"- 执行时间: {timestamp}",
         "- 状态: 成功",
         "",
-    ]
-
-    # 如果有结构化数据，展示 JSON
-    if isinstance(output_data, (dict, list)):
-        lines.extend([
-            "## 结构化数据",
-            "",
-            "```json",
-            json.dumps(output_data, ensure_ascii=False, indent=2),
-            "```",
-            "",
-        ])
+    ])
+
+    # 如果有结构化数据，展示 JSON（已落地为 .json 时只给出链接，避免重复写入）
+    if isinstance(output_data, (dict, list)) and json_file:
+        yield f"\n## 结构化数据\n\n见 [{json_file}]({json_file})\n"
+        if chunk_index:
+            yield f"\n输出较大，已分片，按需读取: [{chunk_index}]({chunk_index})\n"
+    elif isinstance(output_data, (dict, list)):
+        yield "\n## 结构化数据\n\n```json\n"
+        yield from _iter_json(output_data)
+        yield "\n```\n"
 
     # 展示原始文本（如果与结构化数据不同）
     if raw_text:
-        lines.extend([
-            "## 原始输出",
-            "",
-            raw_text,
-            "",
-        ])
+        yield "\n## 原始输出\n\n"
+        yield from iter_text(raw_text)
+        yield "\n"
     elif output_data is None:
-        lines.extend([
-            "## 输出数据",
-            "",
-            "_无输出数据_",
-            "",
-        ])
+        yield "\n## 输出数据\n\n_无输出数据_\n"
     elif isinstance(output_data, str):
-        lines.extend([
-            "## 输出数据",
-            "",
-            output_data,
-            "",
-        ])
+        yield "\n## 输出数据\n\n"
+        yield output_data
+        yield "\n"
 
-    return "\n".join(lines)
 
+# 分片摘要中用于标识元素的字段（按优先级）
+CHUNK_LABEL_FIELDS = ("id", "name", "key", "path", "title")
 
-def _atomic_write(file_path: Path, content: str):
-    """原子写入文件"""
+
+def chunk_dir_for(node_name: str) -> Path:
+    """节点输出分片目录"""
+    return get_project_dir() / ".context" / "outputs" / node_name
+
+
+def _chunk_target(data: Any) -> tuple[str, Optional[str], list]:
+    """
+    选择分片对象
+
+    - 顶层数组：按元素分片
+    - 顶层对象中存在占主体的数组字段：按该数组的元素分片
+    - 其他对象：按顶层键分片
+
+    Returns:
+        (split_by, 数组的 JSON Pointer, 待分片的 [(标签, 值)] 列表)
+    """
+    if isinstance(data, list):
+        return "elements", "", list(enumerate(data))
+
+    sizes = {
+        key: len(value) for key, value in data.items()
+        if isinstance(value, list) and value
+    }
+    if sizes:
+        key = max(sizes, key=lambda k: sizes[k])
+        if sizes[key] > len(data):
+            pointer = "/" + key.replace("~", "~0").replace("/", "~1")
+            return "elements", pointer, list(enumerate(data[key]))
+    return "keys", None, list(data.items())
+
+
+def _chunk_summary(split_by: str, labels: list, values: list) -> str:
+    """分片的简短摘要"""
+    if split_by == "keys":
+        shown = ", ".join(str(label) for label in labels[:5])
+        return f"键: {shown}" + (f" 等 {len(labels)} 个" if len(labels) > 5 else "")
+
+    summary = f"元素 {labels[0]}–{labels[-1]}"
+    first, last = values[0], values[-1]
+    if isinstance(first, dict) and isinstance(last, dict):
+        for field in CHUNK_LABEL_FIELDS:
+            if field in first and field in last:
+                summary += f"（{field}: {str(first[field])[:40]} … {str(last[field])[:40]}）"
+                break
+    return summary
+
+
+def write_output_chunks(node_name: str, data: Any, chunk_bytes: int) -> Optional[str]:
+    """
+    将大输出按顶层数组元素或键拆分为大小受限的分片，并写入索引
+
+    分片写入 .context/outputs/{node}/chunk-NNNN.json，索引 index.json 记录
+    每个分片的范围、数量、大小和摘要；输出未超过上限时清理旧分片。
+
+    Returns:
+        索引文件的相对路径；未分片时返回 None
+    """
+    chunk_dir = chunk_dir_for(node_name)
+    encoded_size = 0
+    if isinstance(data, (dict, list)) and data:
+        json_path = get_project_dir() / ".context" / "outputs" / f"{node_name}.json"
+        encoded_size = json_path.stat().st_size if json_path.exists() else 0
+
+    if encoded_size <= chunk_bytes:
+        if chunk_dir.exists():
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+        return None
+
+    split_by, pointer, entries = _chunk_target(data)
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    chunks: list[dict] = []
+    pending: list[tuple[Any, Any, str]] = []
+    pending_bytes = 0
+
+    def flush():
+        nonlocal pending, pending_bytes
+        number = len(chunks)
+        file_name = f"chunk-{number:04d}.json"
+        labels = [label for label, _, _ in pending]
+        if split_by == "keys":
+            parts = [f"{json.dumps(label, ensure_ascii=False)}: {text}" for label, _, text in pending]
+            body = ["{\n", ",\n".join(parts), "\n}\n"]
+        else:
+            body = ["[\n", ",\n".join(text for _, _, text in pending), "\n]\n"]
+        _atomic_write_chunks(chunk_dir / file_name, body)
+        chunk = {"file": file_name}
+        if split_by == "keys":
+            chunk["keys"] = labels
+        else:
+            chunk["range"] = [labels[0], labels[-1]]
+        chunk.update({
+            "count": len(pending),
+            "bytes": pending_bytes,
+            "summary": _chunk_summary(split_by, labels, [value for _, value, _ in pending]),
+        })
+        chunks.append(chunk)
+        pending, pending_bytes = [], 0
+
+    for label, value in entries:
+        text = json.dumps(value, ensure_ascii=False, indent=2)
+        size = len(text.encode("utf-8"))
+        if pending and pending_bytes + size > chunk_bytes:
+            flush()
+        pending.append((label, value, text))
+        pending_bytes += size
+    if pending:
+        flush()
+
+    index = {
+        "node": node_name,
+        "source": f".context/outputs/{node_name}.json",
+        "split_by": split_by,
+        "pointer": pointer,
+        "total": len(entries),
+        "chunk_bytes": chunk_bytes,
+        "chunks": chunks,
+    }
+    _atomic_write(chunk_dir / "index.json", json.dumps(index, ensure_ascii=False, indent=2))
+
+    # 清理上次输出遗留的多余分片
+    keep = {chunk["file"] for chunk in chunks}
+    for stale in chunk_dir.glob("chunk-*.json"):
+        if stale.name not in keep:
+            stale.unlink()
+    return f".context/outputs/{node_name}/index.json"
+
+
+# 流式写入时的缓冲大小（字符），iterencode 产生的小片段攒够后再写
+WRITE_BUFFER_CHARS = 64 * 1024
+
+
+def _atomic_write_chunks(file_path: Path, chunks: Iterable[str]):
+    """原子写入文件（逐段写入临时文件，小片段合并、大片段切分）"""
     file_path.parent.mkdir(parents=True, exist_ok=True)
     fd, tmp_path = tempfile.mkstemp(
         dir=file_path.parent,
@@ -172,7 +420,23 @@ def _atomic_write(file_path: Path, content: str):
     )
     try:
         with os.fdopen(fd, "w", encoding="utf-8") as f:
-            f.write(content)
+            buffer: list[str] = []
+            buffered = 0
+            for chunk in chunks:
+                if len(chunk) > WRITE_BUFFER_CHARS:
+                    if buffer:
+                        f.write("".join(buffer))
+                        buffer, buffered = [], 0
+                    for start in range(0, len(chunk), WRITE_BUFFER_CHARS):
+                        f.write(chunk[start:start + WRITE_BUFFER_CHARS])
+                    continue
+                buffer.append(chunk)
+                buffered += len(chunk)
+                if buffered >= WRITE_BUFFER_CHARS:
+                    f.write("".join(buffer))
+                    buffer, buffered = [], 0
+            if buffer:
+                f.write("".join(buffer))
         os.replace(tmp_path, file_path)
     except Exception:
         if os.path.exists(tmp_path):
@@ -180,21 +444,29 @@ def _atomic_write(file_path: Path, content: str):
         raise
 
 
+def _atomic_write(file_path: Path, content: str):
+    """原子写入文件"""
+    _atomic_write_chunks(file_path, [content])
+
+
 class WorkflowState:
     """工作流状态管理器"""
 
     def __init__(self, state_file: Path):
         self.state_file = state_file
         self.state = self._load_state()
+        self._pending_events: list[dict] = []  # 保存成功后发布到事件流
 
     def _load_state(self) -> dict:
         """加载现有状态"""
         if not self.state_file.exists():
             return self._create_empty_state()
 
+        profiler = get_profiler()
         try:
-            content = self.state_file.read_text(encoding="utf-8")
-            return self._parse_state_file(content)
+            with profiler.phase("load_state"):
+                content = self.state_file.read_text(encoding="utf-8")
+                return self._parse_state_file(content)
         except Exception:
             return self._create_empty_state()
 
@@ -207,31 +479,45 @@ class WorkflowState:
             "started_at": None,
             "updated_at": None,
             "completed_at": None,
+            "started_ts": None,  # 精确时间（epoch 秒），用于时间线导出
+            "completed_ts": None,
             "current_node": None,
             "progress": "0/0",
             "total_nodes": 0,
             "completed_nodes": 0,
             "outputs": {},  # {node_name: output_file_path}
-            "nodes": {},  # {node_name: {status, started_at, completed_at, summary}}
+            "nodes": {},  # {node_name: {status, started_at, completed_at, summary, usage, attempts}}
             "logs": [],  # [{node, event, timestamp, message}]
+            "usage": {"total": empty_usage(), "orchestrator": empty_usage()},
+            "usage_cursors": {},  # {transcript_path: cursor}，增量统计游标
+            "resume": None,  # {count, from_session, resumed_at, skip}，恢复模式信息
         }
 
     def _parse_state_file(self, content: str) -> dict:
         """解析状态文件"""
         # 提取 YAML frontmatter
         if content.startswith("---"):
-            parts = content.split("---", 2)
-            if len(parts) >= 3:
-                frontmatter = parts[1].strip()
+            # 以行首的 --- 作为结束标记（节点摘要等字段中可能包含 ---）
+            # 兼容早期无 PyYAML 时写出的无结尾换行格式（...: null---）
+            head, sep, _body = content[3:].partition("\n---\n")
+            if not sep:
+                head, sep, _body = content[3:].partition("---\n")
+            if sep:
+                frontmatter = head.strip()
                 if yaml:
-                    state = yaml.safe_load(frontmatter) or {}
+                    with get_profiler().phase("yaml_load"):
+                        state = yaml.safe_load(frontmatter) or {}
                 else:
-                    # 简单解析
+                    # 简单解析（值按 JSON 解码，旧格式的纯文本值原样保留）
                     state = {}
                     for line in frontmatter.split("\n"):
                         if ": " in line:
                             key, value = line.split(": ", 1)
-                            state[key.strip()] = value.strip()
+                            value = value.strip()
+                            try:
+                                state[key.strip()] = json.loads(value)
+                            except ValueError:
+                                state[key.strip()] = value
 
                 # 确保所有必需字段存在
                 base = self._create_empty_state()
@@ -244,6 +530,12 @@ class WorkflowState:
                     base["logs"] = []
                 if "outputs" not in base or not isinstance(base["outputs"], dict):
                     base["outputs"] = {}
+                if not isinstance(base.get("usage"), dict):
+                    base["usage"] = {}
+                base["usage"].setdefault("total", empty_usage())
+                base["usage"].setdefault("orchestrator", empty_usage())
+                if not isinstance(base.get("usage_cursors"), dict):
+                    base["usage_cursors"] = {}
 
                 return base
 
@@ -257,24 +549,166 @@ class WorkflowState:
         """获取显示用时间"""
         return datetime.now().strftime("%H:%M:%S")
 
-    def start_workflow(self, workflow_name: str, session_id: Optional[str] = None, total_nodes: int = 0):
-        """开始工作流"""
+    def start_workflow(
+        self,
+        workflow_name: str,
+        session_id: Optional[str] = None,
+        total_nodes: int = 0,
+        transcript_path: Optional[str] = None,
+    ):
+        """
+        开始工作流
+
+        Args:
+            transcript_path: 编排会话的 transcript，启动前的历史消息不计入用量
+        """
         now = self._get_timestamp()
         self.state["workflow"] = workflow_name
         self.state["session_id"] = session_id
         self.state["status"] = "running"
         self.state["started_at"] = now
         self.state["updated_at"] = now
+        self.state["completed_at"] = None
+        self.state["started_ts"] = round(time.time(), 3)
+        self.state["completed_ts"] = None
         self.state["total_nodes"] = total_nodes
         self.state["completed_nodes"] = 0
         self.state["current_node"] = None
         self.state["progress"] = f"0/{total_nodes}"
         self.state["outputs"] = {}
+        self.state["nodes"] = {}
+        self.state["usage"] = {"total": empty_usage(), "orchestrator": empty_usage()}
+        self.state["usage_cursors"] = {}
+        self.state["resume"] = None
+        self._seed_transcript_cursor(transcript_path)
 
         self._add_log("workflow", "start", f"工作流 '{workflow_name}' 启动")
 
-    def start_node(self, node_name: str):
-        """开始节点执行"""
+    def _seed_transcript_cursor(self, transcript_path: Optional[str]):
+        """从 transcript 当前末尾开始统计用量（此前的历史消息不计入）"""
+        if not transcript_path:
+            return
+        try:
+            offset = Path(transcript_path).stat().st_size
+        except OSError:
+            offset = 0
+        self.state["usage_cursors"][transcript_path] = {"offset": offset}
+
+    def find_resumable(self, workflow_name: str) -> bool:
+        """
+        是否存在可恢复的运行
+
+        条件：同一工作流、未正常完成（中断时仍为 running，或有节点失败），
+        且至少有一个节点已完成。
+        """
+        if self.state.get("workflow") != workflow_name:
+            return False
+        if self.state.get("status") not in ("running", "failed", "paused"):
+            return False
+        return any(
+            info.get("status") == "completed" for info in self.state.get("nodes", {}).values()
+        )
+
+    def resume_workflow(
+        self,
+        session_id: Optional[str] = None,
+        transcript_path: Optional[str] = None,
+        rerun: Optional[list[str]] = None,
+    ):
+        """
+        恢复中断的工作流：保留已完成节点及其输出，其余节点重置为待执行
+
+        Args:
+            rerun: 强制重新执行的已完成节点
+        """
+        now = self._get_timestamp()
+        rerun = set(rerun or [])
+        previous_session = self.state.get("session_id")
+
+        skip = []
+        for node_name, node_info in self.state["nodes"].items():
+            if node_info.get("status") == "completed" and node_name not in rerun:
+                skip.append(node_name)
+                continue
+            node_info.update({"status": "pending", "completed_at": None, "summary": None})
+            self.state["outputs"].pop(node_name, None)
+
+        resume = self.state.get("resume") or {}
+        self.state["resume"] = {
+            "count": resume.get("count", 0) + 1,
+            "from_session": previous_session,
+            "resumed_at": now,
+            "skip": skip,
+        }
+        self.state["session_id"] = session_id
+        self.state["status"] = "running"
+        self.state["updated_at"] = now
+        self.state["completed_at"] = None
+        self.state["completed_ts"] = None
+        self.state["current_node"] = None
+        self.state["completed_nodes"] = len(skip)
+        self.state["progress"] = f"{len(skip)}/{self.state.get('total_nodes', 0)}"
+        self._seed_transcript_cursor(transcript_path)
+
+        self._add_log("workflow", "resume", f"从会话 {previous_session or '-'} 恢复，跳过 {len(skip)} 个已完成节点")
+
+    def is_resume_skipped(self, node_name: str) -> bool:
+        """节点是否在恢复时已完成（不应重新执行）"""
+        resume = self.state.get("resume") or {}
+        return node_name in (resume.get("skip") or [])
+
+    def skip_node(self, node_name: str):
+        """记录跳过已完成节点的重复调用"""
+        self.state["updated_at"] = self._get_timestamp()
+        self._add_log(node_name, "skip", f"节点 '{node_name}' 已在中断前完成，跳过")
+
+    def record_contract_failure(self, node_name: str, failure: dict):
+        """记录契约校验重试耗尽（failure 为 ContractRetries 条目）"""
+        self.state["updated_at"] = self._get_timestamp()
+        target = "工作流输出" if node_name == "workflow" else f"节点 '{node_name}' 输出"
+        self._add_log(
+            node_name, "contract_exhausted",
+            f"{target} {failure.get('attempts')} 次未通过契约 '{failure.get('contract')}'",
+            contract=failure.get("contract"), attempts=failure.get("attempts"),
+        )
+
+    def build_resume_plan(self) -> str:
+        """生成注入编排会话的恢复计划"""
+        nodes = self.state.get("nodes", {})
+        outputs = self.state.get("outputs", {})
+        resume = self.state.get("resume") or {}
+        skip = resume.get("skip") or []
+        pending = [name for name in nodes if name not in skip]
+
+        lines = [
+            f"[wf-state] 工作流 '{self.state.get('workflow')}' 从中断处恢复"
+            f"（第 {resume.get('count', 1)} 次恢复，已完成 {len(skip)} 个节点）。",
+            "已完成节点不要重新调用，直接读取其输出：",
+        ]
+        for name in skip:
+            lines.append(f"- {name}: {outputs.get(name) or '无输出文件'}")
+        if pending:
+            lines.append("需要重新执行: " + ", ".join(pending))
+        lines.append("其余尚未开始的节点按工作流定义继续执行。")
+        lines.append(
+            f"如需强制重跑已完成节点，重新提交命令并附加 {RERUN_PARAM} 节点1,节点2；"
+            f"完全重新开始请附加 {RESTART_PARAM}。"
+        )
+        return "\n".join(lines)
+
+    def start_node(
+        self,
+        node_name: str,
+        tool_use_id: Optional[str] = None,
+        input_hash: Optional[str] = None,
+    ):
+        """
+        开始节点执行
+
+        Args:
+            tool_use_id: Task 调用 ID，用于区分同一节点的并行实例和重试
+            input_hash: 节点输入哈希（启用缓存时），节点成功后以此为键写入缓存
+        """
         now = self._get_timestamp()
         self.state["current_node"] = node_name
         self.state["updated_at"] = now
@@ -290,26 +724,70 @@ class WorkflowState:
             completed = self.state.get("completed_nodes", 0)
             self.state["progress"] = f"{completed}/{total}"
 
-        self.state["nodes"][node_name].update({
+        started_ts = round(time.time(), 3)
+        node_info = self.state["nodes"][node_name]
+        node_info.update({
             "status": "running",
             "started_at": now,
+            "started_ts": started_ts,  # 精确开始时间，用于计算耗时
             "completed_at": None,
+            "duration_s": None,
             "summary": None,
         })
+        attempt = {
+            "id": tool_use_id,
+            "started_ts": started_ts,
+            "completed_ts": None,
+            "status": "running",
+        }
+        if input_hash:
+            attempt["input_hash"] = input_hash
+        node_info.setdefault("attempts", []).append(attempt)
 
         self._add_log(node_name, "start", f"节点 '{node_name}' 开始执行")
 
-    def complete_node(self, node_name: str, success: bool = True, summary: str = "", output_path: Optional[str] = None):
-        """完成节点执行"""
+    def complete_node(
+        self,
+        node_name: str,
+        success: bool = True,
+        summary: str = "",
+        output_path: Optional[str] = None,
+        tool_use_id: Optional[str] = None,
+        cached: bool = False,
+        outcome: Optional[dict] = None,
+    ):
+        """
+        完成节点执行
+
+        Args:
+            cached: 是否复用了缓存输出（节点未实际执行）
+            outcome: 成功判断的分类结果（wf_classify，记录判断依据）
+        """
         now = self._get_timestamp()
         self.state["updated_at"] = now
 
         if node_name in self.state["nodes"]:
-            self.state["nodes"][node_name].update({
-                "status": "completed" if success else "failed",
+            node_info = self.state["nodes"][node_name]
+            completed_ts = round(time.time(), 3)
+            status = "completed" if success else "failed"
+
+            # 按 tool_use_id 匹配本次调用，并行实例各自计时
+            attempt = self._find_attempt(node_info, tool_use_id)
+            if attempt is not None:
+                attempt["completed_ts"] = completed_ts
+                attempt["status"] = status
+                if cached:
+                    attempt["cached"] = True
+            started_ts = (attempt or node_info).get("started_ts")
+
+            node_info.update({
+                "status": status,
                 "completed_at": now,
+                "duration_s": round(completed_ts - started_ts, 3) if started_ts else None,
                 "summary": summary or ("执行成功" if success else "执行失败"),
             })
+            if outcome:
+                node_info["outcome"] = outcome
 
         if success:
             self.state["completed_nodes"] = self.state.get("completed_nodes", 0) + 1
@@ -324,39 +802,139 @@ class WorkflowState:
             self.state["outputs"][node_name] = output_path
 
         status_text = "完成" if success else "失败"
-        self._add_log(node_name, "complete", f"节点 '{node_name}' {status_text}")
+        if cached:
+            status_text = "复用缓存输出"
+        node_info = self.state["nodes"].get(node_name, {})
+        self._add_log(
+            node_name, "complete", f"节点 '{node_name}' {status_text}",
+            status=node_info.get("status"), duration_s=node_info.get("duration_s"),
+            output=output_path, cached=cached or None,
+            reason=(outcome or {}).get("reason") if not success else None,
+        )
 
         # 如果当前节点完成，清除 current_node
         if self.state.get("current_node") == node_name:
             self.state["current_node"] = None
 
+    def get_attempt(self, node_name: str, tool_use_id: Optional[str] = None) -> Optional[dict]:
+        """获取节点的某次调用记录"""
+        node_info = self.state["nodes"].get(node_name)
+        if node_info is None:
+            return None
+        return self._find_attempt(node_info, tool_use_id)
+
+    @staticmethod
+    def _find_attempt(node_info: dict, tool_use_id: Optional[str]) -> Optional[dict]:
+        """查找对应的节点调用记录（无 ID 时取最近一次未结束的调用）"""
+        attempts = node_info.get("attempts") or []
+        if tool_use_id:
+            for attempt in reversed(attempts):
+                if attempt.get("id") == tool_use_id:
+                    return attempt
+        for attempt in reversed(attempts):
+            if attempt.get("completed_ts") is None:
+                return attempt
+        return None
+
+    def resolve_running_node(self, agent_type: Optional[str] = None) -> Optional[str]:
+        """
+        推断 SubagentStop 对应的节点
+
+        优先使用事件中的 agent_type，其次是唯一处于运行中的节点，最后回退到 current_node。
+        """
+        nodes = self.state.get("nodes", {})
+        if agent_type and agent_type in nodes:
+            return agent_type
+
+        running = [name for name, info in nodes.items() if info.get("status") == "running"]
+        if len(running) == 1:
+            return running[0]
+        return self.state.get("current_node")
+
+    def record_usage(
+        self,
+        transcript_path: str,
+        node_name: Optional[str] = None,
+        tool_use_id: Optional[str] = None,
+    ) -> dict:
+        """
+        增量汇总 transcript 的 token 用量并累加到节点和工作流总计
+
+        Args:
+            transcript_path: transcript 文件路径
+            node_name: 节点名称（None 表示编排会话本身）
+            tool_use_id: 节点的 Task 调用 ID，用量同时记入对应的 attempts 条目
+                （无 ID 时记入最近一次未结束的调用）
+
+        Returns:
+            本次新增的用量
+        """
+        cursors = self.state["usage_cursors"]
+        previous = cursors.get(transcript_path) or {}
+        with get_profiler().phase("usage"):
+            cursor = aggregate_transcript_usage(transcript_path, previous)
+        if cursor.get("offset", 0) < (previous.get("offset") or 0):
+            # transcript 被截断或替换，游标从头重新统计：新的计数全部是增量
+            delta = add_usage(empty_usage(), cursor.get("usage") or {})
+        else:
+            delta = diff_usage(cursor.get("usage") or {}, previous.get("usage") or {})
+        cursors[transcript_path] = cursor
+
+        usage = self.state["usage"]
+        add_usage(usage["total"], delta)
+        if node_name and node_name in self.state["nodes"]:
+            node_info = self.state["nodes"][node_name]
+            add_usage(node_info.setdefault("usage", empty_usage()), delta)
+            attempt = self._find_attempt(node_info, tool_use_id)
+            if attempt is not None:
+                add_usage(attempt.setdefault("usage", empty_usage()), delta)
+        else:
+            add_usage(usage["orchestrator"], delta)
+
+        self.state["updated_at"] = self._get_timestamp()
+        return delta
+
     def complete_workflow(self, success: bool = True):
         """完成工作流"""
         now = self._get_timestamp()
         self.state["status"] = "completed" if success else "failed"
         self.state["updated_at"] = now
         self.state["completed_at"] = now
+        self.state["completed_ts"] = round(time.time(), 3)
         self.state["current_node"] = None
 
         status_text = "完成" if success else "失败"
-        self._add_log("workflow", "complete", f"工作流 {status_text}")
+        self._add_log("workflow", "complete", f"工作流 {status_text}", status=self.state["status"])
 
-    def _add_log(self, node: str, event: str, message: str):
-        """添加日志条目"""
+    def _add_log(self, node: str, event: str, message: str, **details: Any):
+        """添加日志条目，并记录待发布的状态事件"""
         self.state["logs"].append({
             "node": node,
             "event": event,
             "timestamp": self._get_time_display(),
             "message": message,
         })
+        entry = {
+            "ts": round(time.time(), 3),
+            "workflow": self.state.get("workflow"),
+            "node": node,
+            "event": event,
+            "message": message,
+            "progress": self.state.get("progress"),
+        }
+        entry.update({k: v for k, v in details.items() if v is not None})
+        self._pending_events.append(entry)
 
     def save(self):
         """保存状态文件（原子写入）"""
+        profiler = get_profiler()
+
         # 确保目录存在
         self.state_file.parent.mkdir(parents=True, exist_ok=True)
 
         # 生成文件内容
-        content = self._generate_state_file()
+        with profiler.phase("render_state"):
+            content = self._generate_state_file()
 
         # 原子写入：先写入临时文件，再重命名
         fd, tmp_path = tempfile.mkstemp(
@@ -365,16 +943,22 @@ class WorkflowState:
             suffix=".tmp"
         )
         try:
-            with os.fdopen(fd, "w", encoding="utf-8") as f:
-                f.write(content)
-            # 重命名（原子操作）
-            os.replace(tmp_path, self.state_file)
+            with profiler.phase("save_state"):
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                # 重命名（原子操作）
+                os.replace(tmp_path, self.state_file)
         except Exception:
             # 清理临时文件
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
             raise
 
+        # 状态已落盘，发布本次的状态事件
+        with profiler.phase("publish_events"):
+            publish_events(self._pending_events)
+        self._pending_events = []
+
     def _generate_state_file(self) -> str:
         """生成状态文件内容"""
         # 计算 progress
@@ -390,26 +974,28 @@ class WorkflowState:
             "started_at": self.state.get("started_at"),
             "updated_at": self.state.get("updated_at"),
             "completed_at": self.state.get("completed_at"),
+            "started_ts": self.state.get("started_ts"),
+            "completed_ts": self.state.get("completed_ts"),
             "current_node": self.state.get("current_node"),
             "progress": progress,
             "total_nodes": total,
             "completed_nodes": completed,
             "outputs": self.state.get("outputs", {}),
+            "nodes": self.state.get("nodes", {}),
+            "usage": self.state.get("usage", {}),
+            "usage_cursors": self.state.get("usage_cursors", {}),
+            "resume": self.state.get("resume"),
         }
 
         if yaml:
-            frontmatter_str = yaml.dump(frontmatter, default_flow_style=False, allow_unicode=True)
+            with get_profiler().phase("yaml_dump"):
+                frontmatter_str = yaml.dump(frontmatter, default_flow_style=False, allow_unicode=True)
         else:
-            # 简单格式化
+            # 简单格式化：每个字段一行，值为 JSON（嵌套的 nodes、usage 等也能读回）
             lines = []
             for k, v in frontmatter.items():
-                if v is None:
-                    lines.append(f"{k}: null")
-                elif isinstance(v, str):
-                    lines.append(f"{k}: {v}")
-                else:
-                    lines.append(f"{k}: {v}")
-            frontmatter_str = "\n".join(lines)
+                lines.append(f"{k}: {json.dumps(v, ensure_ascii=False, default=str)}")
+            frontmatter_str = "\n".join(lines) + "\n"
 
         # 状态图标
         status_icons = {
@@ -445,12 +1031,20 @@ class WorkflowState:
             f"- **状态**: {status_display}",
             f"- **进度**: {progress} 节点完成",
             f"- **当前节点**: {current or '-'}",
+        ]
+        resume = self.state.get("resume")
+        if resume:
+            body_parts.append(
+                f"- **恢复**: 第 {resume.get('count', 1)} 次，"
+                f"跳过已完成节点 {', '.join(resume.get('skip') or []) or '-'}"
+            )
+        body_parts.extend([
             "",
             "## 节点状态",
             "",
             "| 节点 | 状态 | 开始时间 | 完成时间 | 输出 |",
             "|------|------|----------|----------|------|",
-        ]
+        ])
 
         # 节点表格
         nodes = self.state.get("nodes", {})
@@ -476,6 +1070,9 @@ class WorkflowState:
         if not nodes:
             body_parts.append("| - | - | - | - | 暂无节点记录 |")
 
+        # Token 用量
+        body_parts.extend(self._generate_usage_section(nodes))
+
         # 执行日志
         body_parts.extend([
             "",
@@ -508,6 +1105,34 @@ class WorkflowState:
         # 组合完整文件
         return f"---\n{frontmatter_str}---\n\n" + "\n".join(body_parts)
 
+    def _generate_usage_section(self, nodes: dict) -> list[str]:
+        """生成 Token 用量表格"""
+        usage = self.state.get("usage", {})
+        total = usage.get("total") or empty_usage()
+        if not total.get("messages"):
+            return []
+
+        def row(name: str, item: dict) -> str:
+            return (
+                f"| {name} | {item.get('input_tokens', 0)} | {item.get('output_tokens', 0)} "
+                f"| {item.get('cache_creation_input_tokens', 0)} | {item.get('cache_read_input_tokens', 0)} "
+                f"| {cache_hit_rate(item):.1%} |"
+            )
+
+        lines = [
+            "",
+            "## Token 用量",
+            "",
+            "| 节点 | 输入 | 输出 | 缓存写入 | 缓存读取 | 缓存命中率 |",
+            "|------|------|------|----------|----------|------------|",
+        ]
+        for node_name, node_info in nodes.items():
+            if node_info.get("usage"):
+                lines.append(row(node_name, node_info["usage"]))
+        lines.append(row("(编排)", usage.get("orchestrator") or empty_usage()))
+        lines.append(row("**合计**", total))
+        return lines
+
 
 def find_state_file() -> Path:
     """查找状态文件路径"""
@@ -517,6 +1142,11 @@ def find_state_file() -> Path:
     return Path.cwd() / ".context" / "state.md"
 
 
+# 恢复模式的控制参数（从工作流参数中剔除，不写入 params.json）
+RERUN_PARAM = "--wf-rerun"
+RESTART_PARAM = "--wf-restart"
+
+
 def extract_node_name(tool_input: dict) -> Optional[str]:
     """从 Task 工具输入中提取节点名称"""
     return tool_input.get("subagent_type")
@@ -681,39 +1311,21 @@ def write_params_files(params: dict, workflow_name: str) -> None:
     _atomic_write(md_path, "\n".join(md_lines))
 
 
-def check_node_success(tool_output: Any) -> tuple[bool, str]:
+def check_node_success(
+    tool_output: Any,
+    json_data: Any = None,
+    success_spec: Optional[dict] = None,
+    rule_set: Optional[RuleSet] = None,
+) -> tuple[bool, str, dict]:
     """
-    检查节点执行是否成功
+    检查节点执行是否成功（分类规则见 wf_classify）
 
     Returns:
-        (success, summary)
+        (success, summary, outcome)
     """
-    if tool_output is None:
-        return True, "执行完成"
-
-    if isinstance(tool_output, dict):
-        # 检查常见的错误标识
-        if tool_output.get("error"):
-            return False, str(tool_output.get("error"))[:100]
-        if tool_output.get("status") == "failed":
-            return False, tool_output.get("message", "执行失败")[:100]
-        if tool_output.get("status") == "error":
-            return False, tool_output.get("message", "执行出错")[:100]
-
-        # 尝试提取摘要
-        summary = tool_output.get("summary") or tool_output.get("message") or "执行完成"
-        if isinstance(summary, str) and len(summary) > 100:
-            summary = summary[:97] + "..."
-        return True, summary
-
-    if isinstance(tool_output, str):
-        # 检查是否包含错误关键词
-        lower_output = tool_output.lower()
-        if "error" in lower_output or "failed" in lower_output or "exception" in lower_output:
-            return False, tool_output[:100] if len(tool_output) > 100 else tool_output
-        return True, tool_output[:100] if len(tool_output) > 100 else tool_output
-
-    return True, "执行完成"
+    outcome = classify_output(tool_output, json_data, success_spec, rule_set)
+    summary = outcome.pop("summary")
+    return outcome["verdict"] == "success", summary, outcome
 
 
 def parse_args():
@@ -721,25 +1333,227 @@ def parse_args():
     import argparse
     parser = argparse.ArgumentParser(description="工作流状态治理脚本")
     parser.add_argument("--workflow", type=str, help="工作流名称（用于命令匹配）")
+    parser.add_argument("--metrics-file", type=str, help="Prometheus 指标文件路径（.prom）")
+    parser.add_argument(
+        "--export-trace",
+        nargs="?",
+        const=".context/trace.json",
+        metavar="PATH",
+        help="导出当前工作流的 Chrome Trace JSON（默认 .context/trace.json）后退出",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="记录各阶段耗时到 .context/profile.jsonl（等同 WF_PROFILE=1）",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="在终端实时查看工作流事件（增量读取 .context/events.jsonl）",
+    )
+    parser.add_argument(
+        "--new-only",
+        action="store_true",
+        help="配合 --watch 只显示启动后的新事件",
+    )
+    parser.add_argument(
+        "--render-output",
+        metavar="NODE",
+        help="从输出历史渲染节点的完整 Markdown（含内嵌 JSON）到标准输出后退出",
+    )
+    parser.add_argument(
+        "--attempt",
+        type=int,
+        default=-1,
+        help="配合 --render-output 选择历史记录下标（默认 -1，即最近一次）",
+    )
+    add_state_arguments(parser)
     return parser.parse_args()
 
 
-def main():
-    """主函数"""
-    # 解析命令行参数
-    args = parse_args()
-    expected_workflow = args.workflow
+def add_state_arguments(parser: Any) -> None:
+    """状态治理参数（wf-hook.py 复用）"""
+    parser.add_argument(
+        "--chunk-size-kb",
+        type=int,
+        default=0,
+        help="节点 JSON 输出超过该大小（KB）时按顶层数组元素或键分片，写入 .context/outputs/{node}/（默认不分片）",
+    )
+    parser.add_argument(
+        "--success-rules",
+        metavar="PATH",
+        help="节点成功判断的自定义文本规则（YAML / JSON，只作用于输出末尾，格式见 wf_classify.py）",
+    )
+    parser.add_argument(
+        "--spill-kb",
+        type=int,
+        default=SPILL_BYTES // 1024,
+        help=f"tool_response 中超过该大小（KB）的字符串落盘为临时文件，分块处理（默认 {SPILL_BYTES // 1024}，0 表示不落盘）",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="恢复模式：同一工作流以相同参数重新启动时保留已完成节点，拒绝重复执行",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="启用节点结果缓存：输入（节点类型 + prompt + 引用文件）未变化时复用上次成功输出",
+    )
+    parser.add_argument("--cache-ttl", type=float, default=24, help="缓存有效期（小时，默认 24）")
+    parser.add_argument("--cache-max-mb", type=float, default=256, help="缓存总大小上限（MB，默认 256）")
+    parser.add_argument(
+        "--no-cache-node",
+        action="append",
+        default=[],
+        metavar="NODE",
+        help="不缓存的节点（可重复指定，如有副作用或依赖外部状态的节点）",
+    )
 
-    # 读取 stdin 输入
+
+def read_previous_params() -> Optional[dict]:
+    """读取上次运行写入的 params.json"""
     try:
-        input_data = json.load(sys.stdin)
-    except json.JSONDecodeError as e:
-        result = {
-            "continue": True,
-            "systemMessage": f"wf-state: 无法解析输入 ({e})",
-        }
-        print(json.dumps(result))
-        return
+        return json.loads((get_project_dir() / ".context" / "params.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def pop_resume_controls(params: dict) -> tuple[bool, list[str]]:
+    """
+    从工作流参数中取出恢复控制参数
+
+    Returns:
+        (restart, rerun_nodes)
+    """
+    restart = bool(params.pop(RESTART_PARAM[2:], False))
+    rerun = params.pop(RERUN_PARAM[2:], None)
+    if not isinstance(rerun, str):
+        return restart, []
+    return restart, [name.strip() for name in rerun.split(",") if name.strip()]
+
+
+def get_node_cache(args: Any) -> NodeCache:
+    """按命令行参数创建节点结果缓存"""
+    return NodeCache(
+        get_project_dir() / ".context" / "cache",
+        ttl_seconds=args.cache_ttl * 3600,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+    )
+
+
+def get_contract_retries() -> ContractRetries:
+    """契约校验重试计数（contract-validator.py 写入）"""
+    return ContractRetries(get_project_dir() / ".context")
+
+
+def get_rule_set(args: Any) -> Optional[RuleSet]:
+    """成功判断的文本规则集（未指定或规则文件无效时使用默认规则，不影响主流程）"""
+    path = getattr(args, "success_rules", None)
+    if not path:
+        return None
+    if not os.path.isabs(path):
+        path = str(get_project_dir() / path)
+    try:
+        return load_rule_set(path)
+    except (RuleSetError, ValueError) as e:
+        print(f"wf-state: 成功判断规则无效，使用默认规则 ({e})", file=sys.stderr)
+        return None
+
+
+def _node_success_spec(node_name: str) -> Optional[dict]:
+    """节点输出契约中的成功字段（读取失败不影响主流程）"""
+    try:
+        return load_success_spec(get_project_dir(), node_name)
+    except Exception:
+        return None
+
+
+def pop_contract_failure(session_id: Optional[str], node_name: str) -> Optional[dict]:
+    """取出节点重试耗尽的契约校验记录（读取失败时视为没有）"""
+    try:
+        return get_contract_retries().pop_exhausted(session_id, node_name)
+    except Exception:
+        return None
+
+
+def export_trace(output: str) -> Path:
+    """将状态文件和 spans 记录合并导出为 Chrome Trace JSON"""
+    state = WorkflowState(find_state_file()).state
+    now = time.time()
+    since = state.get("started_ts")
+    until = state.get("completed_ts")
+    # 留出余量，包含工作流启动/结束时同一事件中的其他 Hook
+    spans = load_spans(
+        since=since - 5 if since else None,
+        until=until + 5 if until else None,
+    )
+    trace = build_chrome_trace(state, spans, now)
+
+    output_path = Path(output)
+    if not output_path.is_absolute():
+        output_path = get_project_dir() / output_path
+    _atomic_write(output_path, json.dumps(trace, ensure_ascii=False))
+    return output_path
+
+
+def format_event(event: dict) -> str:
+    """格式化一条事件用于终端显示"""
+    timestamp = datetime.fromtimestamp(event.get("ts", 0)).strftime("%H:%M:%S")
+    line = f"{timestamp} [{event.get('progress') or '-':>5}] {event.get('message', '')}"
+    if event.get("duration_s") is not None:
+        line += f" ({event['duration_s']:.1f}s)"
+    if event.get("output"):
+        line += f" → {event['output']}"
+    return line
+
+
+def watch_events(new_only: bool = False) -> None:
+    """在终端持续显示新事件，Ctrl-C 退出"""
+    events_file = get_events_file()
+    print(f"wf-state: 正在跟随 {events_file}（Ctrl-C 退出）", file=sys.stderr)
+    try:
+        for event in follow_events(events_file, from_start=not new_only):
+            print(format_event(event), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+def render_output(node_name: str, index: int) -> Optional[Iterator[str]]:
+    """按需从 blob 渲染节点某次调用的完整 Markdown（逐段返回）"""
+    record = get_output_history().read(node_name, index)
+    if record is None:
+        return None
+    entry, raw = record
+    extraction_result = extract_from_tool_response(raw)
+    return _iter_output_markdown(
+        node_name,
+        extraction_result.json_data if extraction_result.json_data else extraction_result.raw_text,
+        entry.get("ts", ""),
+        raw_text=extraction_result.raw_text,
+    )
+
+
+def handle_event(
+    input_data: dict,
+    state_manager: WorkflowState,
+    args: Any,
+    shared: Optional[dict] = None,
+) -> dict:
+    """
+    处理一次 Hook 事件并更新状态
+
+    Args:
+        input_data: Hook 输入
+        state_manager: 状态管理器
+        args: 命令行参数（workflow）
+        shared: 同一进程内共享的数据（wf-hook.py 传入，UserPromptSubmit 时写入 params）
+
+    Returns:
+        Hook 输出 JSON
+    """
+    expected_workflow = args.workflow
+    metrics = get_metrics()
 
     # 获取 Hook 事件信息
     hook_event = input_data.get("hook_event_name", "")
@@ -750,87 +1564,338 @@ def main():
         tool_output = input_data.get("tool_result")  # 兼容旧字段名
     user_prompt = input_data.get("prompt", "")  # UserPromptSubmit 事件的用户输入
     session_id = input_data.get("session_id")  # 会话 ID
+    tool_use_id = input_data.get("tool_use_id")  # Task 调用 ID
+    transcript_path = input_data.get("transcript_path")  # 编排会话 transcript
 
-    # 初始化状态管理器
-    state_file = find_state_file()
-    state_manager = WorkflowState(state_file)
+    if hook_event != "UserPromptSubmit":
+        # 运行中刷新运行标记；状态不是 running 时标记是遗留的，删除后快速路径生效
+        if state_manager.state.get("status") == "running":
+            touch_active()
+        else:
+            clear_active()
+
+    if hook_event == "UserPromptSubmit":
+        # 检测工作流启动
+        workflow_name = extract_workflow_name(user_prompt, expected_workflow)
+        if workflow_name:
+            # 解析工作流参数
+            params = parse_workflow_params(user_prompt)
+            restart, rerun = pop_resume_controls(params)
+
+            # 参数相同的未完成运行才能恢复，否则已完成节点的输出已失效
+            resuming = (
+                args.resume
+                and not restart
+                and state_manager.find_resumable(workflow_name)
+                and read_previous_params() == params
+            )
 
-    try:
-        if hook_event == "UserPromptSubmit":
-            # 检测工作流启动
-            workflow_name = extract_workflow_name(user_prompt, expected_workflow)
-            if workflow_name:
-                # 解析工作流参数
-                params = parse_workflow_params(user_prompt)
-
-                # 写入参数文件
+            # 写入参数文件
+            with get_profiler().phase("write_params"):
                 write_params_files(params, workflow_name)
+            if shared is not None:
+                shared["params"] = params
 
+            if resuming:
+                state_manager.resume_workflow(
+                    session_id=session_id, transcript_path=transcript_path, rerun=rerun
+                )
+                state_manager.save()
+                mark_active(workflow_name)
+                metrics.inc("wf_runs_resumed_total", {"workflow": workflow_name})
+                result = {
+                    "continue": True,
+                    "systemMessage": f"wf-state: 工作流 '{workflow_name}' 从中断处恢复",
+                    "hookSpecificOutput": {
+                        "hookEventName": "UserPromptSubmit",
+                        "additionalContext": state_manager.build_resume_plan(),
+                    },
+                }
+            else:
                 # 启动工作流
-                state_manager.start_workflow(workflow_name, session_id=session_id)
+                rotate_spans()
+                rotate_events()
+                get_contract_retries().reset()
+                with get_profiler().phase("gc_blobs"):
+                    get_output_history().collect_garbage()
+                state_manager.start_workflow(
+                    workflow_name, session_id=session_id, transcript_path=transcript_path
+                )
                 state_manager.save()
+                mark_active(workflow_name)
+                metrics.inc("wf_runs_started_total", {"workflow": workflow_name})
 
                 result = {
                     "continue": True,
                     "systemMessage": f"wf-state: 工作流 '{workflow_name}' 已初始化，参数已写入 .context/params.json",
                 }
-            else:
-                # 不是工作流命令，忽略
-                result = {"continue": True}
-
-        elif hook_event == "PreToolUse" and tool_name == "Task":
-            # 记录节点开始
-            node_name = extract_node_name(tool_input)
-            if node_name:
-                state_manager.start_node(node_name)
+        else:
+            # 不是工作流命令，忽略
+            result = {"continue": True}
+
+    elif hook_event == "PreToolUse" and tool_name == "Task":
+        # 记录节点开始
+        node_name = extract_node_name(tool_input)
+        if node_name and state_manager.is_resume_skipped(node_name):
+            # 恢复模式下已完成的节点：拒绝重新执行
+            output_path = state_manager.state["outputs"].get(node_name)
+            state_manager.skip_node(node_name)
+            state_manager.save()
+            metrics.inc("wf_node_executions_total", {"node": node_name, "status": "skipped"})
+            reason = (
+                f"wf-state: 节点 '{node_name}' 已在中断前完成，恢复模式下不重新执行。"
+                f"请直接读取输出 {output_path or '（无输出文件）'} 继续后续节点；"
+                f"如确需重跑，重新提交命令并附加 {RERUN_PARAM} {node_name}。"
+            )
+            result = {
+                "continue": True,
+                "systemMessage": f"wf-state: 节点 '{node_name}' 已完成，跳过",
+                "hookSpecificOutput": {
+                    "hookEventName": "PreToolUse",
+                    "permissionDecision": "deny",
+                    "permissionDecisionReason": reason,
+                },
+            }
+        elif node_name:
+            input_hash = None
+            cached_output = None
+            cached_extraction = None
+            if args.cache and node_name not in args.no_cache_node:
+                with get_profiler().phase("cache_lookup"):
+                    input_hash = compute_input_hash(tool_input, get_project_dir())
+                    cached_output = get_node_cache(args).lookup(input_hash)
+                if cached_output is not None:
+                    # 与正常完成的节点使用相同的结构化字段和规则判断；
+                    # 契约或规则变化后判为失败的缓存输出不再复用
+                    with get_profiler().phase("check_success"):
+                        cached_extraction = extract_from_tool_response(cached_output)
+                        cached_success, summary, outcome = check_node_success(
+                            cached_output,
+                            cached_extraction.json_data,
+                            success_spec=_node_success_spec(node_name),
+                            rule_set=get_rule_set(args),
+                        )
+                    if not cached_success:
+                        cached_output = None
+                metrics.inc("wf_node_cache_lookups_total", {
+                    "node": node_name,
+                    "result": "hit" if cached_output is not None else "miss",
+                })
+
+            state_manager.start_node(node_name, tool_use_id=tool_use_id, input_hash=input_hash)
+
+            if cached_output is not None:
+                # 命中缓存：直接落地输出并拒绝本次 Task 调用
+                output_path = write_node_output(
+                    node_name, cached_output, tool_use_id, extraction_result=cached_extraction,
+                )
+                state_manager.complete_node(
+                    node_name, True, summary, output_path=output_path,
+                    tool_use_id=tool_use_id, cached=True, outcome=outcome,
+                )
                 state_manager.save()
+                metrics.inc("wf_node_executions_total", {"node": node_name, "status": "cached"})
+                metrics.inc("wf_node_outcomes_total", {
+                    "node": node_name, "verdict": outcome["verdict"], "source": outcome["source"],
+                })
+                reason = (
+                    f"wf-state: 节点 '{node_name}' 的输入与上次成功执行完全一致，"
+                    f"已复用缓存输出 {output_path}。请直接读取该文件继续后续节点，无需重新执行。"
+                )
                 result = {
                     "continue": True,
-                    "systemMessage": f"wf-state: 节点 '{node_name}' 开始执行",
+                    "systemMessage": f"wf-state: 节点 '{node_name}' 命中缓存",
+                    "hookSpecificOutput": {
+                        "hookEventName": "PreToolUse",
+                        "permissionDecision": "deny",
+                        "permissionDecisionReason": reason,
+                    },
                 }
             else:
-                result = {"continue": True}
-
-        elif hook_event == "PostToolUse" and tool_name == "Task":
-            # 记录节点完成，提取并写入输出
-            node_name = extract_node_name(tool_input)
-            if node_name:
-                success, summary = check_node_success(tool_output)
-
-                # 写入节点输出文件
-                output_path = None
-                if success and tool_output is not None:
-                    output_path = write_node_output(node_name, tool_output)
-
-                state_manager.complete_node(node_name, success, summary, output_path=output_path)
                 state_manager.save()
-                status_text = "完成" if success else "失败"
                 result = {
                     "continue": True,
-                    "systemMessage": f"wf-state: 节点 '{node_name}' {status_text}",
+                    "systemMessage": f"wf-state: 节点 '{node_name}' 开始执行",
                 }
-            else:
-                result = {"continue": True}
-
-        elif hook_event == "Stop":
-            # 记录工作流完成
-            # 检查是否有失败的节点
-            nodes = state_manager.state.get("nodes", {})
-            has_failure = any(
-                n.get("status") == "failed" for n in nodes.values()
+        else:
+            result = {"continue": True}
+
+    elif hook_event == "PostToolUse" and tool_name == "Task":
+        # 记录节点完成，提取并写入输出
+        node_name = extract_node_name(tool_input)
+        if node_name:
+            # 提取一次，供成功判断和写入输出共用
+            extraction_result = None
+            if isinstance(tool_output, (str, SpilledText)):
+                with get_profiler().phase("extract"):
+                    extraction_result = extract_from_tool_response(tool_output)
+            with get_profiler().phase("check_success"):
+                success, summary, outcome = check_node_success(
+                    tool_output,
+                    extraction_result.json_data if extraction_result else None,
+                    success_spec=_node_success_spec(node_name),
+                    rule_set=get_rule_set(args),
+                )
+
+            # SubagentStop 契约校验重试耗尽：节点输出不可用，记为失败
+            contract_failure = pop_contract_failure(session_id, node_name)
+            if contract_failure:
+                success = False
+                state_manager.record_contract_failure(node_name, contract_failure)
+                summary = (
+                    f"输出 {contract_failure['attempts']} 次未通过契约 "
+                    f"'{contract_failure.get('contract')}'"
+                )
+                outcome = {"verdict": "failed", "source": "contract_retries", "reason": summary}
+
+            # 写入节点输出文件
+            output_path = None
+            if success and tool_output is not None:
+                output_path = write_node_output(
+                    node_name, tool_output, tool_use_id, chunk_bytes=args.chunk_size_kb * 1024,
+                    extraction_result=extraction_result,
+                )
+
+                # 写入节点结果缓存（仅 PreToolUse 计算过输入哈希的调用）
+                attempt = state_manager.get_attempt(node_name, tool_use_id)
+                if attempt and attempt.get("input_hash"):
+                    with get_profiler().phase("cache_store"):
+                        get_node_cache(args).store_stream(
+                            attempt["input_hash"], node_name, lambda: _iter_output_bytes(tool_output)
+                        )
+
+            state_manager.complete_node(
+                node_name, success, summary, output_path=output_path, tool_use_id=tool_use_id,
+                outcome=outcome,
             )
-            state_manager.complete_workflow(success=not has_failure)
             state_manager.save()
-            status_text = "完成" if not has_failure else "失败"
+
+            node_status = "completed" if success else "failed"
+            metrics.inc("wf_node_executions_total", {"node": node_name, "status": node_status})
+            metrics.inc("wf_node_outcomes_total", {
+                "node": node_name, "verdict": outcome["verdict"], "source": outcome["source"],
+            })
+            duration = state_manager.state["nodes"].get(node_name, {}).get("duration_s")
+            if duration is not None:
+                metrics.observe("wf_node_duration_seconds", duration, {"node": node_name})
+            status_text = "完成" if success else f"失败（{summary}）"
+            if output_path and args.chunk_size_kb and (chunk_dir_for(node_name) / "index.json").exists():
+                status_text += f"（输出已分片: .context/outputs/{node_name}/index.json）"
             result = {
                 "continue": True,
-                "systemMessage": f"wf-state: 工作流 {status_text}",
+                "systemMessage": f"wf-state: 节点 '{node_name}' {status_text}",
             }
-
+            if contract_failure:
+                last_errors = (contract_failure.get("errors") or [{}])[-1].get("errors") or []
+                result["hookSpecificOutput"] = {
+                    "hookEventName": "PostToolUse",
+                    "additionalContext": (
+                        f"[wf-state] 节点 '{node_name}' {summary}，已标记为失败，其输出不能作为后续节点的输入。"
+                        f"最后一次的错误: {'; '.join(e.get('message', '')[:100] for e in last_errors) or '-'}"
+                    ),
+                }
         else:
-            # 其他事件，忽略
             result = {"continue": True}
 
+    elif hook_event == "SubagentStop":
+        # 汇总节点 transcript 的 token 用量
+        agent_transcript_path = input_data.get("agent_transcript_path")
+        if agent_transcript_path and state_manager.state.get("status") == "running":
+            node_name = state_manager.resolve_running_node(input_data.get("agent_type"))
+            state_manager.record_usage(agent_transcript_path, node_name, input_data.get("tool_use_id"))
+            state_manager.save()
+        result = {"continue": True}
+
+    elif hook_event == "Stop":
+        # 汇总编排会话的 token 用量
+        if transcript_path and state_manager.state.get("status") == "running":
+            state_manager.record_usage(transcript_path)
+
+        # 记录工作流完成
+        # 检查是否有失败的节点
+        nodes = state_manager.state.get("nodes", {})
+        has_failure = any(
+            n.get("status") == "failed" for n in nodes.values()
+        )
+        # 工作流输出校验重试耗尽
+        contract_failure = pop_contract_failure(session_id, ContractRetries.WORKFLOW)
+        if contract_failure:
+            has_failure = True
+            state_manager.record_contract_failure("workflow", contract_failure)
+        was_running = state_manager.state.get("status") == "running"
+        state_manager.complete_workflow(success=not has_failure)
+        state_manager.save()
+        clear_active()
+        if was_running:
+            metrics.inc("wf_runs_finished_total", {
+                "workflow": state_manager.state.get("workflow") or "unknown",
+                "status": state_manager.state["status"],
+            })
+        status_text = "完成" if not has_failure else "失败"
+        result = {
+            "continue": True,
+            "systemMessage": f"wf-state: 工作流 {status_text}",
+        }
+
+    else:
+        # 其他事件，忽略
+        result = {"continue": True}
+
+    return result
+
+
+def main():
+    """主函数"""
+    # 解析命令行参数
+    args = parse_args()
+    profiler = get_profiler("wf-state", args.profile)
+    profiler.add_phase("imports", _IMPORTS_DONE - _IMPORTS_STARTED)
+    metrics = get_metrics(args.metrics_file)
+
+    if args.export_trace:
+        output_path = export_trace(args.export_trace)
+        print(f"trace 已导出: {output_path}（可在 https://ui.perfetto.dev 打开）")
+        return
+
+    if args.watch:
+        watch_events(args.new_only)
+        return
+
+    if args.render_output:
+        chunks = render_output(args.render_output, args.attempt)
+        if chunks is None:
+            print(f"节点 '{args.render_output}' 没有对应的输出记录", file=sys.stderr)
+            sys.exit(1)
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        return
+
+    hook_started = time.perf_counter()
+    hook_started_ts = time.time()
+
+    # 读取 stdin 输入（快速路径返回的字节或流，大字段落盘）
+    try:
+        with profiler.phase("stdin"):
+            input_data = load_payload(_STDIN_RAW, spill_bytes=args.spill_kb * 1024)
+    except json.JSONDecodeError as e:
+        result = {
+            "continue": True,
+            "systemMessage": f"wf-state: 无法解析输入 ({e})",
+        }
+        print(json.dumps(result))
+        profiler.finish("invalid_input")
+        return
+
+    hook_event = input_data.get("hook_event_name", "")
+    record_event(Path(__file__).name, sys.argv[1:], input_data)
+
+    # 初始化状态管理器
+    state_file = find_state_file()
+    state_manager = WorkflowState(state_file)
+
+    try:
+        with profiler.phase(f"handle:{hook_event or 'unknown'}"):
+            result = handle_event(input_data, state_manager, args)
     except Exception as e:
         # 状态更新失败不应阻塞工作流
         result = {
@@ -838,7 +1903,21 @@ def main():
             "systemMessage": f"wf-state: 状态更新失败 ({e})",
         }
 
+    hook_duration = time.perf_counter() - hook_started
+    with profiler.phase("metrics"):
+        metrics.observe(
+            "wf_hook_duration_seconds",
+            hook_duration,
+            {"script": "wf-state", "event": hook_event or "unknown"},
+        )
+        metrics.flush()
+        record_span(
+            hook_event or "unknown", "hook", hook_started_ts, hook_started_ts + hook_duration,
+            script="wf-state", tool=input_data.get("tool_name") or None,
+            tool_use_id=input_data.get("tool_use_id"),
+        )
     print(json.dumps(result))
+    profiler.finish(hook_event)
 
 
 if __name__ == "__main__":
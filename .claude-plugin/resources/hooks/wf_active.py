@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+wf_active.py - 工作流运行标记与 Hook 快速路径
+
+Hook 注册在 settings.json 和工作流 Command 上，项目中的每次提交、每次 Task 调用、
+每次 Stop 都会触发，即使当前没有工作流在运行。wf-state.py 在工作流启动/恢复时
+写入 `.context/active`，完成时删除；各 Hook 脚本在导入其他模块、解析负载之前
+先检查该标记，不在工作流运行中的事件直接返回 `{"continue": true}`。
+
+会话崩溃或被中断时 Stop 不会触发，标记会一直留下。运行中的每个事件都会刷新标记的
+修改时间（touch_active），超过 ACTIVE_MAX_AGE_S 未刷新的标记视为过期，快速路径将其
+删除并按不在运行中处理；wf-state 处理事件时发现状态不是 running 也会删除标记。
+
+UserPromptSubmit 是启动工作流的事件，不受标记限制：指定了 --workflow 时，
+原始负载中不含工作流名称的提交同样直接返回；未指定时照常处理。
+
+设置了 WF_HOOKS_IN_PROCESS 时（Hook 已由 wf_sdk_hooks 在 SDK 进程内处理），
+所有事件都直接返回。
+
+运行标记存在时不预先读取 stdin，直接把流交给调用方（wf_payload.load_payload 分块解析，
+大字段落盘）；不存在时最多读取 PROBE_BYTES 判断事件类型，其余部分分块丢弃，
+不因为一次数 MB 的 tool_response 把整个负载读入内存。
+
+快速路径只用到解释器启动时已加载的模块（json 在需要时才导入，类型注解不引入 typing），
+开销与空解释器基本相同。注意作为 __main__ 运行的脚本不使用字节码缓存，
+脚本越大编译越久：wf-hook.py 很小，并通过 importlib 加载（可缓存字节码）
+wf-state.py 和 contract-validator.py，因此是快速路径开销最低的入口。
+"""
+
+import os
+import sys
+import time
+
+
+ACTIVE_FILE = "active"
+
+# 运行标记的过期时间（秒）：超过这么久没有任何工作流事件时视为遗留标记
+# 可用环境变量 WF_ACTIVE_MAX_AGE 覆盖（单节点运行时间可能更长时调大）
+ACTIVE_MAX_AGE_S = 6 * 3600
+
+# 不在工作流中时用于判断事件类型的负载前缀大小（hook_event_name 位于 tool_input 等大字段之前）
+PROBE_BYTES = 4 * 1024 * 1024
+# 丢弃剩余负载时的分块大小
+DRAIN_CHUNK_BYTES = 1024 * 1024
+
+
+def get_active_file() -> str:
+    """获取运行标记文件路径"""
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "") or os.getcwd()
+    return os.path.join(project_dir, ".context", ACTIVE_FILE)
+
+
+def mark_active(workflow_name: str) -> None:
+    """写入运行标记（失败不影响主流程，只是失去快速路径）"""
+    import json
+
+    try:
+        active_file = get_active_file()
+        os.makedirs(os.path.dirname(active_file), exist_ok=True)
+        with open(active_file, "w", encoding="utf-8") as f:
+            json.dump({"workflow": workflow_name}, f, ensure_ascii=False)
+    except OSError:
+        pass
+
+
+def touch_active() -> None:
+    """刷新运行标记的修改时间（标记不存在时不创建）"""
+    try:
+        os.utime(get_active_file())
+    except OSError:
+        pass
+
+
+def clear_active() -> None:
+    """删除运行标记"""
+    try:
+        os.unlink(get_active_file())
+    except OSError:
+        pass
+
+
+def _max_age() -> float:
+    """运行标记的过期时间（秒）"""
+    try:
+        return float(os.environ.get("WF_ACTIVE_MAX_AGE") or ACTIVE_MAX_AGE_S)
+    except ValueError:
+        return ACTIVE_MAX_AGE_S
+
+
+def is_active() -> bool:
+    """运行标记是否存在且未过期（过期的标记顺便删除）"""
+    try:
+        age = time.time() - os.stat(get_active_file()).st_mtime
+    except OSError:
+        return False
+    if age > _max_age():
+        clear_active()
+        return False
+    return True
+
+
+def _argv_value(argv: "list[str]", name: str) -> "str | None":
+    """从命令行参数中取出选项值（支持 --name value 和 --name=value）"""
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return None
+
+
+def _is_prompt_event(raw: bytes) -> bool:
+    """不解析 JSON，判断负载是否为 UserPromptSubmit 事件"""
+    return b'"UserPromptSubmit"' in raw
+
+
+def _mentions_workflow(raw: bytes, workflow_name: str) -> bool:
+    """原始负载是否包含工作流名称（原文或 JSON 转义后的形式）"""
+    import json
+
+    escaped = json.dumps(workflow_name)[1:-1].encode("ascii")
+    return workflow_name.encode("utf-8") in raw or escaped in raw
+
+
+def _drain(stream) -> None:
+    """分块读完并丢弃剩余负载（不读完时写入方可能收到 EPIPE）"""
+    while stream.read(DRAIN_CHUNK_BYTES):
+        pass
+
+
+def read_stdin_or_exit(argv: "list[str] | None" = None, cli_flags: tuple = ()) -> "bytes | object | None":
+    """
+    读取 stdin 负载；不在工作流运行中的事件直接输出 {"continue": true} 并退出
+
+    Args:
+        argv: 命令行参数（默认 sys.argv[1:]）
+        cli_flags: 不读取 stdin 的命令行模式（如 --watch），出现时返回 None
+
+    Returns:
+        工作流运行中时返回尚未读取的 sys.stdin.buffer，UserPromptSubmit 返回原始字节
+        （均交由 wf_payload.load_payload 解析）
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if any(arg.split("=", 1)[0] in (*cli_flags, "-h", "--help") for arg in argv):
+        return None
+    stream = sys.stdin.buffer
+
+    # 已由 wf_sdk_hooks 在 SDK 进程内处理时，命令行 Hook 不重复处理
+    if not os.environ.get("WF_HOOKS_IN_PROCESS"):
+        if is_active():
+            return stream
+        raw = stream.read(PROBE_BYTES)
+        if _is_prompt_event(raw):
+            raw += stream.read()
+            workflow_name = _argv_value(argv, "--workflow")
+            if not workflow_name or _mentions_workflow(raw, workflow_name):
+                return raw
+
+    _drain(stream)
+    sys.stdout.write('{"continue": true}\n')
+    sys.stdout.flush()
+    sys.exit(0)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+wf_classify.py - 节点执行结果分类
+
+wf-state.py 在 PostToolUse (Task) 时判断节点是否成功。按以下顺序分类，第一个给出
+结论的来源生效:
+
+1. contract  节点输出契约中声明的成功字段（见下文）
+2. json      提取出的 JSON 中的约定字段：error、success / ok、status / state
+3. rule      预编译规则集，只作用于输出末尾 tail_chars 个字符（落盘的大输出只读取末尾）
+4. default   以上都没有结论时判为成功
+
+只提到错误的正常输出（"修复了 3 个 error"、代码审查报告）不再被判为失败；
+大输出也不再整体转小写扫描关键词。
+
+契约中的成功字段（.claude/agents/{node}.md 的 output_contract 指向的契约）:
+
+    success:
+      field: result.status          # 点分路径
+      values: [passed, ok]          # 取值在其中为成功，否则失败
+      failure_values: [failed]      # 或只列出失败取值，其余为成功
+      reason_field: result.message  # 失败原因字段（可选）
+
+规则集（wf-state.py --success-rules 指定 YAML / JSON 文件）按顺序匹配，第一条命中的
+规则生效；自定义规则排在默认规则之前，replace_defaults: true 时不使用默认规则:
+
+    tail_chars: 2000
+    rules:
+      - name: lint-errors
+        pattern: '\\b[1-9]\\d* errors? found'
+        verdict: failed
+      - name: zero-errors
+        pattern: '\\b0 errors\\b'
+        verdict: success
+
+规则以 IGNORECASE | MULTILINE 编译，加载后按文件修改时间缓存。分类结果记录在状态文件
+对应节点的 outcome 中:
+
+    {"verdict": "failed", "source": "rule", "rule": "traceback", "reason": "...", "evidence": "..."}
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from wf_payload import SpilledText
+
+
+VERDICTS = ("success", "failed")
+
+# 规则作用的输出末尾长度（字符）
+DEFAULT_TAIL_CHARS = 2000
+# 摘要、原因、证据的最大长度
+SUMMARY_CHARS = 100
+EVIDENCE_CHARS = 120
+
+FAILURE_STATUSES = frozenset({
+    "failed", "failure", "fail", "error", "errored", "aborted", "crashed", "失败", "出错",
+})
+SUCCESS_STATUSES = frozenset({
+    "success", "succeeded", "ok", "completed", "complete", "done", "passed", "pass", "成功", "完成",
+})
+
+DEFAULT_RULES = (
+    {
+        "name": "exception",
+        "pattern": r"^\s*(?:[\w.]+(?:Error|Exception)|panic|fatal(?: error)?)\s*:",
+        "verdict": "failed",
+    },
+    {
+        "name": "traceback",
+        "pattern": r"^Traceback \(most recent call last\):",
+        "verdict": "failed",
+    },
+    {
+        "name": "error-line",
+        "pattern": r"^\s*(?:error|错误)\s*[:：]",
+        "verdict": "failed",
+    },
+    {
+        "name": "failed-status",
+        "pattern": r"\b(?:status|result|状态|结果)\s*[:：=]\s*[\"'*_`]*(?:(?:failed|failure|error)\b|失败)",
+        "verdict": "failed",
+    },
+    {
+        "name": "gave-up",
+        "pattern": r"无法完成|未能完成|执行失败|任务失败|\b(?:could not|unable to|failed to) (?:complete|finish) (?:the )?task\b",
+        "verdict": "failed",
+    },
+)
+
+
+class RuleSetError(Exception):
+    """规则文件无效"""
+
+
+class RuleSet:
+    """预编译的文本规则集"""
+
+    def __init__(self, rules: list, tail_chars: int = DEFAULT_TAIL_CHARS):
+        self.tail_chars = tail_chars
+        self.rules: list[tuple[str, re.Pattern, str]] = []
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict) or not rule.get("pattern"):
+                raise RuleSetError(f"第 {index + 1} 条规则缺少 pattern")
+            verdict = rule.get("verdict", "failed")
+            if verdict not in VERDICTS:
+                raise RuleSetError(f"规则 {rule.get('name') or index + 1} 的 verdict 必须是 success 或 failed")
+            try:
+                pattern = re.compile(rule["pattern"], re.IGNORECASE | re.MULTILINE)
+            except re.error as e:
+                raise RuleSetError(f"规则 {rule.get('name') or index + 1} 的 pattern 无效: {e}") from e
+            self.rules.append((str(rule.get("name") or f"rule-{index + 1}"), pattern, verdict))
+
+    def match(self, text: str) -> Optional[dict]:
+        """按顺序匹配，返回第一条命中规则的分类结果"""
+        for name, pattern, verdict in self.rules:
+            found = pattern.search(text)
+            if found:
+                return {
+                    "verdict": verdict,
+                    "source": "rule",
+                    "rule": name,
+                    "evidence": _line_at(text, found.start()),
+                }
+        return None
+
+
+DEFAULT_RULE_SET = RuleSet(list(DEFAULT_RULES))
+
+_rule_set_cache: dict = {}
+
+
+def load_rule_set(path: Optional[str]) -> RuleSet:
+    """
+    加载规则文件（未指定时返回默认规则集，按修改时间缓存）
+
+    Raises:
+        RuleSetError: 文件无法读取或格式无效
+    """
+    if not path:
+        return DEFAULT_RULE_SET
+    rule_file = Path(path)
+    try:
+        mtime_ns = rule_file.stat().st_mtime_ns
+        cached = _rule_set_cache.get(rule_file)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        content = rule_file.read_text(encoding="utf-8")
+    except OSError as e:
+        raise RuleSetError(f"无法读取规则文件 {path}: {e}") from e
+
+    if rule_file.suffix == ".json":
+        config = json.loads(content)
+    elif yaml:
+        config = yaml.safe_load(content)
+    else:
+        raise RuleSetError("未安装 PyYAML，规则文件请使用 .json")
+    if not isinstance(config, dict):
+        raise RuleSetError(f"规则文件 {path} 顶层必须是对象")
+
+    rules = list(config.get("rules") or [])
+    if not config.get("replace_defaults"):
+        rules.extend(DEFAULT_RULES)
+    rule_set = RuleSet(rules, int(config.get("tail_chars") or DEFAULT_TAIL_CHARS))
+    _rule_set_cache[rule_file] = (mtime_ns, rule_set)
+    return rule_set
+
+
+def find_node_contract(project_dir: Path, node_name: str) -> Optional[str]:
+    """节点的输出契约（.claude/agents/{node}.md frontmatter 中的 output_contract）"""
+    try:
+        content = (project_dir / ".claude" / "agents" / f"{node_name}.md").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    if not content.startswith("---"):
+        return None
+    frontmatter = content[3:].partition("\n---")[0]
+    match = re.search(r"^output_contract:\s*[\"']?([\w.-]+)", frontmatter, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def load_success_spec(project_dir: Path, node_name: str) -> Optional[dict]:
+    """读取节点输出契约中的 success 配置（无契约、无配置或无法读取时返回 None）"""
+    contract_name = find_node_contract(project_dir, node_name)
+    if not contract_name:
+        return None
+    contracts_dir = project_dir / ".claude" / "contracts"
+    for suffix in (".yaml", ".json"):
+        try:
+            content = (contracts_dir / f"{contract_name}{suffix}").read_text(encoding="utf-8")
+        except OSError:
+            continue
+        try:
+            if suffix == ".json":
+                contract = json.loads(content)
+            elif yaml:
+                contract = yaml.safe_load(content)
+            else:
+                return None
+        except ValueError:
+            return None
+        spec = contract.get("success") if isinstance(contract, dict) else None
+        if isinstance(spec, dict) and spec.get("field"):
+            return dict(spec, contract=contract_name)
+        return None
+    return None
+
+
+def _line_at(text: str, pos: int) -> str:
+    """匹配位置所在的行（截断到 EVIDENCE_CHARS）"""
+    start = text.rfind("\n", 0, pos) + 1
+    end = text.find("\n", pos)
+    line = text[start:end if end != -1 else len(text)].strip()
+    return line[:EVIDENCE_CHARS]
+
+
+def _clip(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= SUMMARY_CHARS else text[:SUMMARY_CHARS - 3] + "..."
+
+
+def _get_path(data: Any, path: str) -> tuple[bool, Any]:
+    """按点分路径取值（数组下标为数字），返回 (是否存在, 值)"""
+    current = data
+    for part in path.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and part.lstrip("-").isdigit() and -len(current) <= int(part) < len(current):
+            current = current[int(part)]
+        else:
+            return False, None
+    return True, current
+
+
+def _same_value(value: Any, candidates: list) -> bool:
+    """取值比较（字符串不区分大小写）"""
+    for candidate in candidates:
+        if value == candidate:
+            return True
+        if isinstance(value, str) and isinstance(candidate, str) and value.lower() == candidate.lower():
+            return True
+    return False
+
+
+def classify_contract(data: Any, spec: Optional[dict]) -> Optional[dict]:
+    """按契约声明的成功字段分类（字段不存在时不下结论，交由契约校验处理）"""
+    if not spec:
+        return None
+    found, value = _get_path(data, str(spec["field"]))
+    if not found:
+        return None
+
+    values = spec.get("values")
+    failure_values = spec.get("failure_values")
+    if isinstance(values, list):
+        success = _same_value(value, values)
+    elif isinstance(failure_values, list):
+        success = not _same_value(value, failure_values)
+    else:
+        success = bool(value)
+
+    reason = f"{spec['field']} = {json.dumps(value, ensure_ascii=False, default=str)}"
+    if not success and spec.get("reason_field"):
+        found, detail = _get_path(data, str(spec["reason_field"]))
+        if found and detail:
+            reason = _clip(detail)
+    outcome = {
+        "verdict": "success" if success else "failed",
+        "source": "contract",
+        "reason": reason,
+    }
+    if spec.get("contract"):
+        outcome["contract"] = spec["contract"]
+    return outcome
+
+
+def classify_json(data: Any) -> Optional[dict]:
+    """按 JSON 中的约定字段分类：error、success / ok、status / state"""
+    if not isinstance(data, dict):
+        return None
+
+    error = data.get("error")
+    if error:
+        return {"verdict": "failed", "source": "json", "reason": _clip(error)}
+
+    message = data.get("message") or data.get("reason")
+    for key in ("success", "ok"):
+        if isinstance(data.get(key), bool):
+            return {
+                "verdict": "success" if data[key] else "failed",
+                "source": "json",
+                "reason": _clip(message) if message else f"{key} = {str(data[key]).lower()}",
+            }
+
+    for key in ("status", "state"):
+        status = data.get(key)
+        if not isinstance(status, str):
+            continue
+        normalized = status.strip().lower()
+        if normalized in FAILURE_STATUSES:
+            return {"verdict": "failed", "source": "json", "reason": _clip(message) if message else f"{key} = {status}"}
+        if normalized in SUCCESS_STATUSES:
+            return {"verdict": "success", "source": "json", "reason": f"{key} = {status}"}
+    return None
+
+
+def output_tail(tool_output: Any, chars: int) -> str:
+    """文本输出的末尾（落盘的大输出只读取文件末尾）"""
+    if isinstance(tool_output, SpilledText):
+        return tool_output.tail(chars)
+    if isinstance(tool_output, str):
+        return tool_output[-chars:]
+    return ""
+
+
+def output_summary(tool_output: Any, json_data: Any = None) -> str:
+    """节点摘要：JSON 的 summary / message，否则为文本开头"""
+    for data in (tool_output, json_data):
+        if isinstance(data, dict):
+            summary = data.get("summary") or data.get("message")
+            if summary:
+                return _clip(summary)
+    if isinstance(tool_output, SpilledText):
+        return tool_output.head(SUMMARY_CHARS)
+    if isinstance(tool_output, str):
+        return tool_output[:SUMMARY_CHARS]
+    return "执行完成"
+
+
+def classify_output(
+    tool_output: Any,
+    json_data: Any = None,
+    success_spec: Optional[dict] = None,
+    rule_set: Optional[RuleSet] = None,
+) -> dict:
+    """
+    分类节点输出
+
+    Args:
+        tool_output: Task 工具返回的输出（str、SpilledText 或结构化对象）
+        json_data: 从文本输出中提取的 JSON（结构化对象输出时忽略）
+        success_spec: 节点输出契约中的 success 配置
+        rule_set: 文本规则集（默认规则集）
+
+    Returns:
+        {"verdict", "source", "reason", "summary", 以及规则命中时的 "rule" / "evidence"}
+    """
+    if isinstance(tool_output, (dict, list)):
+        json_data = tool_output
+    summary = output_summary(tool_output, json_data)
+    if tool_output is None:
+        return {"verdict": "success", "source": "default", "reason": "无输出", "summary": "执行完成"}
+
+    outcome = classify_contract(json_data, success_spec) if json_data is not None else None
+    if outcome is None and json_data is not None:
+        outcome = classify_json(json_data)
+    if outcome is None:
+        rule_set = rule_set or DEFAULT_RULE_SET
+        outcome = rule_set.match(output_tail(tool_output, rule_set.tail_chars))
+        if outcome is not None:
+            outcome["reason"] = outcome["evidence"][:SUMMARY_CHARS] or f"命中规则 {outcome['rule']}"
+    if outcome is None:
+        outcome = {"verdict": "success", "source": "default", "reason": "未发现失败标识"}
+
+    outcome["summary"] = summary if outcome["verdict"] == "success" else outcome["reason"]
+    return outcome
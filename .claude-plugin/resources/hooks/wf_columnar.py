@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+wf_columnar.py - 大型同构数组的按列校验
+
+节点输出中包含十万级同构记录的数组时，jsonschema 逐个元素、逐个关键字递归校验，
+可能超出 Hook 的 30 秒超时。在契约 Schema 中把这类数组标记为同构：
+
+    schema:
+      type: object
+      properties:
+        records:
+          type: array
+          x-columnar: true              # 全量按列校验
+          # x-columnar: {sample: 1000}  # 结构检查全量，取值约束只校验确定性抽样的 1000 条
+          items:
+            type: object
+            required: [id, score]
+            additionalProperties: false
+            properties:
+              id: {type: string, pattern: "^R-[0-9]+$"}
+              score: {type: number, minimum: 0, maximum: 100}
+
+contract-validator.py 对标记的数组（只沿 properties 查找，根 Schema 本身也可以标记）:
+- 数组级: minItems / maxItems / uniqueItems
+- 结构（始终全量）: 元素类型、required、additionalProperties: false、各字段类型
+- 取值（全量或抽样）: enum / const / minimum / maximum / exclusiveMinimum /
+  exclusiveMaximum / multipleOf / pattern / minLength / maxLength；
+  安装了 NumPy 时数值范围检查向量化执行
+- 字段或元素 Schema 中的其他关键字（嵌套对象、anyOf 等）按元素校验（同样遵循抽样策略）：
+  优先用 wf_schema_compiler 在内存中编译的校验函数，无法编译时使用 jsonschema
+
+每个字段、每个关键字报告一条错误，包含失败数量和前几个失败索引（indices）。
+数组之外的部分用去掉元素约束的剩余 Schema 照常校验。
+Schema 中含 $ref 的数组不走按列校验。
+"""
+
+import json
+import re
+from fractions import Fraction
+from numbers import Number
+from typing import Any, Callable, Optional
+
+from wf_schema_compiler import SchemaCompileError, compile_schema, error_details
+
+
+COLUMNAR_KEY = "x-columnar"
+
+# 每条错误报告的失败索引个数
+FIRST_INDICES = 5
+
+ANNOTATION_KEYWORDS = frozenset({
+    "title", "description", "default", "examples", "deprecated", "readOnly", "writeOnly",
+    "format", "$comment",
+})
+# 按列校验接管的数组级关键字（type 保留在剩余 Schema 中，由其检查数组本身的类型）
+ARRAY_KEYWORDS = frozenset({"items", "minItems", "maxItems", "uniqueItems", COLUMNAR_KEY})
+ITEM_KEYWORDS = frozenset({"type", "properties", "required", "additionalProperties"})
+VALUE_KEYWORDS = frozenset({
+    "enum", "const", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+    "multipleOf", "pattern", "minLength", "maxLength",
+})
+
+_MISSING = object()
+
+_numpy: Any = None
+_jsonschema: Any = None
+
+
+def get_numpy() -> Any:
+    """按需导入 NumPy（导入较慢，只在实际校验大数组时才付出开销；未安装时返回 False）"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+def get_jsonschema() -> Any:
+    """按需导入 jsonschema（只在残余约束无法编译时使用；未安装时返回 False）"""
+    global _jsonschema
+    if _jsonschema is None:
+        try:
+            import jsonschema
+            import jsonschema.exceptions
+            _jsonschema = jsonschema
+        except ImportError:
+            _jsonschema = False
+    return _jsonschema
+
+
+_TYPE_CHECKS: dict[str, Callable[[Any], bool]] = {
+    "string": lambda v: isinstance(v, str),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+    "number": lambda v: isinstance(v, Number) and not isinstance(v, bool),
+    "integer": lambda v: not isinstance(v, bool) and (
+        isinstance(v, int) or (isinstance(v, float) and v.is_integer())
+    ),
+}
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def _scalar_key(value: Any) -> Any:
+    """enum / const 比较用的键（区分 True 与 1，1 与 1.0 相等，与 jsonschema 一致）"""
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, (dict, list)):
+        return ("json", json.dumps(value, sort_keys=True, default=str))
+    return ("value", value)
+
+
+class ColumnarTarget:
+    """一个标记为同构的数组"""
+
+    def __init__(self, path: tuple, node: dict):
+        self.path = path
+        self.node = node
+        policy = node.get(COLUMNAR_KEY)
+        self.sample: Optional[int] = policy.get("sample") if isinstance(policy, dict) else None
+
+        items = node.get("items")
+        self.items: dict = items if isinstance(items, dict) else {}
+        self.record_mode = "properties" in self.items or self.items.get("type") == "object"
+        # 元素级不支持按列处理的关键字：整个元素交给 jsonschema
+        self.item_residual = self._residual(
+            self.items, ITEM_KEYWORDS if self.record_mode else {"type"} | VALUE_KEYWORDS,
+        )
+        # 字段级不支持按列处理的关键字：该字段交给 jsonschema
+        self.field_residuals = {
+            name: self._residual(subschema, {"type"} | VALUE_KEYWORDS)
+            for name, subschema in self.items.get("properties", {}).items()
+            if isinstance(subschema, dict)
+        }
+
+    @staticmethod
+    def _residual(schema: dict, handled: frozenset) -> Optional[Callable[[Any], list[dict]]]:
+        """
+        schema 含按列无法处理的关键字时，返回按元素校验的函数（值 -> 错误详情列表）；
+        全部可按列处理时返回 None
+        """
+        rest = {k: v for k, v in schema.items() if k not in handled and k not in ANNOTATION_KEYWORDS}
+        if not rest:
+            return None
+        try:
+            namespace: dict[str, Any] = {}
+            exec(compile(compile_schema(schema, "x-columnar"), "<x-columnar>", "exec"), namespace)
+            collect = namespace["collect_errors"]
+            return lambda value: error_details(collect(value))
+        except SchemaCompileError:
+            pass
+        jsonschema = get_jsonschema()
+        if not jsonschema:
+            return None
+        validator = jsonschema.validators.validator_for(schema)(schema)
+
+        def check(value: Any) -> list[dict]:
+            if validator.is_valid(value):
+                return []
+            error = jsonschema.exceptions.best_match(validator.iter_errors(value))
+            return [{"message": error.message}]
+
+        return check
+
+    @property
+    def field(self) -> str:
+        return ".".join(str(p) for p in self.path) or "(root)"
+
+
+def _contains_ref(schema: Any) -> bool:
+    if isinstance(schema, dict):
+        return any(k in ("$ref", "$dynamicRef") or _contains_ref(v) for k, v in schema.items())
+    if isinstance(schema, list):
+        return any(_contains_ref(v) for v in schema)
+    return False
+
+
+def find_targets(schema: Any) -> list[ColumnarTarget]:
+    """沿 properties 查找标记为同构的数组"""
+    targets: list[ColumnarTarget] = []
+
+    def walk(node: Any, path: tuple) -> None:
+        if not isinstance(node, dict):
+            return
+        if node.get(COLUMNAR_KEY) and isinstance(node.get("items"), dict) and not _contains_ref(node):
+            targets.append(ColumnarTarget(path, node))
+            return
+        for name, subschema in (node.get("properties") or {}).items():
+            walk(subschema, path + (name,))
+
+    walk(schema, ())
+    return targets
+
+
+def residual_schema(schema: dict, targets: list[ColumnarTarget]) -> dict:
+    """去掉按列校验已覆盖的关键字后的 Schema（用于校验数组之外的部分）"""
+    def strip(node: dict, path: tuple) -> dict:
+        for target in targets:
+            if target.path == path:
+                return {k: v for k, v in node.items() if k not in ARRAY_KEYWORDS}
+        copied = dict(node)
+        properties = node.get("properties")
+        if isinstance(properties, dict):
+            copied["properties"] = {
+                name: strip(sub, path + (name,)) if isinstance(sub, dict) else sub
+                for name, sub in properties.items()
+            }
+        return copied
+
+    return strip(schema, ())
+
+
+def lookup(data: Any, path: tuple) -> Any:
+    """按路径取出数据中的数组，不存在时返回 _MISSING"""
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return _MISSING
+        data = data[key]
+    return data
+
+
+def sample_indices(total: int, size: int) -> list[int]:
+    """确定性抽样：等间隔取 size 个索引（包含首尾）"""
+    if size <= 0 or total <= size:
+        return list(range(total))
+    if size == 1:
+        return [0]
+    step = (total - 1) / (size - 1)
+    return sorted({round(i * step) for i in range(size)})
+
+
+class _Report:
+    """按（字段, 关键字）汇总失败索引"""
+
+    def __init__(self, target: ColumnarTarget, checked: int, total: int):
+        self.target = target
+        self.errors: list[dict] = []
+        self.scope = f"抽样 {checked}/{total} 条中" if checked < total else ""
+
+    def add(self, field: Optional[str], keyword: str, expected: str, failing: list[tuple[int, Any]],
+            detail: str = "", sampled: bool = False) -> None:
+        """记录一类失败（sampled: 失败来自抽样检查，消息中注明抽样范围）"""
+        if not failing:
+            return
+        indices = [i for i, _ in failing[:FIRST_INDICES]]
+        first_value = failing[0][1]
+        location = ".".join([*(str(p) for p in self.target.path), "*", *([field] if field else [])])
+        shown = ", ".join(str(i) for i in indices) + (" …" if len(failing) > len(indices) else "")
+        subject = f"字段 {field} " if field else "元素"
+        self.errors.append({
+            "field": location,
+            "expected": expected,
+            "actual": type(first_value).__name__ if first_value is not _MISSING else "missing",
+            "message": (
+                f"{self.scope if sampled else ''}{len(failing)} 条记录的{subject}不满足 {keyword}"
+                f"{f'（{detail}）' if detail else ''}，失败索引: {shown}"
+            ),
+            "indices": indices,
+            "count": len(failing),
+        })
+
+    def add_sampled(self, *args: Any, **kwargs: Any) -> None:
+        """记录取值检查（全量或抽样）的失败"""
+        self.add(*args, sampled=True, **kwargs)
+
+
+def _check_types(report: _Report, field: Optional[str], schema: dict,
+                 column: list[tuple[int, Any]]) -> None:
+    types = schema.get("type")
+    if types is None:
+        return
+    types = [types] if isinstance(types, str) else list(types)
+    checks = [_TYPE_CHECKS[t] for t in types if t in _TYPE_CHECKS]
+    if not checks:
+        return
+    if len(checks) == 1:
+        check = checks[0]
+        failing = [(i, v) for i, v in column if not check(v)]
+    else:
+        failing = [(i, v) for i, v in column if not any(check(v) for check in checks)]
+    report.add(field, "type", str(schema["type"]), failing, f"应为 {', '.join(types)}")
+
+
+def _numeric_failures(numbers: list[tuple[int, Any]], keyword: str, bound: Any) -> list[tuple[int, Any]]:
+    """数值范围检查（有 NumPy 时向量化）"""
+    compare = {
+        "minimum": lambda a, b: a < b,
+        "maximum": lambda a, b: a > b,
+        "exclusiveMinimum": lambda a, b: a <= b,
+        "exclusiveMaximum": lambda a, b: a >= b,
+    }[keyword]
+    np = get_numpy() if len(numbers) > 64 else None
+    if np:
+        try:
+            values = np.asarray([v for _, v in numbers])
+            if values.dtype.kind in "iuf":
+                return [numbers[j] for j in np.flatnonzero(compare(values, bound)).tolist()]
+        except (OverflowError, TypeError, ValueError):
+            pass  # 超出 int64 等情况回退到逐个比较
+    return [(i, v) for i, v in numbers if compare(v, bound)]
+
+
+def _check_values(report: _Report, field: Optional[str], schema: dict,
+                  column: list[tuple[int, Any]]) -> None:
+    expected = str(schema.get("type", ""))
+    if "enum" in schema or "const" in schema:
+        keyword = "enum" if "enum" in schema else "const"
+        allowed_values = schema["enum"] if keyword == "enum" else [schema["const"]]
+        try:
+            allowed = {_scalar_key(v) for v in allowed_values}
+            failing = [(i, v) for i, v in column if _scalar_key(v) not in allowed]
+        except TypeError:
+            failing = []
+        report.add_sampled(field, keyword, expected or keyword, failing, f"允许值 {allowed_values!r}"[:80])
+
+    numbers = None
+    for keyword in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"):
+        if keyword in schema and _is_number(schema[keyword]):
+            if numbers is None:
+                numbers = [(i, v) for i, v in column if _is_number(v)]
+            report.add_sampled(field, keyword, expected or keyword,
+                       _numeric_failures(numbers, keyword, schema[keyword]), f"{keyword}={schema[keyword]}")
+
+    if "multipleOf" in schema:
+        divisor = schema["multipleOf"]
+        numbers = numbers if numbers is not None else [(i, v) for i, v in column if _is_number(v)]
+        failing = []
+        for i, v in numbers:
+            if isinstance(divisor, float):
+                try:
+                    quotient = v / divisor
+                    bad = int(quotient) != quotient
+                except OverflowError:
+                    bad = (Fraction(v) / Fraction(divisor)).denominator != 1
+            else:
+                bad = bool(v % divisor)
+            if bad:
+                failing.append((i, v))
+        report.add_sampled(field, "multipleOf", expected or "multipleOf", failing, f"multipleOf={divisor}")
+
+    strings = None
+    if "pattern" in schema:
+        regex = re.compile(schema["pattern"])
+        strings = [(i, v) for i, v in column if isinstance(v, str)]
+        report.add_sampled(field, "pattern", expected or "pattern",
+                   [(i, v) for i, v in strings if not regex.search(v)], f"pattern={schema['pattern']}")
+    for keyword, compare in (("minLength", lambda n, b: n < b), ("maxLength", lambda n, b: n > b)):
+        if keyword in schema:
+            strings = strings if strings is not None else [(i, v) for i, v in column if isinstance(v, str)]
+            report.add_sampled(field, keyword, expected or keyword,
+                       [(i, v) for i, v in strings if compare(len(v), schema[keyword])],
+                       f"{keyword}={schema[keyword]}")
+
+
+def _check_residual(report: _Report, field: Optional[str], schema: dict,
+                    check: Callable[[Any], list[dict]], column: list[tuple[int, Any]]) -> None:
+    """按元素校验按列无法处理的关键字，报告第一个失败元素的错误消息"""
+    failing = [(i, v) for i, v in column if check(v)]
+    if failing:
+        first = check(failing[0][1])[0]
+        report.add_sampled(field, "schema", str(schema.get("type", "schema")), failing, first["message"][:80])
+
+
+def validate_array(target: ColumnarTarget, array: list) -> list[dict]:
+    """
+    按列校验一个同构数组
+
+    Returns:
+        错误详情列表（field / expected / actual / message，另含 indices 与 count）
+    """
+    node = target.node
+    total = len(array)
+    value_indices = sample_indices(total, target.sample) if target.sample else None
+    checked = len(value_indices) if value_indices is not None else total
+    report = _Report(target, checked, total)
+
+    # 数组级
+    if "minItems" in node and total < node["minItems"]:
+        report.errors.append({"field": target.field, "expected": "array", "actual": "list",
+                              "message": f"数组长度 {total} 小于 minItems={node['minItems']}"})
+    if "maxItems" in node and total > node["maxItems"]:
+        report.errors.append({"field": target.field, "expected": "array", "actual": "list",
+                              "message": f"数组长度 {total} 大于 maxItems={node['maxItems']}"})
+    if node.get("uniqueItems"):
+        seen: dict[str, int] = {}
+        duplicates = []
+        for i, element in enumerate(array):
+            key = json.dumps(element, sort_keys=True, default=str)
+            if key in seen:
+                duplicates.append((i, element))
+            else:
+                seen[key] = i
+        report.add(None, "uniqueItems", "array", duplicates, "与之前的元素重复")
+
+    items = target.items
+    in_sample = set(value_indices) if value_indices is not None else None
+
+    def sampled(column: list[tuple[int, Any]]) -> list[tuple[int, Any]]:
+        return column if in_sample is None else [(i, v) for i, v in column if i in in_sample]
+
+    if not target.record_mode:
+        column = list(enumerate(array))
+        _check_types(report, None, items, column)
+        _check_values(report, None, items, sampled(column))
+        if target.item_residual is not None:
+            _check_residual(report, None, items, target.item_residual, sampled(column))
+        return report.errors
+
+    # 记录数组：元素类型
+    records = [(i, element) for i, element in enumerate(array) if isinstance(element, dict)]
+    if len(records) < total:
+        report.add(None, "type", "object",
+                   [(i, e) for i, e in enumerate(array) if not isinstance(e, dict)], "应为 object")
+    records_only = [element for _, element in records]
+    record_indices = [i for i, _ in records]
+
+    for name in items.get("required", []):
+        report.add(name, "required", "required",
+                   [(i, _MISSING) for i, element in records if name not in element], "缺少必需字段")
+
+    properties = items.get("properties", {})
+    if items.get("additionalProperties") is False:
+        allowed = set(properties)
+        report.add(None, "additionalProperties", "object",
+                   [(i, e) for i, e in records if not allowed.issuperset(e)],
+                   "存在未声明的字段")
+
+    for name, subschema in properties.items():
+        if not isinstance(subschema, dict):
+            continue
+        values = [element.get(name, _MISSING) for element in records_only]
+        column = [(i, v) for i, v in zip(record_indices, values) if v is not _MISSING]
+        _check_types(report, name, subschema, column)
+        _check_values(report, name, subschema, sampled(column))
+        residual = target.field_residuals.get(name)
+        if residual is not None:
+            _check_residual(report, name, subschema, residual, sampled(column))
+
+    if target.item_residual is not None:
+        _check_residual(report, None, items, target.item_residual, sampled(records))
+    return report.errors
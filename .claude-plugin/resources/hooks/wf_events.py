@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+wf_events.py - 工作流状态事件流
+
+wf-state.py 每次状态变化（工作流启动/恢复/完成、节点开始/完成/跳过）
+向 `.context/events.jsonl` 追加一行事件，观察者只需增量读取新行，
+无需反复解析 state.md，也不会与写入方争用文件。
+
+可选的实时订阅：在 `.context/subscribers/` 下创建
+- `*.sock`: Unix domain datagram socket，每个事件作为一个数据报发送
+- `*.fifo`: 命名管道，每个事件写入一行（无读者时跳过）
+发送均为非阻塞，订阅方失效时自动清理，不影响 Hook 主流程。
+"""
+
+import json
+import os
+import socket
+import stat
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+# 事件文件超过该大小时，在新工作流启动时轮转
+EVENTS_ROTATE_BYTES = 10 * 1024 * 1024
+
+
+def get_context_dir() -> Path:
+    """获取 .context 目录"""
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "")
+    return Path(project_dir or Path.cwd()) / ".context"
+
+
+def get_events_file() -> Path:
+    """获取事件文件路径"""
+    return get_context_dir() / "events.jsonl"
+
+
+def rotate_events() -> None:
+    """事件文件过大时轮转为 events.prev.jsonl"""
+    events_file = get_events_file()
+    try:
+        if events_file.stat().st_size > EVENTS_ROTATE_BYTES:
+            os.replace(events_file, events_file.with_name("events.prev.jsonl"))
+    except OSError:
+        pass
+
+
+def _notify_subscribers(line: bytes) -> None:
+    """向订阅目录中的 socket / FIFO 非阻塞发送事件"""
+    subscribers_dir = get_context_dir() / "subscribers"
+    try:
+        entries = list(subscribers_dir.iterdir())
+    except OSError:
+        return
+
+    for path in entries:
+        try:
+            mode = path.stat().st_mode
+        except OSError:
+            continue
+        try:
+            if stat.S_ISSOCK(mode):
+                with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                    sock.setblocking(False)
+                    sock.sendto(line, str(path))
+            elif stat.S_ISFIFO(mode):
+                fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 订阅方已退出，清理残留的 socket
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        except OSError:
+            # FIFO 无读者（ENXIO）或缓冲区已满（EAGAIN）时丢弃本条
+            pass
+
+
+def publish_events(events: list[dict]) -> None:
+    """
+    发布一批事件（单次 O_APPEND 写入，多进程并发安全；失败不影响主流程）
+    """
+    if not events:
+        return
+    lines = [
+        (json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        for event in events
+    ]
+    try:
+        events_file = get_events_file()
+        events_file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(events_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, b"".join(lines))
+        finally:
+            os.close(fd)
+    except Exception:
+        pass
+
+    for line in lines:
+        _notify_subscribers(line)
+
+
+def follow_events(
+    events_file: Path,
+    from_start: bool = True,
+    interval: float = 0.2,
+    stop_after: Optional[float] = None,
+) -> Iterator[dict]:
+    """
+    增量读取事件文件（类似 tail -f）
+
+    只读取上次位置之后新增的字节，文件被轮转或截断时从头开始。
+
+    Args:
+        from_start: 是否先输出已有事件
+        interval: 无新事件时的轮询间隔（秒）
+        stop_after: 连续无新事件超过该时长后结束（None 表示一直跟随）
+    """
+    offset = 0
+    if not from_start:
+        try:
+            offset = events_file.stat().st_size
+        except OSError:
+            offset = 0
+
+    pending = b""
+    idle_since = time.monotonic()
+    while True:
+        try:
+            size = events_file.stat().st_size
+        except OSError:
+            size = 0
+        if size < offset:
+            offset, pending = 0, b""
+
+        if size > offset:
+            with open(events_file, "rb") as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            offset += len(chunk)
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+            idle_since = time.monotonic()
+        elif stop_after is not None and time.monotonic() - idle_since > stop_after:
+            return
+        else:
+            time.sleep(interval)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+wf_metrics.py - 工作流 Prometheus 指标导出模块
+
+以 node_exporter textfile collector 可读取的格式维护 `.prom` 文件，
+供 wf-state.py 和 contract-validator.py 共同使用。
+
+启用方式（二选一，未配置时所有调用均为空操作）：
+- 环境变量 WF_METRICS_FILE=<path>.prom
+- 脚本参数 --metrics-file <path>.prom
+
+更新机制：
+- 每次 Hook 调用先在内存中累积指标，进程结束前 flush() 一次
+- flush 时持锁读取旁路状态文件 `<path>.prom.json`，合并增量后
+  原子替换状态文件和 `.prom` 文件（均为临时文件 + os.replace）
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不加锁
+    fcntl = None
+
+
+# 直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 1800)
+
+# 指标定义: name -> (type, help)；inc / observe 只接受这里登记的指标
+METRICS = {
+    "wf_runs_started_total": ("counter", "工作流启动次数"),
+    "wf_runs_finished_total": ("counter", "工作流结束次数（按结果）"),
+    "wf_runs_resumed_total": ("counter", "工作流从中断处恢复的次数"),
+    "wf_node_executions_total": ("counter", "节点执行次数（按结果）"),
+    "wf_node_duration_seconds": ("histogram", "节点执行耗时"),
+    "wf_node_cache_lookups_total": ("counter", "节点结果缓存查询次数（hit/miss）"),
+    "wf_contract_validations_total": ("counter", "契约校验次数（按结果）"),
+    "wf_hook_duration_seconds": ("histogram", "Hook 处理耗时（按脚本和事件）"),
+    "wf_validator_script_duration_seconds": ("histogram", "自定义校验脚本子进程耗时"),
+    "wf_validation_cache_total": ("counter", "契约校验结果缓存查询次数（hit/miss）"),
+    "wf_validation_deadline_total": ("counter", "契约校验超出 Hook 超时预算的次数（按 on_timeout 策略和结果）"),
+    "wf_contract_retries_exhausted_total": ("counter", "契约校验重试次数耗尽后放行的次数"),
+    "wf_skeleton_injections_total": ("counter", "向 Task prompt 注入契约输出骨架的次数"),
+    "wf_node_outcomes_total": ("counter", "节点执行结果分类次数（按结论和判断依据）"),
+}
+
+
+def _check_metric(name: str, metric_type: str) -> None:
+    """指标必须已登记且类型一致（编码错误，不做静默降级）"""
+    registered = METRICS.get(name)
+    if registered is None:
+        raise ValueError(f"未登记的指标 '{name}'：请在 wf_metrics.METRICS 中添加类型和说明")
+    if registered[0] != metric_type:
+        raise ValueError(f"指标 '{name}' 登记为 {registered[0]}，不能按 {metric_type} 记录")
+
+
+def _series_key(name: str, labels: Optional[dict]) -> str:
+    """序列键：指标名 + 排序后的标签"""
+    return json.dumps([name, sorted((labels or {}).items())], ensure_ascii=False)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: list, extra: Optional[tuple] = None) -> str:
+    pairs = [f'{k}="{_escape_label(v)}"' for k, v in labels]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRecorder:
+    """指标记录器（进程内累积，flush 时合并写入）"""
+
+    def __init__(self, prom_path: Optional[Path]):
+        self.prom_path = prom_path
+        self._counters: dict[str, float] = {}
+        self._observations: dict[str, list[float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.prom_path is not None
+
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1) -> None:
+        """计数器累加"""
+        _check_metric(name, "counter")
+        if not self.enabled:
+            return
+        key = _series_key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None) -> None:
+        """直方图观测"""
+        _check_metric(name, "histogram")
+        if not self.enabled:
+            return
+        self._observations.setdefault(_series_key(name, labels), []).append(value)
+
+    def flush(self) -> None:
+        """合并本进程累积的指标并原子更新 .prom 文件（失败不影响主流程）"""
+        if not self.enabled or not (self._counters or self._observations):
+            return
+        try:
+            self._flush()
+        except Exception:
+            pass
+        self._counters.clear()
+        self._observations.clear()
+
+    def _flush(self) -> None:
+        prom_path = self.prom_path
+        assert prom_path is not None
+        prom_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path = prom_path.with_name(prom_path.name + ".json")
+
+        with open(prom_path.with_name(prom_path.name + ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                store = json.loads(state_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                store = {}
+            counters = store.setdefault("counters", {})
+            histograms = store.setdefault("histograms", {})
+
+            for key, value in self._counters.items():
+                counters[key] = counters.get(key, 0) + value
+
+            for key, values in self._observations.items():
+                hist = histograms.setdefault(
+                    key, {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+                )
+                for value in values:
+                    for i, bound in enumerate(DEFAULT_BUCKETS):
+                        if value <= bound:
+                            hist["buckets"][i] += 1
+                    hist["sum"] += value
+                    hist["count"] += 1
+
+            _atomic_write_text(state_path, json.dumps(store, ensure_ascii=False))
+            _atomic_write_text(prom_path, render_prometheus(store))
+
+
+def render_prometheus(store: dict) -> str:
+    """
+    将状态渲染为 Prometheus 文本格式
+
+    状态文件中已不在 METRICS 里的指标（如旧版本记录的）按所在分区确定类型：
+    counters 为 counter，histograms 为 histogram
+    """
+    series: dict[str, list] = {}
+    kinds: dict[str, str] = {}
+    for key, value in store.get("counters", {}).items():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append((labels, value))
+        kinds.setdefault(name, "counter")
+    for key, hist in store.get("histograms", {}).items():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append((labels, hist))
+        kinds.setdefault(name, "histogram")
+
+    lines = []
+    for name in sorted(series):
+        metric_type, help_text = METRICS.get(name, (kinds[name], name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(series[name], key=lambda item: str(item[0])):
+            if metric_type == "histogram":
+                for bound, bucket in zip(DEFAULT_BUCKETS, value["buckets"]):
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {bucket}"
+                    )
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _atomic_write_text(file_path: Path, content: str) -> None:
+    """原子写入文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=".tmp_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+_recorder: Optional[MetricsRecorder] = None
+_recorder_spec = ""  # 命令行或环境变量给出的路径（相对路径每次按当前 CLAUDE_PROJECT_DIR 解析）
+
+
+def _resolve_metrics_path(path_str: str) -> Optional[Path]:
+    if not path_str:
+        return None
+    path = Path(path_str)
+    if not path.is_absolute():
+        path = Path(os.environ.get("CLAUDE_PROJECT_DIR", "") or Path.cwd()) / path
+    return path
+
+
+def get_metrics(metrics_file: Optional[str] = None) -> MetricsRecorder:
+    """
+    获取进程内共享的指标记录器
+
+    Args:
+        metrics_file: 命令行指定的 .prom 路径，优先于环境变量 WF_METRICS_FILE；
+            相对路径基于 CLAUDE_PROJECT_DIR 解析
+
+    相对路径在每次调用时重新解析：同一进程处理多个项目目录（wf_sdk_hooks / wf-batch.py
+    切换 CLAUDE_PROJECT_DIR）时，指标写入当前项目目录；切换前先写出上一个记录器的累积值。
+    """
+    global _recorder, _recorder_spec
+    if metrics_file:
+        _recorder_spec = metrics_file
+    elif _recorder is None:
+        _recorder_spec = os.environ.get("WF_METRICS_FILE", "")
+    path = _resolve_metrics_path(_recorder_spec)
+    if _recorder is None or _recorder.prom_path != path:
+        if _recorder is not None:
+            _recorder.flush()
+        _recorder = MetricsRecorder(path)
+    return _recorder
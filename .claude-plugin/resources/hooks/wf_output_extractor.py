@@ -8,28 +8,35 @@ wf-output-extractor.py - 工作流节点输出提取工具
 用法：
   作为模块导入：
     from wf_output_extractor import extract_from_transcript, extract_from_text
+    from wf_output_extractor import aggregate_transcript_usage
 
   作为命令行工具：
     python wf-output-extractor.py --transcript <path>
+    python wf-output-extractor.py --transcript <path> --usage
     python wf-output-extractor.py --text <text>
     echo "<text>" | python wf-output-extractor.py --stdin
+    python wf-output-extractor.py --file .context/outputs/<node>.json --query 'items[*].id'
 """
 
 import json
+import os
 import re
 import sys
 import argparse
+import tempfile
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Optional, Any
 
+from wf_payload import SpilledText
+
 
 @dataclass
 class ExtractionResult:
     """提取结果"""
     success: bool
     json_data: Optional[Any] = None  # 提取的 JSON 数据（若有）
-    raw_text: str = ""               # 原始文本内容
+    raw_text: Any = ""               # 原始文本内容（落盘的大输出为 SpilledText）
     error: Optional[str] = None      # 错误信息（若失败）
     source: str = ""                 # 数据来源描述
 
@@ -190,17 +197,525 @@ def extract_from_transcript(transcript_path: str) -> ExtractionResult:
     return result
 
 
-def extract_from_tool_response(tool_response: str) -> ExtractionResult:
+# transcript 中 message.usage 的计数字段
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+def empty_usage() -> dict:
+    """创建空的 token 用量统计"""
+    usage = {field: 0 for field in USAGE_FIELDS}
+    usage["messages"] = 0
+    return usage
+
+
+def add_usage(target: dict, delta: dict, sign: int = 1) -> dict:
+    """将 delta 中的 token 计数累加到 target（sign=-1 时扣减）"""
+    for field in USAGE_FIELDS:
+        value = delta.get(field) or 0
+        if isinstance(value, (int, float)):
+            target[field] = target.get(field, 0) + sign * int(value)
+    target["messages"] = target.get("messages", 0) + sign * int(delta.get("messages", 0) or 0)
+    return target
+
+
+def diff_usage(after: dict, before: dict) -> dict:
+    """计算两次统计之间的增量"""
+    delta = empty_usage()
+    add_usage(delta, after)
+    add_usage(delta, before, sign=-1)
+    return delta
+
+
+def cache_hit_rate(usage: dict) -> float:
+    """缓存命中率 = cache_read / (input + cache_creation + cache_read)"""
+    cache_read = usage.get("cache_read_input_tokens", 0) or 0
+    prompt_total = (
+        (usage.get("input_tokens", 0) or 0)
+        + (usage.get("cache_creation_input_tokens", 0) or 0)
+        + cache_read
+    )
+    if prompt_total <= 0:
+        return 0.0
+    return cache_read / prompt_total
+
+
+def aggregate_transcript_usage(transcript_path: str, cursor: Optional[dict] = None) -> dict:
+    """
+    增量汇总 transcript 中 assistant 消息的 token 用量
+
+    从 cursor["offset"] 处继续读取，不会重复读取已处理的字节；
+    末尾未写完的行（无换行符）留到下次处理。
+
+    同一条 assistant 消息可能按 content block 拆成多行、且每行携带相同的
+    message.id 和 usage，因此按 message.id 去重：连续出现的同 id 行以最后
+    一行的 usage 为准。
+
+    Args:
+        transcript_path: transcript 文件路径
+        cursor: 上次返回的游标（None 表示从头读取）
+
+    Returns:
+        新游标 {offset, last_message_id, last_usage, usage, by_model}
+    """
+    cursor = dict(cursor or {})
+    usage = add_usage(empty_usage(), cursor.get("usage") or {})
+    by_model = {
+        model: add_usage(empty_usage(), model_usage)
+        for model, model_usage in (cursor.get("by_model") or {}).items()
+    }
+    offset = int(cursor.get("offset", 0) or 0)
+    last_message_id = cursor.get("last_message_id")
+    last_usage = cursor.get("last_usage")
+    last_model = cursor.get("last_model")
+
+    path = Path(transcript_path)
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return cursor or {"offset": 0, "usage": usage, "by_model": by_model}
+
+    if size < offset:
+        # 文件被截断或替换，重新统计
+        offset = 0
+        usage = empty_usage()
+        by_model = {}
+        last_message_id = last_usage = last_model = None
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break  # 行尚未写完
+            offset += len(raw_line)
+
+            entry = parse_transcript_line(raw_line.decode("utf-8", errors="replace"))
+            if not entry or entry.get("type") != "assistant":
+                continue
+            message = entry.get("message")
+            if not isinstance(message, dict) or not isinstance(message.get("usage"), dict):
+                continue
+
+            message_id = message.get("id") or entry.get("requestId") or entry.get("uuid")
+            model = message.get("model") or "unknown"
+            current = {field: message["usage"].get(field, 0) for field in USAGE_FIELDS}
+            current["messages"] = 1
+
+            if message_id and message_id == last_message_id and last_usage:
+                # 同一条消息的后续 block：撤销上一行的计数
+                add_usage(usage, last_usage, sign=-1)
+                if last_model in by_model:
+                    add_usage(by_model[last_model], last_usage, sign=-1)
+
+            add_usage(usage, current)
+            add_usage(by_model.setdefault(model, empty_usage()), current)
+            last_message_id, last_usage, last_model = message_id, current, model
+
+    return {
+        "offset": offset,
+        "last_message_id": last_message_id,
+        "last_usage": last_usage,
+        "last_model": last_model,
+        "usage": usage,
+        "by_model": by_model,
+    }
+
+
+def extract_from_tool_response(tool_response: Any) -> ExtractionResult:
     """
     从 tool_response 中提取输出
 
-    tool_response 是 Task 工具返回的节点最后一条消息内容
+    tool_response 是 Task 工具返回的节点最后一条消息内容；
+    负载读取时已落盘的大输出（SpilledText）直接从临时文件分块扫描
     """
-    result = extract_json_from_text(tool_response)
+    if isinstance(tool_response, SpilledText):
+        result = extract_json_from_spilled(tool_response)
+    else:
+        result = extract_json_from_text(tool_response)
     result.source = f"tool_response:{result.source}"
     return result
 
 
+# 分块扫描 ```json 代码块时的读取大小
+_SCAN_CHUNK_BYTES = 1024 * 1024
+_FENCE_OPEN = b"```json"
+_FENCE_CLOSE = b"```"
+
+
+def _last_json_block(path: Path) -> Optional[tuple[int, int]]:
+    """
+    分块查找文件中最后一个 ```json 代码块内容的字节范围
+
+    与 extract_json_from_text 的正则逐个匹配的结果一致：代码块内容止于其后第一个 ```
+    """
+    last = None
+    content_start = None   # 已找到开始标记、尚未找到结束标记的代码块内容起点
+    keep = len(_FENCE_OPEN) - 1
+    base = 0               # data[0] 在文件中的偏移
+    carry = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_SCAN_CHUNK_BYTES)
+            if not chunk:
+                return last
+            data = carry + chunk
+            pos = 0
+            while True:
+                if content_start is None:
+                    index = data.find(_FENCE_OPEN, pos)
+                    if index == -1:
+                        break
+                    content_start = base + index + len(_FENCE_OPEN)
+                    pos = index + len(_FENCE_OPEN)
+                else:
+                    index = data.find(_FENCE_CLOSE, max(pos, content_start - base))
+                    if index == -1:
+                        break
+                    last = (content_start, base + index)
+                    content_start = None
+                    pos = index + len(_FENCE_CLOSE)
+            # 保留末尾可能被截断的标记
+            tail = max(len(data) - keep, pos)
+            carry = data[tail:]
+            base += tail
+
+
+def extract_json_from_spilled(spilled: SpilledText) -> ExtractionResult:
+    """
+    从落盘的大输出中提取 JSON（规则同 extract_json_from_text，不把全文读入内存）
+
+    只读取最后一个 ```json 代码块的内容；没有代码块且内容以 { 或 [ 开头时才整体解析。
+    """
+    block = _last_json_block(spilled.path)
+    if block:
+        start, end = block
+        with open(spilled.path, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start)
+        try:
+            return ExtractionResult(
+                success=True,
+                json_data=json.loads(content.strip()),
+                raw_text=spilled,
+                source="json_code_block"
+            )
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+        del content
+
+    if spilled.head(64).lstrip()[:1] in ("{", "["):
+        try:
+            with open(spilled.path, "rb") as f:
+                return ExtractionResult(
+                    success=True,
+                    json_data=json.load(f),
+                    raw_text=spilled,
+                    source="raw_json"
+                )
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            pass
+
+    return ExtractionResult(
+        success=True,
+        json_data=None,
+        raw_text=spilled,
+        source="plain_text"
+    )
+
+
+# ============================================================
+# 字段查询（JSON Pointer / JSONPath 子集）
+# ============================================================
+
+# 偏移索引格式版本，格式变化时旧索引自动失效
+INDEX_VERSION = 1
+
+# 查询命中的元素超过该数量时，一次读取覆盖范围而不是逐个 seek
+_SEEK_LIMIT = 64
+
+_WILDCARD = object()
+
+_PATH_TOKEN = re.compile(
+    r"""\.(?P<name>[^.\[\]]+)|\[(?P<index>-?\d+)\]|\[(?P<star>\*)\]|\[(?P<quote>["'])(?P<key>.*?)(?P=quote)\]"""
+)
+
+_JSON_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class QueryError(Exception):
+    """查询表达式无效或路径不存在"""
+
+
+def parse_query(expr: str) -> list:
+    """
+    解析查询表达式为路径步骤
+
+    支持:
+    - JSON Pointer: /items/0/id
+    - JSONPath 子集: $.items[*].id、items[-1].name、$["key.with.dot"]、summary.*
+
+    Returns:
+        步骤列表，元素为 str（对象键或 JSON Pointer 片段）、int（数组下标）或通配符
+    """
+    expr = expr.strip()
+    if expr in ("", "$", "/"):
+        return []
+    if expr.startswith("/"):
+        return [
+            token.replace("~1", "/").replace("~0", "~")
+            for token in expr[1:].split("/")
+        ]
+
+    if expr.startswith("$"):
+        expr = expr[1:]
+    if not expr.startswith((".", "[")):
+        expr = "." + expr
+
+    steps: list = []
+    pos = 0
+    while pos < len(expr):
+        match = _PATH_TOKEN.match(expr, pos)
+        if not match:
+            raise QueryError(f"无法解析查询表达式: 位置 {pos} 附近 '{expr[pos:pos + 10]}'")
+        if match.group("name") is not None:
+            name = match.group("name")
+            steps.append(_WILDCARD if name == "*" else name)
+        elif match.group("index") is not None:
+            steps.append(int(match.group("index")))
+        elif match.group("star") is not None:
+            steps.append(_WILDCARD)
+        else:
+            steps.append(match.group("key"))
+        pos = match.end()
+    return steps
+
+
+def _step_into(value: Any, step: Any) -> list:
+    """对一个值应用一步路径，返回匹配到的值列表"""
+    if step is _WILDCARD:
+        if isinstance(value, dict):
+            return list(value.values())
+        if isinstance(value, list):
+            return list(value)
+        return []
+    if isinstance(value, dict):
+        return [value[step]] if isinstance(step, str) and step in value else []
+    if isinstance(value, list):
+        try:
+            index = int(step)
+        except (TypeError, ValueError):
+            return []
+        if -len(value) <= index < len(value):
+            return [value[index]]
+    return []
+
+
+def apply_query(data: Any, steps: list) -> list:
+    """在已解析的 JSON 数据上执行查询，返回所有匹配值"""
+    current = [data]
+    for step in steps:
+        current = [item for value in current for item in _step_into(value, step)]
+    return current
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _scan_array(text: str, pos: int) -> tuple[list, int]:
+    """扫描数组（pos 指向 '['），返回 (元素偏移 [[start, end], ...], 数组结束位置)"""
+    items = []
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "]":
+        return items, pos + 1
+    while True:
+        _, end = _JSON_DECODER.raw_decode(text, pos)
+        items.append([pos, end])
+        pos = _skip_ws(text, end)
+        if text[pos] == "]":
+            return items, pos + 1
+        if text[pos] != ",":
+            raise ValueError(f"数组在位置 {pos} 处格式错误")
+        pos = _skip_ws(text, pos + 1)
+
+
+def _to_byte_offsets(text: str, index: dict) -> dict:
+    """将索引中的字符偏移转换为 UTF-8 字节偏移（纯 ASCII 文本两者相同）"""
+    if text.isascii():
+        return index
+
+    spans = []
+    if index.get("type") == "array":
+        spans.extend(index["items"])
+    elif index.get("type") == "object":
+        for entry in index["keys"].values():
+            spans.append(entry["span"])
+            spans.extend(entry.get("items") or [])
+
+    # 按偏移顺序一次遍历，累加中间片段的编码长度
+    positions = sorted({pos for span in spans for pos in span})
+    mapping = {}
+    char_pos = byte_pos = 0
+    for pos in positions:
+        byte_pos += len(text[char_pos:pos].encode("utf-8"))
+        char_pos = pos
+        mapping[pos] = byte_pos
+    for span in spans:
+        span[0], span[1] = mapping[span[0]], mapping[span[1]]
+    return index
+
+
+def build_offset_index(text: str) -> dict:
+    """
+    构建顶层偏移索引（偏移为 UTF-8 字节偏移）
+
+    记录顶层对象每个键（或顶层数组每个元素）的值在文件中的起止偏移；
+    值为数组时再记录其元素偏移。逐个值解码后立即丢弃，不保留整棵对象树。
+    """
+    return _to_byte_offsets(text, _build_char_index(text))
+
+
+def _build_char_index(text: str) -> dict:
+    """构建字符偏移的顶层索引"""
+    pos = _skip_ws(text, 0)
+    if pos < len(text) and text[pos] == "[":
+        items, _ = _scan_array(text, pos)
+        return {"type": "array", "items": items}
+    if pos >= len(text) or text[pos] != "{":
+        _JSON_DECODER.raw_decode(text, pos)
+        return {"type": "scalar"}
+
+    keys = {}
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "}":
+        return {"type": "object", "keys": keys}
+    while True:
+        key, pos = _JSON_DECODER.raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if text[pos] != ":":
+            raise ValueError(f"对象在位置 {pos} 处格式错误")
+        start = _skip_ws(text, pos + 1)
+        if text[start] == "[":
+            items, end = _scan_array(text, start)
+            keys[key] = {"span": [start, end], "items": items}
+        else:
+            _, end = _JSON_DECODER.raw_decode(text, start)
+            keys[key] = {"span": [start, end]}
+        pos = _skip_ws(text, end)
+        if text[pos] == "}":
+            return {"type": "object", "keys": keys}
+        if text[pos] != ",":
+            raise ValueError(f"对象在位置 {pos} 处格式错误")
+        pos = _skip_ws(text, pos + 1)
+
+
+def _index_path(file_path: Path) -> Path:
+    return file_path.parent / ".index" / f"{file_path.name}.idx.json"
+
+
+def load_offset_index(file_path: Path) -> dict:
+    """读取偏移索引（按文件大小和修改时间判断是否失效，失效时重建并缓存）"""
+    stat = file_path.stat()
+    signature = [INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+    index_path = _index_path(file_path)
+    try:
+        cached = json.loads(index_path.read_text(encoding="utf-8"))
+        if cached.get("signature") == signature:
+            return cached["index"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_offset_index(file_path.read_text(encoding="utf-8"))
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, prefix=".tmp_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"signature": signature, "index": index}, f, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass  # 索引缓存写入失败不影响查询
+    return index
+
+
+def _read_spans(file_path: Path, spans: list) -> list:
+    """按字节偏移读取并解码若干个值"""
+    if not spans:
+        return []
+    with open(file_path, "rb") as f:
+        if len(spans) <= _SEEK_LIMIT:
+            values = []
+            for start, end in spans:
+                f.seek(start)
+                values.append(json.loads(f.read(end - start)))
+            return values
+        low = min(span[0] for span in spans)
+        high = max(span[1] for span in spans)
+        f.seek(low)
+        block = f.read(high - low)
+    return [json.loads(block[start - low:end - low]) for start, end in spans]
+
+
+def _select_items(items: list, step: Any) -> list:
+    """按步骤从元素偏移列表中选择元素"""
+    if step is _WILDCARD:
+        return items
+    try:
+        index = int(step)
+    except (TypeError, ValueError):
+        return []
+    if -len(items) <= index < len(items):
+        return [items[index]]
+    return []
+
+
+def query_json_file(file_path: str, expr: str) -> list:
+    """
+    查询 JSON 文件中的字段，只解码路径经过的部分
+
+    Returns:
+        所有匹配值（表达式不含通配符时至多一个）
+    """
+    steps = parse_query(expr)
+    path = Path(file_path)
+    if not steps:
+        return [json.loads(path.read_text(encoding="utf-8"))]
+
+    index = load_offset_index(path)
+    kind = index.get("type")
+
+    if kind == "object":
+        first = steps[0]
+        if first is _WILDCARD:
+            entries = list(index["keys"].values())
+        elif isinstance(first, str) and first in index["keys"]:
+            entries = [index["keys"][first]]
+        else:
+            return []
+        rest = steps[1:]
+        if len(entries) == 1 and rest and "items" in entries[0]:
+            # 顶层键的值是数组：直接按元素偏移解码所需元素
+            values = _read_spans(path, _select_items(entries[0]["items"], rest[0]))
+            return [item for value in values for item in apply_query(value, rest[1:])]
+        values = _read_spans(path, [entry["span"] for entry in entries])
+        return [item for value in values for item in apply_query(value, rest)]
+
+    if kind == "array":
+        values = _read_spans(path, _select_items(index["items"], steps[0]))
+        return [item for value in values for item in apply_query(value, steps[1:])]
+
+    return apply_query(json.loads(path.read_text(encoding="utf-8")), steps)
+
+
+def has_wildcard(expr: str) -> bool:
+    """表达式是否包含通配符（结果为列表）"""
+    return any(step is _WILDCARD for step in parse_query(expr))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="从 transcript 或文本中提取节点输出"
@@ -219,6 +734,10 @@ def main():
         action="store_true",
         help="从 stdin 读取文本"
     )
+    group.add_argument(
+        "--file", "-f",
+        help="节点输出 JSON 文件路径（配合 --query 只读取所需字段）"
+    )
     parser.add_argument(
         "--json-only",
         action="store_true",
@@ -229,9 +748,46 @@ def main():
         action="store_true",
         help="只输出原始文本"
     )
+    parser.add_argument(
+        "--usage",
+        action="store_true",
+        help="汇总 transcript 中的 token 用量（需配合 --transcript）"
+    )
+    parser.add_argument(
+        "--query", "-q",
+        help="查询字段：JSON Pointer（/items/0/id）或 JSONPath 子集（$.items[*].id）"
+    )
 
     args = parser.parse_args()
 
+    if args.file:
+        if not args.query:
+            parser.error("--file 需要配合 --query 使用")
+        try:
+            matches = query_json_file(args.file, args.query)
+        except (OSError, ValueError, QueryError) as e:
+            print(f"查询失败: {e}", file=sys.stderr)
+            sys.exit(2)
+        # 查询结果单行输出，减少读取方的上下文占用
+        if has_wildcard(args.query):
+            print(json.dumps(matches, ensure_ascii=False))
+            sys.exit(0)
+        if not matches:
+            print(f"路径不存在: {args.query}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(matches[0], ensure_ascii=False))
+        sys.exit(0)
+
+    if args.usage:
+        if not args.transcript:
+            parser.error("--usage 需要配合 --transcript 使用")
+        cursor = aggregate_transcript_usage(args.transcript)
+        report = dict(cursor["usage"])
+        report["cache_hit_rate"] = round(cache_hit_rate(cursor["usage"]), 4)
+        report["by_model"] = cursor["by_model"]
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(0)
+
     # 执行提取
     if args.transcript:
         result = extract_from_transcript(args.transcript)
@@ -242,7 +798,17 @@ def main():
         result = extract_from_tool_response(text)
 
     # 输出结果
-    if args.json_only:
+    if args.query:
+        try:
+            matches = apply_query(result.json_data, parse_query(args.query))
+        except QueryError as e:
+            print(f"查询失败: {e}", file=sys.stderr)
+            sys.exit(2)
+        if has_wildcard(args.query):
+            print(json.dumps(matches, ensure_ascii=False))
+        else:
+            print(json.dumps(matches[0] if matches else None, ensure_ascii=False))
+    elif args.json_only:
         if result.json_data is not None:
             print(json.dumps(result.json_data, ensure_ascii=False, indent=2))
         else:
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+wf_payload.py - Hook 负载读取（大字符串字段落盘）
+
+PostToolUse (Task) 的 tool_response 是子 Agent 的完整回复，可能有数 MB。整体
+json.load 之后，原文还会在成功判断、摘要截取、blob 存储、JSON 提取时被复制多份，
+Hook 进程的峰值内存随输出大小线性增长。
+
+load_payload() 分块读取 stdin 并扫描 JSON 文本：指定顶层字段（默认 tool_response /
+tool_result）下超过阈值的字符串值不进入内存，边读边解码写入临时文件，在解析结果中
+以 SpilledText 代替；负载的其余部分照常 json.loads。
+
+    payload = load_payload(sys.stdin.buffer, spill_bytes=1024 * 1024)
+    output = payload["tool_response"]        # str 或 SpilledText（嵌套在对象中时同理）
+    for chunk in iter_text(output): ...      # 两者都可以分块遍历
+
+SpilledText 提供 iter_chunks() / head() / tail() / read()，临时文件在进程退出时删除。
+wf-state 写节点输出、wf_output_extractor 提取 JSON 代码块、wf_store 写 blob 都直接读取
+临时文件，峰值内存与分块大小相关，与输出大小无关（JSON 代码块本身仍需完整解析）。
+"""
+
+import atexit
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Optional, Union
+
+
+# 默认落盘阈值（单个字符串值的 JSON 编码字节数）
+SPILL_BYTES = 1024 * 1024
+# 默认落盘的顶层字段
+SPILL_FIELDS = ("tool_response", "tool_result")
+# stdin 分块读取大小
+READ_CHUNK_BYTES = 1024 * 1024
+# 落盘文本的分块读取大小（字符）
+TEXT_CHUNK_CHARS = 256 * 1024
+
+# 信封中代替落盘字符串的占位值（NUL 开头，正常文本中不会出现）
+_PLACEHOLDER = "\x00wf-spill:"
+_PLACEHOLDER_JSON = re.compile(r'"\\u0000wf-spill:(\d+)"')
+
+_QUOTE = 0x22
+_BACKSLASH = 0x5C
+_OPENERS = (ord("{"), ord(","))
+
+_spilled_paths: list[str] = []
+
+
+def _cleanup() -> None:
+    for path in _spilled_paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+atexit.register(_cleanup)
+
+
+class SpilledText:
+    """落盘的字符串字段（UTF-8 文本文件，size 为字节数）"""
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def __repr__(self) -> str:
+        return f"SpilledText({str(self.path)!r}, size={self.size})"
+
+    def iter_chunks(self, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+        """分块读取全文"""
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            while True:
+                chunk = f.read(chunk_chars)
+                if not chunk:
+                    return
+                yield chunk
+
+    def head(self, chars: int) -> str:
+        """开头 chars 个字符"""
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            return f.read(chars)
+
+    def tail(self, chars: int) -> str:
+        """末尾 chars 个字符（按每字符至多 4 字节定位，不读取全文）"""
+        with open(self.path, "rb") as f:
+            f.seek(max(self.size - chars * 4, 0))
+            data = f.read()
+        return data.decode("utf-8", errors="ignore")[-chars:]
+
+    def read(self) -> str:
+        """读取全文（仅用于确实需要完整字符串的场景，如事件录制）"""
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+
+def iter_text(value: Any, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+    """
+    分块返回字段的文本形式
+
+    字符串原样切分，SpilledText 从临时文件读取，其他值按 json.dumps(ensure_ascii=False) 编码
+    （其中嵌套的 SpilledText 同样分块读取）。
+    """
+    if isinstance(value, SpilledText):
+        yield from value.iter_chunks(chunk_chars)
+    elif isinstance(value, str):
+        for start in range(0, len(value), chunk_chars):
+            yield value[start:start + chunk_chars]
+    else:
+        yield from iter_dumps(value, chunk_chars)
+
+
+def iter_dumps(value: Any, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+    """流式 JSON 编码（与 json.dumps(value, ensure_ascii=False) 输出一致）"""
+    spilled: list[SpilledText] = []
+    concealed = _conceal(value, spilled)
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    if not spilled:
+        yield from encoder.iterencode(concealed)
+        return
+    for chunk in encoder.iterencode(concealed):
+        pos = 0
+        for match in _PLACEHOLDER_JSON.finditer(chunk):
+            yield chunk[pos:match.start()]
+            yield '"'
+            for piece in spilled[int(match.group(1))].iter_chunks(chunk_chars):
+                yield json.dumps(piece, ensure_ascii=False)[1:-1]
+            yield '"'
+            pos = match.end()
+        yield chunk[pos:]
+
+
+def _conceal(value: Any, spilled: list) -> Any:
+    """把 SpilledText 换回占位字符串（编码时再展开）"""
+    if isinstance(value, SpilledText):
+        spilled.append(value)
+        return f"{_PLACEHOLDER}{len(spilled) - 1}"
+    if isinstance(value, dict):
+        return {key: _conceal(item, spilled) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_conceal(item, spilled) for item in value]
+    return value
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps 的 default 钩子：SpilledText 展开为全文"""
+    if isinstance(value, SpilledText):
+        return value.read()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _Reader:
+    """stdin 分块缓冲"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.buf = b""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """读入下一块（丢弃已消费的部分）；流结束时返回 False"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def until_quote(self) -> tuple[bytes, bool]:
+        """读取到下一个双引号（字符串外）之前的内容，并消费该引号"""
+        parts = []
+        while True:
+            index = self.buf.find(b'"', self.pos)
+            if index != -1:
+                parts.append(self.buf[self.pos:index])
+                self.pos = index + 1
+                return b"".join(parts), True
+            parts.append(self.buf[self.pos:])
+            self.buf, self.pos = b"", 0
+            if not self.fill():
+                return b"".join(parts), False
+
+    def closing_quote(self, start: int) -> int:
+        """字符串内从 start 起第一个未转义的双引号下标（不存在时返回 -1）"""
+        buf = self.buf
+        index = buf.find(b'"', start)
+        while index != -1:
+            run = index
+            while run > self.pos and buf[run - 1] == _BACKSLASH:
+                run -= 1
+            if (index - run) % 2 == 0:
+                return index
+            index = buf.find(b'"', index + 1)
+        return -1
+
+
+def _safe_cut(buf: bytes, start: int, end: int) -> int:
+    """
+    字符串内容的安全截断点（截断点之前的部分可以单独解码）
+
+    不截断转义序列、\\uXXXX 代理对和 UTF-8 多字节字符。
+    """
+    # 转义序列至多 6 字节：末尾 12 字节内有反斜杠时，截到最后一段连续反斜杠之前
+    backslash = buf.rfind(b"\\", max(start, end - 12), end)
+    if backslash != -1:
+        cut = backslash
+        while cut > start and buf[cut - 1] == _BACKSLASH:
+            cut -= 1
+        # 截断点前是高代理项（\uD800-\uDBFF）时一并留到下一段
+        high = cut - 6
+        if high >= start and buf[high + 1:high + 2] == b"u" and buf[high + 2:high + 4].lower() in (
+            b"d8", b"d9", b"da", b"db"
+        ):
+            run = high
+            while run > start and buf[run - 1] == _BACKSLASH:
+                run -= 1
+            if buf[high] == _BACKSLASH and (high - run) % 2 == 0:
+                cut = high
+        return cut
+
+    # 末尾是不完整的 UTF-8 字符时留到下一段
+    lead = end - 1
+    while lead > start and buf[lead] & 0xC0 == 0x80:
+        lead -= 1
+    if lead < end:
+        byte = buf[lead]
+        width = 1 if byte < 0x80 else 2 if byte >> 5 == 0b110 else 3 if byte >> 4 == 0b1110 else 4
+        if lead + width > end:
+            return lead
+    return end
+
+
+def _decode_piece(piece: bytes) -> bytes:
+    """解码 JSON 字符串片段的转义，返回 UTF-8 字节"""
+    if b"\\" not in piece:
+        return piece
+    text = json.loads(b'"' + piece + b'"', strict=False)
+    return text.encode("utf-8", errors="replace")
+
+
+def _spill_string(reader: _Reader, spill_dir: Optional[str]) -> SpilledText:
+    """把当前字符串（起点为 reader.pos）解码写入临时文件，消费到结束引号之后"""
+    fd, path = tempfile.mkstemp(prefix="wf-spill-", suffix=".txt", dir=spill_dir)
+    _spilled_paths.append(path)
+    size = 0
+    with os.fdopen(fd, "wb") as f:
+        while True:
+            end = reader.closing_quote(reader.pos)
+            if end != -1:
+                data = _decode_piece(reader.buf[reader.pos:end])
+                f.write(data)
+                size += len(data)
+                reader.pos = end + 1
+                return SpilledText(Path(path), size)
+            cut = _safe_cut(reader.buf, reader.pos, len(reader.buf))
+            data = _decode_piece(reader.buf[reader.pos:cut])
+            f.write(data)
+            size += len(data)
+            reader.pos = cut
+            if not reader.fill():
+                raise json.JSONDecodeError("Unterminated string", "", size)
+
+
+def _scan(
+    stream: BinaryIO,
+    spill_bytes: int,
+    fields: tuple,
+    spill_dir: Optional[str],
+) -> tuple[bytes, list]:
+    """
+    扫描负载 JSON，返回 (信封 JSON, 落盘字段列表)
+
+    只跟踪字符串边界和嵌套深度：结构部分原样复制到信封，字符串在指定顶层字段下
+    且超过阈值时落盘，信封中以占位字符串代替。
+    """
+    reader = _Reader(stream)
+    envelope = bytearray()
+    spilled: list[SpilledText] = []
+    depth = 0
+    previous = 0       # 字符串外最后一个非空白字节
+    top_key = None     # 当前所在的顶层字段
+
+    while True:
+        segment, found = reader.until_quote()
+        envelope += segment
+        depth += segment.count(b"{") + segment.count(b"[") - segment.count(b"}") - segment.count(b"]")
+        stripped = segment.rstrip()
+        if stripped:
+            previous = stripped[-1]
+        if not found:
+            return bytes(envelope), spilled
+
+        is_key = depth == 1 and previous in _OPENERS
+        eligible = depth >= 1 and not is_key and top_key in fields
+
+        # 查找结束引号；可落盘的字符串超过阈值时改为边读边写
+        searched = reader.pos
+        while True:
+            end = reader.closing_quote(searched)
+            length = (end if end != -1 else len(reader.buf)) - reader.pos
+            if eligible and length > spill_bytes:
+                spilled.append(_spill_string(reader, spill_dir))
+                envelope += f'"\\u0000wf-spill:{len(spilled) - 1}"'.encode("ascii")
+                break
+            if end != -1:
+                body = reader.buf[reader.pos:end]
+                reader.pos = end + 1
+                envelope += b'"' + body + b'"'
+                if is_key:
+                    top_key = json.loads(b'"' + body + b'"', strict=False)
+                break
+            searched_offset = len(reader.buf) - reader.pos
+            if not reader.fill():
+                raise json.JSONDecodeError("Unterminated string", "", len(envelope))
+            searched = reader.pos + searched_offset
+        previous = _QUOTE
+
+
+def _restore(value: Any, spilled: list) -> Any:
+    """把占位字符串换回 SpilledText"""
+    if isinstance(value, str):
+        if value.startswith(_PLACEHOLDER):
+            return spilled[int(value[len(_PLACEHOLDER):])]
+        return value
+    if isinstance(value, dict):
+        return {key: _restore(item, spilled) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore(item, spilled) for item in value]
+    return value
+
+
+def load_payload(
+    source: Union[bytes, BinaryIO, None] = None,
+    spill_bytes: int = SPILL_BYTES,
+    fields: tuple = SPILL_FIELDS,
+    spill_dir: Optional[str] = None,
+) -> dict:
+    """
+    解析 Hook 负载，大字符串字段落盘
+
+    Args:
+        source: 原始字节或二进制流（默认 sys.stdin.buffer）
+        spill_bytes: 落盘阈值（字节），<= 0 时不落盘，与 json.loads 相同
+        fields: 允许落盘的顶层字段
+        spill_dir: 临时文件目录（默认系统临时目录）
+
+    Raises:
+        json.JSONDecodeError: 负载不是有效 JSON
+    """
+    if source is None:
+        source = sys.stdin.buffer
+    if isinstance(source, (bytes, bytearray)):
+        if spill_bytes <= 0 or len(source) <= spill_bytes:
+            return json.loads(source)
+        source = io.BytesIO(source)
+    elif spill_bytes <= 0:
+        return json.loads(source.read())
+
+    envelope, spilled = _scan(source, spill_bytes, fields, spill_dir)
+    data = json.loads(envelope)
+    if spilled and isinstance(data, dict):
+        for field in fields:
+            if field in data:
+                data[field] = _restore(data[field], spilled)
+    return data
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+wf_profile.py - Hook 脚本自我剖析
+
+记录一次 Hook 调用中各阶段（stdin 解析、状态加载、YAML、输出提取、
+Schema 校验、原子保存等）的单调时钟耗时，供 wf-state.py 和
+contract-validator.py 共同使用。
+
+启用方式（默认关闭，关闭时 phase() 为空操作）：
+- 环境变量 WF_PROFILE=1 或脚本参数 --profile
+- 环境变量 WF_PROFILE_TOP=N：同时使用 cProfile 采样，只保留最慢的 N 次调用的
+  统计文件（.context/profile/*.prof，可用 `python -m pstats` 或 snakeviz 查看）
+
+输出:
+- .context/profile.jsonl: 每次调用一行 {ts, script, event, total_ms, phases}
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+def get_profile_dir() -> Path:
+    """获取剖析输出目录（.context）"""
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "")
+    return Path(project_dir or Path.cwd()) / ".context"
+
+
+class HookProfiler:
+    """Hook 调用剖析器"""
+
+    def __init__(self, script: str, enabled: bool, top_n: int = 0):
+        self.script = script
+        self.enabled = enabled
+        self.top_n = top_n if enabled else 0
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self._stack: list[str] = []
+        self._cprofile = None
+
+        if self.top_n > 0:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        记录一个阶段的耗时
+
+        嵌套阶段以 "/" 连接父阶段名，同名阶段多次进入时耗时累加。
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._stack.append(name)
+        key = "/".join(self._stack)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[key] = self.phases.get(key, 0.0) + (time.perf_counter() - started)
+            self._stack.pop()
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        """记录在剖析器创建前测得的阶段（如模块导入）"""
+        if self.enabled:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self, event: str) -> None:
+        """写入剖析记录（失败不影响主流程）"""
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+        try:
+            profile_dir = get_profile_dir()
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            entry = {
+                "ts": round(time.time(), 3),
+                "script": self.script,
+                "event": event or "unknown",
+                "total_ms": round(total * 1000, 3),
+                "phases": {k: round(v * 1000, 3) for k, v in self.phases.items()},
+            }
+            with open(profile_dir / "profile.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+            if self._cprofile is not None:
+                self._keep_if_slowest(profile_dir / "profile", total, event)
+        except Exception:
+            pass
+
+    def _keep_if_slowest(self, stats_dir: Path, total: float, event: str) -> None:
+        """仅当本次调用属于最慢的 N 次时保存 cProfile 统计"""
+        stats_dir.mkdir(parents=True, exist_ok=True)
+        # 文件名以耗时（微秒）开头，按名称排序即按耗时排序
+        existing = sorted(stats_dir.glob("*.prof"))
+        micros = int(total * 1_000_000)
+        if len(existing) >= self.top_n:
+            fastest = int(existing[0].name.split("-", 1)[0])
+            if micros <= fastest:
+                return
+
+        name = f"{micros:012d}-{self.script}-{event or 'unknown'}-{os.getpid()}.prof"
+        assert self._cprofile is not None
+        self._cprofile.dump_stats(str(stats_dir / name))
+
+        existing = sorted(stats_dir.glob("*.prof"))
+        for stale in existing[: max(len(existing) - self.top_n, 0)]:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+
+_profiler: Optional[HookProfiler] = None
+
+
+def get_profiler(script: str = "", enable: bool = False) -> HookProfiler:
+    """
+    获取进程内共享的剖析器
+
+    首次调用时创建（应在 main() 开头，传入脚本名和 --profile 参数）；
+    之后各模块直接调用 get_profiler() 获取同一实例。
+    """
+    if _profiler is None:
+        return reset_profiler(script, enable)
+    return _profiler
+
+
+def reset_profiler(script: str = "", enable: bool = False) -> HookProfiler:
+    """
+    为新的一次事件创建剖析器并替换进程内共享的实例
+
+    命令行 Hook 每个进程只处理一个事件，get_profiler() 即可；长驻进程（wf_sdk_hooks、
+    wf-batch.py）每个事件开始时调用本函数，计时起点和阶段不跨事件累积，结束时调用 finish()
+    """
+    global _profiler
+    enabled = enable or os.environ.get("WF_PROFILE", "") not in ("", "0", "false")
+    try:
+        top_n = int(os.environ.get("WF_PROFILE_TOP", "0") or 0)
+    except ValueError:
+        top_n = 0
+    _profiler = HookProfiler(script or "hook", enabled, top_n)
+    return _profiler
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+wf_record.py - Hook 事件录制
+
+设置环境变量 WF_RECORD_DIR=<bundle-dir> 后，wf-hook.py、wf-state.py 和 contract-validator.py
+每次被调用时把 stdin 负载、命令行参数以及负载引用的 transcript 快照保存到
+录制包中，供 wf-bench.py replay 按原顺序回放并统计延迟。
+
+录制包结构:
+    <bundle>/
+    ├── events/{time_ns}-{pid}-{script}.json   # 单个事件（按文件名排序即调用顺序）
+    ├── transcripts/{sha256}.jsonl              # transcript 快照（按内容去重）
+    └── project/.claude/contracts/              # 首次录制时复制的契约目录
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from wf_payload import json_default
+
+
+# 负载中引用 transcript 文件的字段
+TRANSCRIPT_FIELDS = ("transcript_path", "agent_transcript_path")
+
+# 这些事件会读取 transcript 内容，需要保存快照
+SNAPSHOT_EVENTS = ("UserPromptSubmit", "SubagentStop", "Stop")
+
+
+def get_record_dir() -> Optional[Path]:
+    """获取录制目录（未设置 WF_RECORD_DIR 时返回 None）"""
+    record_dir = os.environ.get("WF_RECORD_DIR", "")
+    return Path(record_dir) if record_dir else None
+
+
+def _snapshot_transcript(bundle: Path, transcript_path: str) -> Optional[str]:
+    """保存 transcript 快照，返回包内相对路径"""
+    try:
+        content = Path(transcript_path).read_bytes()
+    except OSError:
+        return None
+    digest = hashlib.sha256(content).hexdigest()
+    relative = f"transcripts/{digest}.jsonl"
+    target = bundle / relative
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, target)
+    return relative
+
+
+def _snapshot_contracts(bundle: Path) -> None:
+    """首次录制时复制契约目录，回放时校验器才能加载同样的契约"""
+    target = bundle / "project" / ".claude" / "contracts"
+    if target.exists():
+        return
+    project_dir = Path(os.environ.get("CLAUDE_PROJECT_DIR", "") or Path.cwd())
+    source = project_dir / ".claude" / "contracts"
+    if source.is_dir():
+        shutil.copytree(source, target, dirs_exist_ok=True)
+    else:
+        target.mkdir(parents=True, exist_ok=True)
+
+
+def record_event(script: str, argv: list[str], input_data: dict) -> None:
+    """
+    录制一次 Hook 调用（未启用时为空操作，失败不影响主流程）
+
+    Args:
+        script: 脚本文件名（wf-hook.py / wf-state.py / contract-validator.py）
+        argv: 命令行参数（不含脚本名）
+        input_data: 已解析的 stdin 负载
+    """
+    bundle = get_record_dir()
+    if bundle is None:
+        return
+
+    try:
+        _snapshot_contracts(bundle)
+
+        hook_event = input_data.get("hook_event_name", "")
+        snapshots = {}
+        if hook_event in SNAPSHOT_EVENTS:
+            for field in TRANSCRIPT_FIELDS:
+                path = input_data.get(field)
+                if path:
+                    relative = _snapshot_transcript(bundle, path)
+                    if relative:
+                        snapshots[field] = relative
+
+        entry = {
+            "ts": time.time(),
+            "script": script,
+            "argv": argv,
+            "event": hook_event,
+            "payload": input_data,
+            "transcripts": snapshots,
+        }
+        events_dir = bundle / "events"
+        events_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns()}-{os.getpid()}-{script}.json"
+        # 落盘的大字段展开为全文，回放时与原始负载一致
+        (events_dir / name).write_text(json.dumps(entry, ensure_ascii=False, default=json_default), encoding="utf-8")
+    except Exception:
+        pass
+
+
+def load_events(bundle: Path) -> list[dict]:
+    """按调用顺序读取录制包中的事件"""
+    events = []
+    for path in sorted((bundle / "events").glob("*.json"), key=lambda p: int(p.name.split("-", 1)[0])):
+        events.append(json.loads(path.read_text(encoding="utf-8")))
+    return events
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+wf_schema_compiler.py - 契约 Schema 编译器
+
+contract-validator.py 默认通过 jsonschema 解释执行契约中的 JSON Schema，每次校验
+都要遍历 Schema、查找关键字实现、构造错误对象。`contract-validator.py --compile`
+在编写契约时把 Schema 编译成纯 Python 校验模块，缓存到
+`.claude/contracts/.compiled/{contract}.py`，校验时直接调用生成的函数。
+
+生成的模块:
+- SOURCE_HASH: 编译时 Schema 的哈希（含编译器版本），加载时与当前 Schema 比对，
+  不一致（契约已修改但未重新编译）时忽略编译结果，回退到 jsonschema
+- collect_errors(instance): 返回所有原始错误，不依赖 jsonschema
+
+错误选择与 jsonschema.validate 一致（best_match：按路径深度、关键字优先级和类型匹配
+选出最相关的错误，再沿 anyOf/oneOf 的 context 下钻），error_details() 生成的
+field / expected / actual / message 与解释执行路径相同。
+
+支持 JSON Schema 2020-12（契约默认草案）中 Hook 校验常用的关键字；
+Schema 中含有不支持的关键字（if/then/else、prefixItems、contains、
+unevaluated* 等）时拒绝编译，该契约继续走解释执行路径。
+"""
+
+import hashlib
+import heapq
+import importlib.util
+import json
+import re
+from numbers import Number
+from pathlib import Path
+from typing import Any, Optional
+
+
+# 生成代码的格式或语义变化时递增，旧的编译结果随之失效
+COMPILER_VERSION = 1
+
+COMPILED_DIR = ".compiled"
+
+DRAFT_2020_12 = "https://json-schema.org/draft/2020-12/schema"
+DRAFT_2019_09 = "https://json-schema.org/draft/2019-09/schema"
+DRAFT_07 = "http://json-schema.org/draft-07/schema"
+
+# 不参与校验的注解关键字
+ANNOTATION_KEYWORDS = frozenset({
+    "$schema", "$id", "$anchor", "$comment", "$defs", "definitions", "$vocabulary",
+    "title", "description", "default", "examples", "deprecated", "readOnly", "writeOnly",
+    "format", "contentEncoding", "contentMediaType", "contentSchema",
+})
+
+# jsonschema 会执行、但编译器未实现的关键字（出现时拒绝编译）
+UNSUPPORTED_KEYWORDS = frozenset({
+    "prefixItems", "contains", "minContains", "maxContains", "if", "then", "else",
+    "dependentSchemas", "dependencies", "unevaluatedItems", "unevaluatedProperties",
+    "additionalItems", "$dynamicRef", "$dynamicAnchor", "$recursiveRef", "$recursiveAnchor",
+})
+
+TYPE_CHECKS = {
+    "string": "isinstance({x}, str)",
+    "object": "isinstance({x}, dict)",
+    "array": "isinstance({x}, list)",
+    "boolean": "isinstance({x}, bool)",
+    "null": "{x} is None",
+    "number": "_is_number({x})",
+    "integer": "_is_integer({x})",
+}
+
+# 生成模块的运行时辅助函数（与 jsonschema 的 equal / uniq / 类型判断语义一致）
+RUNTIME_PRELUDE = '''\
+import itertools
+import re
+from fractions import Fraction
+from numbers import Number
+
+
+def _is_number(x):
+    return not isinstance(x, bool) and isinstance(x, Number)
+
+
+def _is_integer(x):
+    if isinstance(x, bool):
+        return False
+    return isinstance(x, int) or (isinstance(x, float) and x.is_integer())
+
+
+_TRUE = object()
+_FALSE = object()
+
+
+def _unbool(x):
+    if x is True:
+        return _TRUE
+    if x is False:
+        return _FALSE
+    return x
+
+
+def _equal(one, two):
+    if one is two:
+        return True
+    if isinstance(one, str) or isinstance(two, str):
+        return one == two
+    if isinstance(one, (list, tuple)) and isinstance(two, (list, tuple)):
+        return len(one) == len(two) and all(_equal(a, b) for a, b in zip(one, two))
+    if isinstance(one, dict) and isinstance(two, dict):
+        return len(one) == len(two) and all(k in two and _equal(v, two[k]) for k, v in one.items())
+    return _unbool(one) == _unbool(two)
+
+
+def _uniq(container):
+    try:
+        ordered = sorted(_unbool(i) for i in container)
+        for a, b in zip(ordered, itertools.islice(ordered, 1, None)):
+            if _equal(a, b):
+                return False
+    except (NotImplementedError, TypeError):
+        seen = []
+        for e in container:
+            e = _unbool(e)
+            for s in seen:
+                if _equal(s, e):
+                    return False
+            seen.append(e)
+    return True
+
+
+def _not_multiple(x, d):
+    if isinstance(d, float):
+        try:
+            q = x / d
+            return int(q) != q
+        except OverflowError:
+            return (Fraction(x) / Fraction(d)).denominator != 1
+    return x % d
+
+
+def _extras_msg(extras):
+    return ", ".join(repr(e) for e in extras), ("was" if len(extras) == 1 else "were")
+
+
+def _valid(check, x):
+    errs = []
+    check(x, (), errs)
+    return not errs
+'''
+
+
+class SchemaCompileError(Exception):
+    """Schema 无法编译（含不支持的关键字或无效引用）"""
+
+
+def source_hash(schema: Any) -> str:
+    """Schema 内容哈希（键顺序影响错误顺序，因此不排序键）"""
+    payload = json.dumps(schema, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{COMPILER_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+def is_type(instance: Any, type_name: str) -> bool:
+    """Draft 2020-12 类型判断（与生成模块的 TYPE_CHECKS 一致）"""
+    if type_name == "string":
+        return isinstance(instance, str)
+    if type_name == "object":
+        return isinstance(instance, dict)
+    if type_name == "array":
+        return isinstance(instance, list)
+    if type_name == "boolean":
+        return isinstance(instance, bool)
+    if type_name == "null":
+        return instance is None
+    if isinstance(instance, bool):
+        return False
+    if type_name == "number":
+        return isinstance(instance, Number)
+    if type_name == "integer":
+        return isinstance(instance, int) or (isinstance(instance, float) and instance.is_integer())
+    return False
+
+
+def _describe(text: str) -> str:
+    """生成 "repr(实例) + 固定文本" 形式的错误消息表达式"""
+    return "repr(x) + " + repr(text)
+
+
+class _SchemaCompiler:
+    """把一个 Schema 生成为校验函数集合（每个子 Schema 一个函数）"""
+
+    def __init__(self, root: Any):
+        self.root = root
+        self.functions: dict[Any, str] = {}
+        self.pending: list[tuple[str, Any]] = []
+        self.constants: list[str] = []
+        self.lines: list[str] = []
+        self.draft = DRAFT_2020_12
+        if isinstance(root, dict) and "$schema" in root:
+            self.draft = str(root["$schema"]).rstrip("#")
+            if self.draft not in (DRAFT_2020_12, DRAFT_2019_09, DRAFT_07):
+                raise SchemaCompileError(f"不支持的 $schema: {root['$schema']}")
+
+    def constant(self, value: Any) -> str:
+        """登记模块级常量，返回常量名"""
+        name = f"_C{len(self.constants)}"
+        self.constants.append(f"{name} = {value!r}")
+        return name
+
+    def regex(self, pattern: str) -> str:
+        """登记预编译正则，返回常量名"""
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise SchemaCompileError(f"无效的正则 {pattern!r}: {e}") from e
+        name = f"_C{len(self.constants)}"
+        self.constants.append(f"{name} = re.compile({pattern!r})")
+        return name
+
+    def function_for(self, node: Any) -> str:
+        """子 Schema 对应的函数名（同一对象只生成一次，支持 $ref 递归）"""
+        key = ("bool", node) if isinstance(node, bool) else id(node)
+        if key not in self.functions:
+            if not isinstance(node, (dict, bool)):
+                raise SchemaCompileError(f"无效的子 Schema: {node!r}")
+            self.functions[key] = f"_s{len(self.functions)}"
+            self.pending.append((self.functions[key], node))
+        return self.functions[key]
+
+    def resolve_ref(self, ref: Any) -> Any:
+        """解析本文档内的 $ref（#、#/$defs/...、#/definitions/...）"""
+        if not isinstance(ref, str) or not ref.startswith("#"):
+            raise SchemaCompileError(f"只支持文档内引用: {ref!r}")
+        node = self.root
+        for part in ref[1:].lstrip("/").split("/") if ref not in ("#", "#/") else []:
+            part = part.replace("~1", "/").replace("~0", "~")
+            try:
+                node = node[int(part)] if isinstance(node, list) else node[part]
+            except (KeyError, IndexError, ValueError, TypeError) as e:
+                raise SchemaCompileError(f"无法解析引用: {ref}") from e
+        return node
+
+    def compile(self, name: str, digest: str) -> str:
+        """生成模块源码"""
+        entry = self.function_for(self.root)
+        while self.pending:
+            self.emit_function(*self.pending.pop(0))
+
+        header = [
+            f'"""契约 {name} 的编译校验器（由 contract-validator.py --compile 生成，请勿手工修改）"""',
+            "",
+            RUNTIME_PRELUDE,
+            f"SOURCE_HASH = {digest!r}",
+            f"COMPILER_VERSION = {COMPILER_VERSION}",
+            "",
+            *self.constants,
+            "",
+        ]
+        footer = [
+            "",
+            "def collect_errors(instance):",
+            "    errs = []",
+            f"    {entry}(instance, (), errs)",
+            "    return errs",
+            "",
+        ]
+        return "\n".join(header + self.lines + footer)
+
+    def emit_function(self, name: str, node: Any) -> None:
+        """生成单个子 Schema 的校验函数: f(x, p, errs)，错误追加到 errs"""
+        body: list[str] = []
+        if node is False:
+            body.append("errs.append((p, None, 'False schema does not allow ' + repr(x), 'None', x, None, None))")
+        elif isinstance(node, dict):
+            for keyword, value in node.items():
+                if keyword in UNSUPPORTED_KEYWORDS:
+                    raise SchemaCompileError(f"不支持的关键字: {keyword}")
+                if keyword in ANNOTATION_KEYWORDS:
+                    continue
+                emitter = getattr(self, f"kw_{keyword.lstrip('$')}", None)
+                if emitter is None:
+                    # jsonschema 同样忽略未知关键字
+                    continue
+                if keyword in ("$ref", "dependentRequired") and self.draft == DRAFT_07:
+                    raise SchemaCompileError(f"draft-07 中 {keyword} 的语义不同，不编译")
+                emitter(node, value, body)
+
+        self.lines.append(f"def {name}(x, p, errs):")
+        self.lines.extend(f"    {line}" for line in body or ["pass"])
+        self.lines.append("")
+        self.lines.append("")
+
+    def error(self, node: dict, keyword: str, message: str, context: str = "None") -> str:
+        """生成一条错误追加语句（expected / 类型在编译时确定）"""
+        expected = repr(str(node.get("type", keyword)))
+        types = repr(node.get("type"))
+        return f"errs.append((p, {keyword!r}, {message}, {expected}, x, {types}, {context}))"
+
+    # ---- 关键字 ----
+
+    def kw_type(self, node, value, body):
+        types = [value] if isinstance(value, str) else list(value)
+        for t in types:
+            if t not in TYPE_CHECKS:
+                raise SchemaCompileError(f"未知类型: {t!r}")
+        condition = " or ".join(TYPE_CHECKS[t].format(x="x") for t in types)
+        reprs = ", ".join(repr(t) for t in types)
+        body.append(f"if not ({condition}):")
+        body.append(f"    {self.error(node, 'type', _describe(' is not of type ' + reprs))}")
+
+    def kw_properties(self, node, value, body):
+        if not value:
+            return
+        body.append("if isinstance(x, dict):")
+        for prop, subschema in value.items():
+            body.append(f"    if {prop!r} in x:")
+            body.append(f"        {self.function_for(subschema)}(x[{prop!r}], p + ({prop!r},), errs)")
+
+    def kw_patternProperties(self, node, value, body):
+        if not value:
+            return
+        body.append("if isinstance(x, dict):")
+        for pattern, subschema in value.items():
+            regex = self.regex(pattern)
+            body.append("    for k, v in x.items():")
+            body.append(f"        if {regex}.search(k):")
+            body.append(f"            {self.function_for(subschema)}(v, p + (k,), errs)")
+
+    def kw_additionalProperties(self, node, value, body):
+        if value is True or (isinstance(value, dict) and not value):
+            return
+        known = self.constant(frozenset(node.get("properties", {})))
+        patterns = node.get("patternProperties", {})
+        condition = f"k not in {known}"
+        if patterns:
+            condition += f" and not {self.regex('|'.join(patterns))}.search(k)"
+        body.append("if isinstance(x, dict):")
+        body.append(f"    extras = [k for k in x if {condition}]")
+        if isinstance(value, dict):
+            check = self.function_for(value)
+            body.append("    for k in extras:")
+            body.append(f"        {check}(x[k], p + (k,), errs)")
+            return
+        body.append("    if extras:")
+        if patterns:
+            regexes = ", ".join(repr(each) for each in sorted(patterns))
+            message = (f"', '.join(repr(e) for e in sorted(extras)) + "
+                       f"(' does' if len(extras) == 1 else ' do') + {' not match any of the regexes: ' + regexes!r}")
+        else:
+            message = "'Additional properties are not allowed (%s %s unexpected)' % _extras_msg(sorted(extras, key=str))"
+        body.append(f"        {self.error(node, 'additionalProperties', message)}")
+
+    def kw_required(self, node, value, body):
+        if not value:
+            return
+        body.append("if isinstance(x, dict):")
+        body.append(f"    for k in {self.constant(list(value))}:")
+        body.append("        if k not in x:")
+        body.append(f"            {self.error(node, 'required', 'repr(k) + ' + repr(' is a required property'))}")
+
+    def kw_items(self, node, value, body):
+        if isinstance(value, list):
+            raise SchemaCompileError("不支持数组形式的 items（请使用 prefixItems 语义的解释执行路径）")
+        if value is True:
+            return
+        body.append("if isinstance(x, list) and x:")
+        if value is False:
+            message = ("'Expected at most 0 items but found ' + str(len(x)) + ' extra: ' "
+                       "+ repr(x if len(x) != 1 else x[0])")
+            body.append(f"    {self.error(node, 'items', message)}")
+            return
+        body.append("    for i, v in enumerate(x):")
+        body.append(f"        {self.function_for(value)}(v, p + (i,), errs)")
+
+    def kw_enum(self, node, value, body):
+        enums = self.constant(value)
+        body.append(f"if all(not _equal(e, x) for e in {enums}):")
+        body.append(f"    {self.error(node, 'enum', _describe(' is not one of ' + repr(value)))}")
+
+    def kw_const(self, node, value, body):
+        body.append(f"if not _equal(x, {self.constant(value)}):")
+        body.append(f"    {self.error(node, 'const', repr(repr(value) + ' was expected'))}")
+
+    def _length(self, node, keyword, value, body, guard, too_small):
+        if too_small:
+            suffix = " should be non-empty" if value == 1 else (
+                " does not have enough properties" if keyword == "minProperties" else " is too short")
+            operator = "<"
+        else:
+            suffix = " is expected to be empty" if value == 0 else (
+                " has too many properties" if keyword == "maxProperties" else " is too long")
+            operator = ">"
+        body.append(f"if {guard} and len(x) {operator} {value!r}:")
+        body.append(f"    {self.error(node, keyword, _describe(suffix))}")
+
+    def kw_minLength(self, node, value, body):
+        self._length(node, "minLength", value, body, "isinstance(x, str)", True)
+
+    def kw_maxLength(self, node, value, body):
+        self._length(node, "maxLength", value, body, "isinstance(x, str)", False)
+
+    def kw_minItems(self, node, value, body):
+        self._length(node, "minItems", value, body, "isinstance(x, list)", True)
+
+    def kw_maxItems(self, node, value, body):
+        self._length(node, "maxItems", value, body, "isinstance(x, list)", False)
+
+    def kw_minProperties(self, node, value, body):
+        self._length(node, "minProperties", value, body, "isinstance(x, dict)", True)
+
+    def kw_maxProperties(self, node, value, body):
+        self._length(node, "maxProperties", value, body, "isinstance(x, dict)", False)
+
+    def kw_pattern(self, node, value, body):
+        regex = self.regex(value)
+        body.append(f"if isinstance(x, str) and not {regex}.search(x):")
+        body.append(f"    {self.error(node, 'pattern', _describe(' does not match ' + repr(value)))}")
+
+    def _bound(self, node, keyword, value, body, operator, text):
+        body.append(f"if _is_number(x) and x {operator} {value!r}:")
+        body.append(f"    {self.error(node, keyword, _describe(text + repr(value)))}")
+
+    def kw_minimum(self, node, value, body):
+        self._bound(node, "minimum", value, body, "<", " is less than the minimum of ")
+
+    def kw_maximum(self, node, value, body):
+        self._bound(node, "maximum", value, body, ">", " is greater than the maximum of ")
+
+    def kw_exclusiveMinimum(self, node, value, body):
+        if isinstance(value, bool):
+            raise SchemaCompileError("不支持布尔形式的 exclusiveMinimum（draft-04）")
+        self._bound(node, "exclusiveMinimum", value, body, "<=", " is less than or equal to the minimum of ")
+
+    def kw_exclusiveMaximum(self, node, value, body):
+        if isinstance(value, bool):
+            raise SchemaCompileError("不支持布尔形式的 exclusiveMaximum（draft-04）")
+        self._bound(node, "exclusiveMaximum", value, body, ">=", " is greater than or equal to the maximum of ")
+
+    def kw_multipleOf(self, node, value, body):
+        body.append(f"if _is_number(x) and _not_multiple(x, {value!r}):")
+        body.append(f"    {self.error(node, 'multipleOf', _describe(' is not a multiple of ' + str(value)))}")
+
+    def kw_uniqueItems(self, node, value, body):
+        if not value:
+            return
+        body.append("if isinstance(x, list) and not _uniq(x):")
+        body.append(f"    {self.error(node, 'uniqueItems', _describe(' has non-unique elements'))}")
+
+    def kw_dependentRequired(self, node, value, body):
+        body.append("if isinstance(x, dict):")
+        body.append(f"    for prop, deps in {self.constant({k: list(v) for k, v in value.items()})}.items():")
+        body.append("        if prop in x:")
+        body.append("            for k in deps:")
+        body.append("                if k not in x:")
+        body.append(f"                    {self.error(node, 'dependentRequired', 'repr(k) + ' + repr(' is a dependency of ') + ' + repr(prop)')}")
+
+    def kw_propertyNames(self, node, value, body):
+        body.append("if isinstance(x, dict):")
+        body.append("    for k in x:")
+        body.append(f"        {self.function_for(value)}(k, p, errs)")
+
+    def kw_allOf(self, node, value, body):
+        for subschema in value:
+            body.append(f"{self.function_for(subschema)}(x, p, errs)")
+
+    def kw_anyOf(self, node, value, body):
+        checks = ", ".join(self.function_for(subschema) for subschema in value)
+        body.append("ctx = []")
+        body.append(f"for check in ({checks},):")
+        body.append("    sub = []")
+        body.append("    check(x, (), sub)")
+        body.append("    if not sub:")
+        body.append("        break")
+        body.append("    ctx.extend(sub)")
+        body.append("else:")
+        body.append(f"    {self.error(node, 'anyOf', _describe(' is not valid under any of the given schemas'), 'ctx')}")
+
+    def kw_oneOf(self, node, value, body):
+        checks = ", ".join(self.function_for(subschema) for subschema in value)
+        reprs = self.constant([repr(subschema) for subschema in value])
+        body.append("ctx = []")
+        body.append("first = None")
+        body.append(f"checks = ({checks},)")
+        body.append("for i, check in enumerate(checks):")
+        body.append("    sub = []")
+        body.append("    check(x, (), sub)")
+        body.append("    if not sub:")
+        body.append("        first = i")
+        body.append("        break")
+        body.append("    ctx.extend(sub)")
+        body.append("else:")
+        body.append(f"    {self.error(node, 'oneOf', _describe(' is not valid under any of the given schemas'), 'ctx')}")
+        body.append("if first is not None:")
+        body.append("    more = [i for i in range(first + 1, len(checks)) if _valid(checks[i], x)]")
+        body.append("    if more:")
+        body.append("        more.append(first)")
+        message = f"repr(x) + ' is valid under each of ' + ', '.join({reprs}[i] for i in more)"
+        body.append(f"        {self.error(node, 'oneOf', message)}")
+
+    def kw_not(self, node, value, body):
+        body.append(f"if _valid({self.function_for(value)}, x):")
+        body.append(f"    {self.error(node, 'not', _describe(' should not be valid under ' + repr(value)))}")
+
+    def kw_ref(self, node, value, body):
+        body.append(f"{self.function_for(self.resolve_ref(value))}(x, p, errs)")
+
+
+def compile_schema(schema: Any, name: str) -> str:
+    """
+    把 Schema 编译为校验模块源码
+
+    Raises:
+        SchemaCompileError: Schema 含不支持的关键字或无效引用
+    """
+    return _SchemaCompiler(schema).compile(name, source_hash(schema))
+
+
+def load_compiled(path: Path, schema: Any) -> Optional[Any]:
+    """
+    加载编译模块，SOURCE_HASH 与当前 Schema 不一致时返回 None
+
+    使用 importlib 加载（字节码缓存在 .compiled/__pycache__/）
+    """
+    module_name = "wf_compiled_" + re.sub(r"\W", "_", path.stem)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    if spec is None or spec.loader is None:
+        return None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if getattr(module, "SOURCE_HASH", None) != source_hash(schema):
+        return None
+    return module
+
+
+# ---- 错误选择（移植自 jsonschema.exceptions.best_match / relevance） ----
+
+WEAK_MATCHES = frozenset({"anyOf", "oneOf"})
+
+
+def _matches_type(error: tuple) -> bool:
+    """错误实例是否符合所在子 Schema 声明的类型"""
+    instance, types = error[4], error[5]
+    if types is None:
+        return False
+    if isinstance(types, str):
+        return is_type(instance, types)
+    return any(is_type(instance, t) for t in types)
+
+
+def _relevance(error: tuple) -> tuple:
+    path, keyword = error[0], error[1]
+    return (-len(path), path, keyword not in WEAK_MATCHES, False, not _matches_type(error))
+
+
+def _detail(error: tuple, absolute_path: tuple) -> dict:
+    return {
+        "field": ".".join(str(p) for p in absolute_path) or "(root)",
+        "expected": error[3],
+        "actual": str(type(error[4]).__name__),
+        "message": error[2],
+    }
+
+
+def error_details(errors: list) -> list[dict]:
+    """
+    从 collect_errors() 的结果中选出最相关的错误（含 context 子错误），
+    生成与解释执行路径一致的错误详情
+
+    原始错误: (path, keyword, message, expected, instance, types, context)，
+    path 为相对于所在 anyOf/oneOf 实例（顶层为根）的路径
+    """
+    if not errors:
+        return []
+    best = max(errors, key=_relevance)
+    absolute_path = best[0]
+    while best[6]:
+        smallest = heapq.nsmallest(2, best[6], key=_relevance)
+        if len(smallest) == 2 and _relevance(smallest[0]) == _relevance(smallest[1]):
+            break
+        best = smallest[0]
+        absolute_path = absolute_path + best[0]
+
+    details = [_detail(best, absolute_path)]
+    for suberror in best[6] or ():
+        details.append(_detail(suberror, absolute_path + suberror[0]))
+    return details
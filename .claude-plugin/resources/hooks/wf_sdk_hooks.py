@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+wf_sdk_hooks.py - Python Agent SDK 进程内 Hook 适配
+
+用 Python Agent SDK 驱动工作流时，Hook 可以直接注册为 Python 回调。本模块把
+wf-hook.py 的处理流程（状态治理 + 契约校验）包装为 SDK 兼容的异步回调，
+所有事件共用同一个内存中的 WorkflowState 和 ContractValidator（契约按修改时间缓存），
+每个事件不再启动子进程、不再重新加载状态文件和契约。
+
+用法:
+    from claude_agent_sdk import ClaudeAgentOptions
+    from wf_sdk_hooks import WorkflowHooks
+
+    hooks = WorkflowHooks(
+        workflow="code-review",
+        input_contract="review-input",
+        output_contract="review-report",
+        node_contracts={"analyzer": "analysis-result"},
+    )
+    options = ClaudeAgentOptions(hooks=hooks.matchers())
+
+未安装 claude_agent_sdk 时 matchers() 返回等价的 {"matcher", "hooks"} 字典。
+
+Hook 已在进程内处理时，项目 settings.json / Command 中注册的命令行 Hook 不应重复处理：
+给 SDK 启动的 CLI 设置环境变量 WF_HOOKS_IN_PROCESS=1（HOOKS_IN_PROCESS_ENV），
+命令行 Hook 脚本会在快速路径中直接返回。
+
+本地测试（不依赖 SDK，按 SDK 的匹配规则把事件依次交给回调）:
+    python wf_sdk_hooks.py drive events.jsonl --workflow code-review --input-contract review-input
+    cat events.jsonl | python wf_sdk_hooks.py drive - --workflow code-review
+
+events.jsonl 每行一个 Hook 负载（与 stdin 传给 Hook 脚本的 JSON 相同）。
+
+离线示例（examples/ 下的最小项目和事件，项目复制到临时目录后运行）:
+    cd examples && tmp=$(mktemp -d) && cp -r project/.claude "$tmp"/
+    python ../wf_sdk_hooks.py drive sdk-events.jsonl --project-dir "$tmp" --workflow code-review \\
+        --input-contract review-input --output-contract review-report \\
+        --node-contract analyzer=analysis-result
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+HOOKS_DIR = Path(__file__).parent
+
+# 确保可以从任意工作目录导入同目录下的模块
+sys.path.insert(0, str(HOOKS_DIR))
+from wf_metrics import get_metrics
+from wf_profile import reset_profiler
+from wf_trace import record_span
+
+try:
+    from claude_agent_sdk import HookMatcher
+except ImportError:
+    HookMatcher = None
+
+
+def _load_wf_hook():
+    """导入 wf-hook.py（文件名含连字符，不能直接 import）"""
+    spec = importlib.util.spec_from_file_location("wf_hook", HOOKS_DIR / "wf-hook.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+wf_hook = _load_wf_hook()
+
+# 传给 SDK 启动的 CLI 的环境变量，使命令行 Hook 跳过处理
+HOOKS_IN_PROCESS_ENV = {"WF_HOOKS_IN_PROCESS": "1"}
+
+# Hook 模块通过 CLAUDE_PROJECT_DIR 定位 .context / 契约目录；同一进程中有多个项目目录
+# （如 wf-batch.py 并发运行）时，处理事件期间独占并切换该环境变量
+_PROJECT_ENV_LOCK = threading.Lock()
+
+# 各事件的工具匹配（None 表示不限工具）
+EVENT_MATCHERS = {
+    "UserPromptSubmit": None,
+    "PreToolUse": "Task",
+    "PostToolUse": "Task",
+    "SubagentStop": None,
+    "Stop": None,
+}
+
+
+def to_sdk_output(hook_event: str, result: Optional[dict], blocking: Any) -> dict:
+    """
+    把合并后的 Hook 结果转换为 SDK 回调的返回值
+
+    命令行 Hook 用 exit(2) 阻止的事件，在 SDK 中改用等价的 JSON 字段表达。
+    """
+    if blocking is None:
+        return result or {}
+    if hook_event == "PreToolUse":
+        return {
+            "hookSpecificOutput": {
+                "hookEventName": "PreToolUse",
+                "permissionDecision": "deny",
+                "permissionDecisionReason": blocking.message,
+            },
+        }
+    return {"decision": "block", "reason": blocking.message}
+
+
+class WorkflowHooks:
+    """工作流 Hook 的 SDK 回调集合（同一实例内共享状态与契约缓存）"""
+
+    def __init__(
+        self,
+        workflow: Optional[str] = None,
+        input_contract: Optional[str] = None,
+        output_contract: Optional[str] = None,
+        node_contracts: Optional[dict[str, str]] = None,
+        state_argv: Optional[list[str]] = None,
+        project_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            workflow: 工作流名称（用于命令匹配）
+            input_contract: 工作流输入契约（UserPromptSubmit）
+            output_contract: 工作流输出契约（Stop）
+            node_contracts: {节点名: 输出契约}（SubagentStop，按 agent_type 匹配）
+            state_argv: wf-state 的附加参数，如 ["--cache", "--resume"]
+            project_dir: 项目目录（默认 CLAUDE_PROJECT_DIR 或当前目录）
+        """
+        self.project_dir = str(project_dir) if project_dir else None
+        self.workflow = workflow
+        self.input_contract = input_contract
+        self.output_contract = output_contract
+        self.node_contracts = node_contracts or {}
+        self.state_argv = state_argv or []
+        self._parser = wf_hook.build_parser()
+        with self._project_env():
+            self.state_manager = wf_hook.wf_state.WorkflowState(wf_hook.wf_state.find_state_file())
+            contract_validator = wf_hook.get_contract_validator()
+            self.validator = contract_validator.ContractValidator(contract_validator.find_contracts_dir())
+        self._lock: Optional[asyncio.Lock] = None
+
+    @contextmanager
+    def _project_env(self) -> Iterator[None]:
+        """在本实例的项目目录下执行（未指定项目目录时不切换）"""
+        if not self.project_dir:
+            yield
+            return
+        with _PROJECT_ENV_LOCK:
+            previous = os.environ.get("CLAUDE_PROJECT_DIR")
+            os.environ["CLAUDE_PROJECT_DIR"] = self.project_dir
+            try:
+                yield
+            finally:
+                if previous is None:
+                    os.environ.pop("CLAUDE_PROJECT_DIR", None)
+                else:
+                    os.environ["CLAUDE_PROJECT_DIR"] = previous
+
+    def _args_for(self, input_data: dict) -> argparse.Namespace:
+        """按事件组装与命令行注册等价的参数"""
+        hook_event = input_data.get("hook_event_name", "")
+        argv = list(self.state_argv)
+        if self.workflow:
+            argv += ["--workflow", self.workflow]
+
+        contract = None
+        if hook_event == "UserPromptSubmit":
+            contract = self.input_contract
+        elif hook_event == "Stop":
+            contract = self.output_contract
+        elif hook_event == "SubagentStop":
+            node_name = input_data.get("agent_type")
+            contract = self.node_contracts.get(node_name)
+            if contract:
+                argv += ["--node", node_name]
+        if contract:
+            argv += ["--contract", contract]
+        return self._parser.parse_args(argv)
+
+    def handle(self, input_data: dict) -> dict:
+        """同步处理一次 Hook 事件，返回 SDK 回调的返回值"""
+        hook_event = input_data.get("hook_event_name", "")
+        started = time.perf_counter()
+        started_ts = time.time()
+
+        with self._project_env():
+            args = self._args_for(input_data)
+            # 每个事件单独剖析（进程级剖析器的计时起点和阶段不跨事件累积）
+            profiler = reset_profiler("wf-sdk", args.profile)
+            # 相对的 WF_METRICS_FILE / --metrics-file 按本实例的项目目录解析
+            metrics = get_metrics(args.metrics_file)
+            with profiler.phase(f"handle:{hook_event or 'unknown'}"):
+                result, blocking = wf_hook.process_event(
+                    input_data, args, self.state_manager, self.validator
+                )
+
+            duration = time.perf_counter() - started
+            metrics.observe(
+                "wf_hook_duration_seconds", duration, {"script": "wf-sdk", "event": hook_event or "unknown"}
+            )
+            metrics.flush()
+            record_span(
+                hook_event or "unknown", "hook", started_ts, started_ts + duration,
+                script="wf-sdk", tool=input_data.get("tool_name") or None,
+                tool_use_id=input_data.get("tool_use_id"),
+            )
+            profiler.finish(hook_event)
+        return to_sdk_output(hook_event, result, blocking)
+
+    async def on_event(self, input_data: dict, tool_use_id: Optional[str], context: Any) -> dict:  # noqa: ARG002
+        """
+        SDK Hook 回调（签名与 HookCallback 一致）
+
+        事件串行处理：状态在内存中共享，并行的 Task 调用不能交错修改；
+        文件读写放到线程中执行，不阻塞事件循环。
+        """
+        if tool_use_id and not input_data.get("tool_use_id"):
+            input_data = {**input_data, "tool_use_id": tool_use_id}
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await asyncio.to_thread(self.handle, input_data)
+
+    def matchers(self) -> dict[str, list]:
+        """生成 ClaudeAgentOptions(hooks=...) 所需的配置"""
+        hooks: dict[str, list] = {}
+        for hook_event, matcher in EVENT_MATCHERS.items():
+            if HookMatcher is not None:
+                hooks[hook_event] = [HookMatcher(matcher=matcher, hooks=[self.on_event])]
+            else:
+                hooks[hook_event] = [{"matcher": matcher, "hooks": [self.on_event]}]
+        return hooks
+
+
+class FakeSDKDriver:
+    """本地模拟 SDK 的 Hook 调度：按事件名和工具匹配调用已注册的回调"""
+
+    def __init__(self, hooks: dict[str, list]):
+        self.hooks = hooks
+
+    @staticmethod
+    def _parts(entry: Any) -> tuple[Optional[str], list]:
+        if isinstance(entry, dict):
+            return entry.get("matcher"), entry.get("hooks", [])
+        return entry.matcher, entry.hooks
+
+    async def dispatch(self, input_data: dict) -> list[dict]:
+        """把一个事件交给所有匹配的回调，返回各回调的返回值"""
+        hook_event = input_data.get("hook_event_name", "")
+        tool_name = input_data.get("tool_name", "")
+        outputs = []
+        for entry in self.hooks.get(hook_event, []):
+            matcher, callbacks = self._parts(entry)
+            if matcher and matcher != "*" and not re.fullmatch(matcher, tool_name or ""):
+                continue
+            for callback in callbacks:
+                outputs.append(await callback(input_data, input_data.get("tool_use_id"), {"signal": None}))
+        return outputs
+
+
+async def drive(source, hooks: WorkflowHooks) -> int:
+    """逐行读取事件并派发，输出每个事件的回调结果与耗时"""
+    driver = FakeSDKDriver(hooks.matchers())
+    latencies = []
+    for line in source:
+        line = line.strip()
+        if not line:
+            continue
+        input_data = json.loads(line)
+        started = time.perf_counter()
+        outputs = await driver.dispatch(input_data)
+        latency_ms = (time.perf_counter() - started) * 1000
+        latencies.append(latency_ms)
+        print(json.dumps({
+            "event": input_data.get("hook_event_name"),
+            "tool_name": input_data.get("tool_name"),
+            "latency_ms": round(latency_ms, 2),
+            "outputs": outputs,
+        }, ensure_ascii=False))
+
+    if latencies:
+        print(f"共 {len(latencies)} 个事件，平均 {sum(latencies) / len(latencies):.2f}ms/事件", file=sys.stderr)
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Python Agent SDK 进程内 Hook 适配")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    drive_parser = subparsers.add_parser("drive", help="用本地模拟的 SDK 调度器依次派发事件")
+    drive_parser.add_argument("source", help="事件文件（JSONL，每行一个 Hook 负载；- 表示标准输入）")
+    drive_parser.add_argument("--workflow", type=str, help="工作流名称（用于命令匹配）")
+    drive_parser.add_argument("--input-contract", type=str, help="工作流输入契约")
+    drive_parser.add_argument("--output-contract", type=str, help="工作流输出契约")
+    drive_parser.add_argument(
+        "--node-contract",
+        action="append",
+        default=[],
+        metavar="NODE=CONTRACT",
+        help="节点输出契约（可重复指定）",
+    )
+    drive_parser.add_argument("--project-dir", type=str, help="项目目录（默认 CLAUDE_PROJECT_DIR）")
+    drive_parser.add_argument(
+        "--state-arg",
+        action="append",
+        default=[],
+        metavar="ARG",
+        help="传给 wf-state 的参数（可重复指定，如 --state-arg=--cache）",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    hooks = WorkflowHooks(
+        workflow=args.workflow,
+        input_contract=args.input_contract,
+        output_contract=args.output_contract,
+        node_contracts=dict(item.split("=", 1) for item in args.node_contract),
+        state_argv=args.state_arg,
+        project_dir=args.project_dir,
+    )
+    if args.source == "-":
+        sys.exit(asyncio.run(drive(sys.stdin, hooks)))
+    with open(args.source, encoding="utf-8") as source:
+        sys.exit(asyncio.run(drive(source, hooks)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+wf_skeleton.py - 由契约 Schema 生成节点输出骨架
+
+契约校验在 SubagentStop 时才执行，节点此时已经完成全部工作，每次校验失败都要
+付出一次完整重试的代价。contract-validator.py --inject-skeleton 在 PreToolUse (Task)
+时把节点输出契约的骨架和关键约束追加到 Task prompt 中，让子 Agent 一开始就按契约组织输出:
+
+    [contract-validator] 输出契约 analysis-result：最终回复须包含一个符合以下结构的 ```json 代码块
+    {"summary": "<string>", "issues": [{"file": "<string>", "severity": "info|warning|error", ...}]}
+    关键约束:
+    - 必需字段: summary, issues; issues[]: file, severity, message
+    - summary: 长度 >= 20
+    - issues[].severity: 取值 info | warning | error
+
+骨架保持紧凑：嵌套深度、每层字段数、约束条数都有上限，可选字段以 "?" 结尾。
+只解析本地 $ref（#/...），anyOf / oneOf 取第一个分支并在约束中注明。
+生成结果按 Schema 哈希缓存在 .context/cache/skeletons/。
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+
+SKELETON_VERSION = 1
+
+# 骨架嵌套深度（更深的值以 "..." 代替）
+MAX_DEPTH = 4
+# 每个对象最多展示的字段数
+MAX_PROPERTIES = 12
+# 最多列出的约束条数
+MAX_CONSTRAINTS = 20
+# 单条约束中枚举值的展示个数
+MAX_ENUM_VALUES = 8
+
+_BOUND_LABELS = (
+    ("minLength", "长度 >= {}"),
+    ("maxLength", "长度 <= {}"),
+    ("minimum", ">= {}"),
+    ("maximum", "<= {}"),
+    ("exclusiveMinimum", "> {}"),
+    ("exclusiveMaximum", "< {}"),
+    ("multipleOf", "{} 的倍数"),
+    ("minItems", "至少 {} 项"),
+    ("maxItems", "最多 {} 项"),
+    ("pattern", "匹配 /{}/"),
+    ("format", "格式 {}"),
+)
+
+
+def skeleton_hash(schema: Any) -> str:
+    """骨架缓存键（Schema 内容 + 生成器版本）"""
+    payload = json.dumps(schema, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(f"{SKELETON_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+class _SkeletonBuilder:
+    """单个 Schema 的骨架生成（记录约束和涉及的字段路径）"""
+
+    def __init__(self, root: Any):
+        self.root = root
+        self.constraints: list[str] = []
+        self.required: list[str] = []
+        self.fields: set[str] = set()
+
+    def resolve(self, schema: Any, seen: tuple = ()) -> Any:
+        """解析本地 $ref（循环引用时停止）"""
+        while isinstance(schema, dict) and isinstance(schema.get("$ref"), str):
+            ref = schema["$ref"]
+            if not ref.startswith("#") or ref in seen:
+                return {}
+            seen = (*seen, ref)
+            target: Any = self.root
+            for part in ref[1:].split("/")[1:] if ref != "#" else []:
+                part = part.replace("~1", "/").replace("~0", "~")
+                target = target.get(part) if isinstance(target, dict) else None
+            schema = target if target is not None else {}
+        return schema if isinstance(schema, dict) else {}
+
+    def add_constraint(self, path: str, text: str) -> None:
+        if len(self.constraints) < MAX_CONSTRAINTS:
+            self.constraints.append(f"{path or '(root)'}: {text}")
+
+    def value(self, schema: Any, path: str, depth: int) -> str:
+        """生成 schema 对应的骨架文本（JSON 风格，取值以占位符表示）"""
+        schema = self.resolve(schema)
+        self.fields.add(path or "(root)")
+
+        for combinator in ("anyOf", "oneOf"):
+            branches = schema.get(combinator)
+            if isinstance(branches, list) and branches:
+                if len(branches) > 1:
+                    self.add_constraint(path, f"满足 {len(branches)} 种结构之一（骨架为第一种）")
+                merged = {k: v for k, v in schema.items() if k != combinator}
+                merged.update(self.resolve(branches[0]))
+                schema = merged
+                break
+
+        if "const" in schema:
+            return json.dumps(schema["const"], ensure_ascii=False)
+        enum = schema.get("enum")
+        if isinstance(enum, list) and enum:
+            shown = [str(v) if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+                     for v in enum[:MAX_ENUM_VALUES]]
+            more = " | ..." if len(enum) > MAX_ENUM_VALUES else ""
+            self.add_constraint(path, "取值 " + " | ".join(shown) + more)
+            if all(isinstance(v, str) for v in enum):
+                return json.dumps("|".join(enum[:MAX_ENUM_VALUES]), ensure_ascii=False)
+            return json.dumps(enum[0], ensure_ascii=False)
+
+        bounds = [label.format(schema[key]) for key, label in _BOUND_LABELS if key in schema]
+        if bounds:
+            self.add_constraint(path, ", ".join(bounds))
+
+        type_name = schema.get("type")
+        if isinstance(type_name, list):
+            type_name = next((t for t in type_name if t != "null"), type_name[0] if type_name else None)
+        if type_name is None:
+            if "properties" in schema:
+                type_name = "object"
+            elif "items" in schema:
+                type_name = "array"
+
+        if type_name == "object":
+            return self.object_value(schema, path, depth)
+        if type_name == "array":
+            if depth >= MAX_DEPTH:
+                return "[...]"
+            items = schema.get("items")
+            if not isinstance(items, dict):
+                return "[]"
+            return "[" + self.value(items, f"{path}[]", depth + 1) + ", ...]"
+        if type_name in ("string", "number", "integer", "boolean", "null"):
+            return f'"<{type_name}>"' if type_name == "string" else f"<{type_name}>"
+        return "<any>"
+
+    def object_value(self, schema: dict, path: str, depth: int) -> str:
+        properties = schema.get("properties") or {}
+        if not isinstance(properties, dict):
+            properties = {}
+        required = [name for name in schema.get("required") or [] if isinstance(name, str)]
+        if required:
+            self.required.append(f"{path}: {', '.join(required)}" if path else ", ".join(required))
+        if schema.get("additionalProperties") is False:
+            self.add_constraint(path, "不允许契约以外的字段")
+        if depth >= MAX_DEPTH:
+            return "{...}"
+
+        # 必需字段在前，可选字段以 ? 结尾
+        names = required + [name for name in properties if name not in required]
+        parts = []
+        for name in names[:MAX_PROPERTIES]:
+            child_path = f"{path}.{name}" if path else name
+            key = name if name in required else f"{name}?"
+            parts.append(
+                json.dumps(key, ensure_ascii=False) + ": "
+                + self.value(properties.get(name, {}), child_path, depth + 1)
+            )
+        if len(names) > MAX_PROPERTIES or (not names and schema.get("additionalProperties") is not False):
+            parts.append("...")
+        return "{" + ", ".join(parts) + "}"
+
+
+def build_skeleton(schema: Any) -> dict:
+    """
+    生成输出骨架
+
+    Returns:
+        {"skeleton": 骨架文本, "required": [...], "constraints": [...],
+         "fields": [涉及的字段路径，数组元素以 [] 表示]}
+    """
+    builder = _SkeletonBuilder(schema)
+    skeleton = builder.value(schema, "", 0)
+    return {
+        "skeleton": skeleton,
+        "required": builder.required,
+        "constraints": builder.constraints,
+        "fields": sorted(builder.fields),
+    }
+
+
+def render_skeleton(contract_name: str, skeleton: dict) -> str:
+    """渲染注入 Task prompt 的文本"""
+    lines = [
+        f"[contract-validator] 输出契约 {contract_name}：最终回复须包含一个符合以下结构的 ```json 代码块"
+        "（\"?\" 结尾的字段可省略，<type> 为占位符）",
+        skeleton["skeleton"],
+    ]
+    if skeleton["required"] or skeleton["constraints"]:
+        lines.append("关键约束:")
+        if skeleton["required"]:
+            lines.append("- 必需字段: " + "; ".join(skeleton["required"]))
+        lines.extend(f"- {item}" for item in skeleton["constraints"])
+    return "\n".join(lines)
+
+
+def normalize_field(field: str) -> str:
+    """把校验错误中的字段路径（issues.0.severity）转为骨架路径（issues[].severity）"""
+    parts: list[str] = []
+    for part in (field or "").split("."):
+        if part.isdigit() or part == "*":
+            if parts:
+                parts[-1] += "[]"
+            else:
+                parts.append("[]")
+        elif part:
+            parts.append(part)
+    return ".".join(parts) or "(root)"
+
+
+def load_cached_skeleton(cache_dir: Path, schema: Any) -> Optional[dict]:
+    """读取缓存的骨架（不存在或损坏时返回 None）"""
+    try:
+        return json.loads((cache_dir / f"{skeleton_hash(schema)}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def store_skeleton(cache_dir: Path, schema: Any, skeleton: dict) -> None:
+    """写入骨架缓存（原子替换）"""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    target = cache_dir / f"{skeleton_hash(schema)}.json"
+    # 并行的 PreToolUse（扇出的 Task 调用）可能同时写入同一骨架，临时文件名须唯一
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(skeleton, ensure_ascii=False))
+        os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
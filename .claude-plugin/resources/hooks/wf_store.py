@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+wf_store.py - 内容寻址存储与节点结果缓存
+
+供 wf-state.py 使用：
+- BlobStore: 以 sha256 命名、gzip 压缩的 blob 存储，内容相同只存一份
+- OutputHistory: 节点每次调用的原始输出记录（只保存 blob 引用，重试与跨节点、
+  跨运行的相同输出不重复占用空间）
+- NodeCache: 以「节点类型 + prompt + 引用的输入文件内容 + 节点 Agent 定义与契约内容」的
+  哈希为键，缓存成功节点的输出，重复执行相同输入的节点时可直接复用
+- ValidationCache: 供 contract-validator.py 使用，以「数据 + 契约内容 + 校验器版本」
+  的哈希为键缓存契约校验结果，同一输出重复校验时跳过 Schema 校验和校验脚本
+- ContractRetries: SubagentStop / Stop 契约校验未通过的阻止次数，contract-validator.py
+  累计并在超过上限后放行，wf-state.py 据此把节点或工作流记为失败
+
+存储目录:
+    .context/blobs/{sha256[:2]}/{sha256}.gz      # 节点原始输出（所有运行共享）
+    .context/outputs/{node}.history.json          # [{attempt, ts, blob, size, json}]
+    .context/cache/
+    ├── blobs/{sha256[:2]}/{sha256}.gz            # 缓存的节点输出
+    ├── index.json                                # {key: {node, blob, size, created, last_used}}
+    ├── index.lock
+    ├── validations.json                          # {"entries": {key: {contract, errors, created, last_used, hits}}}
+    └── validations.lock
+    .context/contract-retries.json                # {"entries": {session|node|agent: {attempts, status, errors}}}
+    .context/contract-retries.lock
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不加锁
+    fcntl = None
+
+
+# 大文本分片编码的片段长度（字符），避免一次性生成完整的 bytes 副本
+TEXT_CHUNK_CHARS = 1024 * 1024
+
+# Agent frontmatter 中的契约声明
+_CONTRACT_FIELD_PATTERN = re.compile(r"^(?:input|output)_contract:\s*[\"']?([\w.-]+)", re.MULTILINE)
+# prompt 中疑似文件路径的片段（含扩展名），用于识别节点引用的输入文件
+_PATH_PATTERN = re.compile(r"(?<![\w/.-])((?:\.{1,2}/|/)?[\w.-]+(?:/[\w.-]+)*\.[A-Za-z0-9]{1,8})(?![\w/])")
+
+
+@contextmanager
+def file_lock(lock_path: Path) -> Iterator[None]:
+    """进程间互斥锁（fcntl 不可用时退化为无锁）"""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _atomic_write_bytes(file_path: Path, content: bytes) -> None:
+    """原子写入文件"""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=".tmp_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class BlobStore:
+    """内容寻址 blob 存储（sha256 命名，gzip 压缩，自动去重）"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.gz"
+
+    def put(self, content: bytes) -> str:
+        """写入内容并返回 sha256；内容已存在时不重复写入"""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path_for(digest)
+        if not path.exists():
+            _atomic_write_bytes(path, gzip.compress(content, compresslevel=6))
+        return digest
+
+    def put_text(self, text: str) -> tuple[str, int]:
+        """
+        分片写入文本（先哈希、不存在时再压缩写入，峰值内存与分片大小相关）
+
+        Returns:
+            (sha256, UTF-8 字节数)
+        """
+        return self.put_stream(lambda: (
+            text[start:start + TEXT_CHUNK_CHARS].encode("utf-8")
+            for start in range(0, len(text), TEXT_CHUNK_CHARS)
+        ))
+
+    def put_stream(self, chunks: Callable[[], Iterable[bytes]]) -> tuple[str, int]:
+        """
+        分块写入内容（如落盘的大输出），两遍遍历：先哈希、不存在时再压缩写入
+
+        Args:
+            chunks: 每次调用返回一个新的分块迭代器
+
+        Returns:
+            (sha256, 字节数)
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        for piece in chunks():
+            hasher.update(piece)
+            size += len(piece)
+        digest = hasher.hexdigest()
+
+        path = self.path_for(digest)
+        if path.exists():
+            return digest, size
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw_file:
+                with gzip.GzipFile(fileobj=raw_file, mode="wb", compresslevel=6) as gz:
+                    for piece in chunks():
+                        gz.write(piece)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """读取内容（不存在或损坏时返回 None）"""
+        try:
+            return gzip.decompress(self.path_for(digest).read_bytes())
+        except (OSError, EOFError, gzip.BadGzipFile):
+            return None
+
+    def exists(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+
+class OutputHistory:
+    """节点输出历史（原文存于 BlobStore，历史文件只记录引用）"""
+
+    def __init__(self, outputs_dir: Path, blobs: BlobStore, max_entries: int = 50):
+        self.outputs_dir = outputs_dir
+        self.blobs = blobs
+        self.max_entries = max_entries
+
+    def path_for(self, node_name: str) -> Path:
+        return self.outputs_dir / f"{node_name}.history.json"
+
+    def load(self, node_name: str) -> list[dict]:
+        try:
+            history = json.loads(self.path_for(node_name).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return []
+        return history if isinstance(history, list) else []
+
+    def append(self, node_name: str, entry: dict) -> None:
+        """追加一条记录（超过上限时丢弃最早的记录）"""
+        history = self.load(node_name)
+        history.append(entry)
+        history = history[-self.max_entries:]
+        _atomic_write_bytes(
+            self.path_for(node_name),
+            json.dumps(history, ensure_ascii=False, indent=2).encode("utf-8"),
+        )
+
+    def read(self, node_name: str, index: int = -1) -> Optional[tuple[dict, str]]:
+        """
+        读取某次调用的原始输出
+
+        Args:
+            index: 历史记录下标（默认最近一次，支持负数）
+
+        Returns:
+            (记录, 原文)；不存在时返回 None
+        """
+        history = self.load(node_name)
+        try:
+            entry = history[index]
+        except IndexError:
+            return None
+        content = self.blobs.get(entry.get("blob", ""))
+        if content is None:
+            return None
+        return entry, content.decode("utf-8")
+
+    def collect_garbage(self) -> int:
+        """删除不再被任何历史记录引用的 blob，返回删除数量"""
+        referenced = set()
+        for history_file in self.outputs_dir.glob("*.history.json"):
+            try:
+                history = json.loads(history_file.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            referenced.update(entry.get("blob") for entry in history if isinstance(entry, dict))
+
+        removed = 0
+        for blob_path in self.blobs.root.glob("*/*.gz"):
+            if blob_path.name[:-3] not in referenced:
+                try:
+                    blob_path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def find_referenced_files(prompt: str, project_dir: Path) -> list[Path]:
+    """找出 prompt 中引用且实际存在于项目目录内的文件"""
+    files = []
+    seen = set()
+    project_root = project_dir.resolve()
+    for match in _PATH_PATTERN.finditer(prompt or ""):
+        candidate = Path(match.group(1))
+        path = candidate if candidate.is_absolute() else project_dir / candidate
+        try:
+            resolved = path.resolve()
+        except OSError:
+            continue
+        if resolved in seen or not resolved.is_file():
+            continue
+        if project_root not in resolved.parents:
+            continue
+        seen.add(resolved)
+        files.append(resolved)
+    return files
+
+
+def _file_digest(path: Path) -> str:
+    """文件内容的 sha256（分块读取）"""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def find_node_definition_files(subagent_type: Optional[str], project_dir: Path) -> list[Path]:
+    """
+    节点定义文件：.claude/agents/{node}.md 及其 frontmatter 中 input_contract / output_contract
+    指向的契约文件（内置 subagent 类型没有 Agent 文件时返回空列表）
+    """
+    if not subagent_type:
+        return []
+    claude_dir = project_dir / ".claude"
+    agent_file = claude_dir / "agents" / f"{subagent_type}.md"
+    try:
+        content = agent_file.read_text(encoding="utf-8")
+    except (OSError, ValueError):
+        return []
+
+    files = [agent_file]
+    if content.startswith("---"):
+        frontmatter = content[3:].partition("\n---")[0]
+        for contract_name in sorted(set(_CONTRACT_FIELD_PATTERN.findall(frontmatter))):
+            for suffix in (".yaml", ".json"):
+                contract_file = claude_dir / "contracts" / f"{contract_name}{suffix}"
+                if contract_file.is_file():
+                    files.append(contract_file)
+                    break
+    return files
+
+
+def compute_input_hash(tool_input: dict, project_dir: Path) -> str:
+    """
+    计算 Task 调用的输入哈希
+
+    组成：节点类型（subagent_type）、模型、完整 prompt，
+    prompt 中引用的每个项目内文件的相对路径和内容哈希，
+    以及节点 Agent 定义（系统提示、技能、契约声明）和其契约文件的内容哈希，
+    修改 Agent 或收紧契约后不再复用旧输出。
+
+    prompt 中引用的目录（如 src/）不计入：目录内容变化不会使缓存失效。
+    """
+    prompt = tool_input.get("prompt", "") or ""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({
+        "subagent_type": tool_input.get("subagent_type"),
+        "model": tool_input.get("model"),
+        "prompt": prompt,
+    }, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+    project_root = project_dir.resolve()
+    for path in sorted(find_referenced_files(prompt, project_dir)):
+        hasher.update(f"\n{path.relative_to(project_root)}:{_file_digest(path)}".encode("utf-8"))
+    for path in find_node_definition_files(tool_input.get("subagent_type"), project_dir):
+        hasher.update(f"\ndefinition:{path.relative_to(project_dir)}:{_file_digest(path)}".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class NodeCache:
+    """节点结果缓存（TTL + 总大小上限，LRU 淘汰）"""
+
+    def __init__(self, root: Path, ttl_seconds: float, max_bytes: int):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.blobs = BlobStore(root / "blobs")
+        self.index_file = root / "index.json"
+        self.lock_file = root / "index.lock"
+
+    def _load_index(self) -> dict:
+        try:
+            return json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index: dict) -> None:
+        _atomic_write_bytes(self.index_file, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        查找缓存的节点输出
+
+        Returns:
+            节点输出原文；未命中、已过期或 blob 缺失时返回 None
+        """
+        with file_lock(self.lock_file):
+            index = self._load_index()
+            entry = index.get(key)
+            if not entry:
+                return None
+            now = time.time()
+            if now - entry.get("created", 0) > self.ttl_seconds:
+                return None
+            content = self.blobs.get(entry["blob"])
+            if content is None:
+                index.pop(key, None)
+                self._save_index(index)
+                return None
+            entry["last_used"] = now
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._save_index(index)
+        return content.decode("utf-8")
+
+    def store(self, key: str, node_name: str, output: str) -> None:
+        """写入缓存并按需淘汰"""
+        self.store_stream(key, node_name, lambda: (output.encode("utf-8"),))
+
+    def store_stream(self, key: str, node_name: str, chunks: Callable[[], Iterable[bytes]]) -> None:
+        """分块写入缓存（chunks 同 BlobStore.put_stream）"""
+        with file_lock(self.lock_file):
+            digest, size = self.blobs.put_stream(chunks)
+            index = self._load_index()
+            now = time.time()
+            index[key] = {
+                "node": node_name,
+                "blob": digest,
+                "size": size,
+                "created": now,
+                "last_used": now,
+                "hits": 0,
+            }
+            self._evict(index, now)
+            self._save_index(index)
+
+    def _evict(self, index: dict, now: float) -> None:
+        """淘汰过期条目，再按最近使用时间淘汰直到总大小不超过上限"""
+        for key in [k for k, e in index.items() if now - e.get("created", 0) > self.ttl_seconds]:
+            del index[key]
+
+        total = sum(e.get("size", 0) for e in index.values())
+        for key, entry in sorted(index.items(), key=lambda item: item[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= entry.get("size", 0)
+            del index[key]
+
+        # 删除不再被引用的 blob
+        referenced = {e["blob"] for e in index.values()}
+        for blob_path in self.blobs.root.glob("*/*.gz"):
+            if blob_path.name[:-3] not in referenced:
+                try:
+                    blob_path.unlink()
+                except OSError:
+                    pass
+
+    def stats(self) -> dict[str, Any]:
+        """缓存统计"""
+        index = self._load_index()
+        return {
+            "entries": len(index),
+            "bytes": sum(e.get("size", 0) for e in index.values()),
+            "hits": sum(e.get("hits", 0) for e in index.values()),
+        }
+
+
+def canonical_hash(value: Any) -> str:
+    """JSON 规范化（键排序、紧凑分隔符）后的 sha256"""
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ValidationCache:
+    """契约校验结果缓存（条目数上限，LRU 淘汰；条目只含校验结论和错误详情，体积很小）"""
+
+    def __init__(self, root: Path, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.index_file = root / "validations.json"
+        self.lock_file = root / "validations.lock"
+
+    def _load(self) -> dict:
+        try:
+            index = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        return index
+
+    def _save(self, index: dict) -> None:
+        _atomic_write_bytes(self.index_file, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def lookup(self, key: str) -> Optional[list[dict]]:
+        """
+        查找缓存的校验结果
+
+        索引以原子替换写入，查找时不加锁直接读取；未命中不写文件（命中/未命中由调用方
+        记入日志和指标），命中时才更新条目的 last_used 和 hits，供 LRU 淘汰使用。
+
+        Returns:
+            错误列表（通过时为空列表），未命中时为 None
+        """
+        entry = self._load()["entries"].get(key)
+        if entry is None:
+            return None
+        with file_lock(self.lock_file):
+            index = self._load()
+            current = index["entries"].get(key)
+            if current is not None:
+                current["last_used"] = time.time()
+                current["hits"] = current.get("hits", 0) + 1
+                self._save(index)
+        return entry["errors"]
+
+    def store(self, key: str, contract_name: str, errors: list[dict]) -> None:
+        """写入校验结果，超过条目上限时淘汰最久未使用的条目"""
+        with file_lock(self.lock_file):
+            index = self._load()
+            entries = index["entries"]
+            now = time.time()
+            entries[key] = {
+                "contract": contract_name,
+                "errors": errors,
+                "created": now,
+                "last_used": now,
+                "hits": 0,
+            }
+            if len(entries) > self.max_entries:
+                ordered = sorted(entries, key=lambda k: entries[k].get("last_used", 0))
+                for stale in ordered[:len(entries) - self.max_entries]:
+                    del entries[stale]
+            self._save(index)
+
+    def stats(self) -> dict[str, Any]:
+        """缓存统计"""
+        entries = self._load()["entries"]
+        return {"entries": len(entries), "hits": sum(e.get("hits", 0) for e in entries.values())}
+
+
+class ContractRetries:
+    """
+    契约校验重试计数（每次运行按会话、节点、agent 实例分别计数）
+
+    每次阻止记录一次失败及其错误；失败次数超过重试上限时状态变为 exhausted，
+    节点完成（PostToolUse）或工作流结束（Stop）时由 wf-state 取出并记为失败
+    """
+
+    # 工作流输出校验（Stop）使用的节点名
+    WORKFLOW = "(workflow)"
+    # 每次失败保留的错误条数
+    MAX_ERRORS_PER_ATTEMPT = 5
+
+    def __init__(self, root: Path):
+        self.index_file = root / "contract-retries.json"
+        self.lock_file = root / "contract-retries.lock"
+
+    @staticmethod
+    def _key(session_id: Optional[str], node: str, agent: Optional[str]) -> str:
+        return f"{session_id or '-'}|{node}|{agent or '-'}"
+
+    def _load(self) -> dict:
+        try:
+            index = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        return index
+
+    def _save(self, index: dict) -> None:
+        _atomic_write_bytes(self.index_file, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def record_failure(
+        self,
+        session_id: Optional[str],
+        node: str,
+        agent: Optional[str],
+        contract_name: str,
+        errors: list[dict],
+        max_retries: int,
+    ) -> dict:
+        """
+        记录一次校验失败
+
+        Returns:
+            更新后的条目（attempts 为累计失败次数，errors 为每次失败的错误，
+            status 为 retrying 或 exhausted）
+        """
+        key = self._key(session_id, node, agent)
+        with file_lock(self.lock_file):
+            index = self._load()
+            entry = index["entries"].setdefault(key, {
+                "session": session_id,
+                "node": node,
+                "agent": agent,
+                "contract": contract_name,
+                "attempts": 0,
+                "status": "retrying",
+                "errors": [],
+            })
+            entry["attempts"] += 1
+            entry["updated"] = time.time()
+            entry["errors"].append({
+                "attempt": entry["attempts"],
+                "errors": errors[:self.MAX_ERRORS_PER_ATTEMPT],
+            })
+            if entry["attempts"] > max_retries:
+                entry["status"] = "exhausted"
+            self._save(index)
+        return entry
+
+    def clear(self, session_id: Optional[str], node: str, agent: Optional[str]) -> None:
+        """校验通过后清除计数"""
+        if not self.index_file.exists():
+            return
+        key = self._key(session_id, node, agent)
+        with file_lock(self.lock_file):
+            index = self._load()
+            if index["entries"].pop(key, None) is not None:
+                self._save(index)
+
+    def pop_exhausted(self, session_id: Optional[str], node: str) -> Optional[dict]:
+        """取出并删除该节点一个已耗尽重试的条目（没有时返回 None）"""
+        if not self.index_file.exists():
+            return None
+        with file_lock(self.lock_file):
+            index = self._load()
+            for key, entry in index["entries"].items():
+                if (entry.get("status") == "exhausted" and entry.get("node") == node
+                        and entry.get("session") == session_id):
+                    del index["entries"][key]
+                    self._save(index)
+                    return entry
+        return None
+
+    def reset(self) -> None:
+        """清除全部计数（新运行开始时）"""
+        try:
+            self.index_file.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+wf_trace.py - 工作流执行时间线记录与导出
+
+Hook 脚本每次处理事件时向 `.context/spans.jsonl` 追加一行 span 记录
+（Hook 处理耗时、契约校验、校验脚本子进程），wf-state.py 在状态文件中
+记录工作流和每次节点调用（按 tool_use_id 区分）的精确起止时间。
+
+`wf-state.py --export-trace` 将两者合并为 Chrome Trace Event JSON，
+可在 Perfetto (ui.perfetto.dev) 或 chrome://tracing 中打开：
+- 进程「工作流」: 工作流总时长 + 节点调用，并行的节点实例各占一条轨道
+- 进程「Hooks」: 每个 Hook 脚本一条轨道，校验步骤嵌套在 Hook 处理之内
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+
+# spans 文件超过该大小时，在新工作流启动时轮转
+SPANS_ROTATE_BYTES = 10 * 1024 * 1024
+
+WORKFLOW_PID = 1
+HOOKS_PID = 2
+
+
+def get_spans_file() -> Path:
+    """获取 spans 文件路径"""
+    project_dir = os.environ.get("CLAUDE_PROJECT_DIR", "")
+    return Path(project_dir or Path.cwd()) / ".context" / "spans.jsonl"
+
+
+def record_span(name: str, cat: str, start_ts: float, end_ts: float, **args: Any) -> None:
+    """
+    追加一条 span 记录（单次 O_APPEND 写入，多进程并发安全；失败不影响主流程）
+
+    Args:
+        name: span 名称
+        cat: 分类（hook / validation）
+        start_ts: 开始时间（epoch 秒）
+        end_ts: 结束时间（epoch 秒）
+        **args: 附加信息，导出时放入 trace 事件的 args
+    """
+    entry = {
+        "name": name,
+        "cat": cat,
+        "ts": round(start_ts, 6),
+        "dur": round(max(end_ts - start_ts, 0.0), 6),
+        "pid": os.getpid(),
+    }
+    if args:
+        entry["args"] = args
+    try:
+        spans_file = get_spans_file()
+        spans_file.parent.mkdir(parents=True, exist_ok=True)
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(spans_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except Exception:
+        pass
+
+
+def rotate_spans() -> None:
+    """spans 文件过大时轮转为 spans.prev.jsonl"""
+    spans_file = get_spans_file()
+    try:
+        if spans_file.stat().st_size > SPANS_ROTATE_BYTES:
+            os.replace(spans_file, spans_file.with_name("spans.prev.jsonl"))
+    except OSError:
+        pass
+
+
+def load_spans(since: Optional[float] = None, until: Optional[float] = None) -> list[dict]:
+    """读取时间范围内的 span 记录"""
+    spans = []
+    try:
+        with open(get_spans_file(), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                ts = span.get("ts", 0)
+                if since is not None and ts + span.get("dur", 0) < since:
+                    continue
+                if until is not None and ts > until:
+                    continue
+                spans.append(span)
+    except OSError:
+        pass
+    return spans
+
+
+def assign_lanes(intervals: list[tuple[float, float]]) -> list[int]:
+    """
+    为区间分配轨道编号，使同一轨道上的区间互不重叠（贪心区间划分）
+
+    Returns:
+        与输入顺序对应的轨道编号（从 0 开始）
+    """
+    lanes_end: list[float] = []
+    result = [0] * len(intervals)
+    for index in sorted(range(len(intervals)), key=lambda i: intervals[i][0]):
+        start, end = intervals[index]
+        for lane, lane_end in enumerate(lanes_end):
+            if lane_end <= start:
+                lanes_end[lane] = end
+                result[index] = lane
+                break
+        else:
+            lanes_end.append(end)
+            result[index] = len(lanes_end) - 1
+    return result
+
+
+def _metadata(name: str, pid: int, tid: Optional[int], value: str) -> dict:
+    event = {"name": name, "ph": "M", "pid": pid, "args": {"name": value}}
+    if tid is not None:
+        event["tid"] = tid
+    return event
+
+
+def build_chrome_trace(state: dict, spans: list[dict], now: float) -> dict:
+    """
+    构建 Chrome Trace Event JSON
+
+    Args:
+        state: wf-state 的状态字典
+        spans: load_spans() 返回的 span 记录
+        now: 当前时间（未结束的工作流/节点以此作为结束时间）
+    """
+    origin = state.get("started_ts") or min((s["ts"] for s in spans), default=now)
+
+    def us(ts: float) -> int:
+        return int(round((ts - origin) * 1_000_000))
+
+    events: list[dict] = [
+        _metadata("process_name", WORKFLOW_PID, None, f"工作流 {state.get('workflow') or ''}".strip()),
+        _metadata("process_name", HOOKS_PID, None, "Hooks"),
+        _metadata("thread_name", WORKFLOW_PID, 0, "workflow"),
+    ]
+
+    # 工作流总时长
+    if state.get("started_ts"):
+        end = state.get("completed_ts") or now
+        events.append({
+            "name": state.get("workflow") or "workflow",
+            "cat": "workflow",
+            "ph": "X",
+            "pid": WORKFLOW_PID,
+            "tid": 0,
+            "ts": 0,
+            "dur": us(end),
+            "args": {"status": state.get("status"), "progress": state.get("progress")},
+        })
+
+    # 节点调用：每个并行实例一条轨道
+    attempts = []
+    for node_name, node_info in (state.get("nodes") or {}).items():
+        for number, attempt in enumerate(node_info.get("attempts") or [], start=1):
+            if not attempt.get("started_ts"):
+                continue
+            attempts.append((node_name, number, attempt))
+
+    lanes = assign_lanes([
+        (attempt["started_ts"], attempt.get("completed_ts") or now)
+        for _, _, attempt in attempts
+    ])
+    for lane in sorted(set(lanes)):
+        events.append(_metadata("thread_name", WORKFLOW_PID, lane + 1, f"节点实例 {lane + 1}"))
+
+    for (node_name, number, attempt), lane in zip(attempts, lanes):
+        end = attempt.get("completed_ts") or now
+        events.append({
+            "name": node_name,
+            "cat": "node",
+            "ph": "X",
+            "pid": WORKFLOW_PID,
+            "tid": lane + 1,
+            "ts": us(attempt["started_ts"]),
+            "dur": max(us(end) - us(attempt["started_ts"]), 1),
+            "args": {
+                "attempt": number,
+                "status": attempt.get("status", "running"),
+                "tool_use_id": attempt.get("id"),
+            },
+        })
+
+    # Hook 与校验 span：同一进程的 span 放在同一轨道（校验嵌套在 Hook 处理内），
+    # 同一脚本的并发调用分配到不同轨道
+    invocations: dict[tuple, list[dict]] = {}
+    for span in spans:
+        script = (span.get("args") or {}).get("script", "hook")
+        invocations.setdefault((script, span.get("pid")), []).append(span)
+
+    keys = list(invocations)
+    tids: dict[tuple, int] = {}
+    for script in sorted({key[0] for key in keys}):
+        script_keys = [key for key in keys if key[0] == script]
+        script_lanes = assign_lanes([
+            (
+                min(s["ts"] for s in invocations[key]),
+                max(s["ts"] + s.get("dur", 0) for s in invocations[key]),
+            )
+            for key in script_keys
+        ])
+        for key, lane in zip(script_keys, script_lanes):
+            track = (script, lane)
+            if track not in tids:
+                tids[track] = len(tids) + 1
+                label = script if lane == 0 else f"{script} #{lane + 1}"
+                events.append(_metadata("thread_name", HOOKS_PID, tids[track], label))
+            for span in invocations[key]:
+                events.append({
+                    "name": span.get("name", ""),
+                    "cat": span.get("cat", "hook"),
+                    "ph": "X",
+                    "pid": HOOKS_PID,
+                    "tid": tids[track],
+                    "ts": us(span["ts"]),
+                    "dur": max(int(round(span.get("dur", 0) * 1_000_000)), 1),
+                    "args": span.get("args", {}),
+                })
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+wf_validation_args.py - 契约校验参数与超时预算
+
+contract-validator.py 的命令行参数和单次事件的超时预算。单独成模块是为了让
+wf-hook.py 构建参数解析器、开始计时时不必加载 contract-validator.py
+（及其依赖的 jsonschema、wf_columnar、wf_schema_compiler、wf_skeleton）：
+未指定 --contract / --inject-skeleton 的事件只更新状态，不应为校验付出导入开销。
+
+本模块只依赖标准库。contract-validator.py 导入并沿用这里的定义。
+"""
+
+import argparse
+import time
+from typing import Optional
+
+
+# 超时预算
+DEFAULT_HOOK_TIMEOUT = 30.0  # 生成的 Hook 配置中的 timeout（秒）
+DEADLINE_MARGIN = 2.0  # 留给解释器启动、写日志指标、输出结果的时间（秒）
+
+DEFAULT_MAX_RETRIES = 3  # SubagentStop / Stop 校验未通过时最多阻止的次数
+
+# --inject-skeleton 修改 Task prompt 时随 updatedInput 返回的权限决定
+# ask: 由用户确认修改后的调用；allow: 自动批准（绕过 Task 的 ask / deny 权限规则，须明确选择）
+SKELETON_PERMISSIONS = ("ask", "allow")
+
+
+class ValidationDeadline:
+    """
+    单次 Hook 事件的超时预算
+
+    各阶段结束时调用 mark() 记录耗时；预算用尽后未执行的校验层记入 skipped，
+    由 run_contract_layers 按契约的 on_timeout 决定结论
+    """
+
+    def __init__(self, hook_timeout: float = DEFAULT_HOOK_TIMEOUT, started: Optional[float] = None):
+        """
+        Args:
+            hook_timeout: Hook 配置的 timeout（秒）
+            started: 计时起点（time.perf_counter()，默认为当前时间）
+        """
+        self.hook_timeout = hook_timeout
+        self.budget = max(hook_timeout - DEADLINE_MARGIN, 0.0)
+        self.started = time.perf_counter() if started is None else started
+        self._last_mark = self.started
+        self.phases: dict[str, float] = {}  # {阶段: 耗时秒数}
+        self.skipped: list[str] = []  # 因超时未执行或未完成的校验层
+        self.policy: Optional[str] = None  # 超时后实际采用的 on_timeout
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def remaining(self) -> float:
+        return self.budget - self.elapsed()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def mark(self, phase: str) -> None:
+        """记录自上一次 mark 以来的阶段耗时"""
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + now - self._last_mark, 4)
+        self._last_mark = now
+
+    def note(self) -> str:
+        """预算用尽时附加到放行提示中的说明"""
+        if not self.skipped:
+            return ""
+        return (
+            f"（超出 {self.hook_timeout:g} 秒 Hook 超时预算，未完成: {', '.join(self.skipped)}；"
+            f"on_timeout={self.policy}）"
+        )
+
+
+def add_validation_arguments(parser: argparse.ArgumentParser) -> None:
+    """契约校验参数（contract-validator.py、wf-hook.py 共用）"""
+    parser.add_argument("--contract", type=str, help="契约名称")
+    parser.add_argument("--node", type=str, help="节点名称")
+    parser.add_argument(
+        "--no-validation-cache",
+        action="store_true",
+        help="不使用校验结果缓存（.context/cache/validations.json）",
+    )
+    parser.add_argument(
+        "--hook-timeout",
+        type=float,
+        default=DEFAULT_HOOK_TIMEOUT,
+        metavar="SECONDS",
+        help=f"Hook 配置的 timeout，校验在此预算内完成，超出时按契约 on_timeout 处理（默认 {DEFAULT_HOOK_TIMEOUT:g}）",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        metavar="N",
+        help=f"SubagentStop / Stop 校验未通过时最多阻止 N 次，之后放行并标记失败"
+             f"（契约 max_retries 优先，默认 {DEFAULT_MAX_RETRIES}）",
+    )
+    parser.add_argument(
+        "--inject-skeleton",
+        nargs="?",
+        const="ask",
+        choices=SKELETON_PERMISSIONS,
+        metavar="ask|allow",
+        help="PreToolUse (Task) 时把节点输出契约的骨架和关键约束追加到 Task prompt。"
+             "修改 prompt 必须同时给出权限决定：ask（默认）由用户确认；"
+             "allow 自动批准 Task 调用，会绕过 Task 的 ask / deny 权限规则",
+    )